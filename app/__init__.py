@@ -5,8 +5,20 @@ from flask_login import LoginManager, current_user
 from datetime import datetime
 # Убедитесь, что импортированы ВСЕ модели
 from .models import db, User, Role, VisitLog
+from . import bootstrap, search, user_import, compression, templating
 from .config import Config
-import os
+from .visit_buffer import visit_buffer
+from .identity import user_cache
+from .roles import role_registry
+from .visit_rules import visit_rules
+from .visit_paths import path_dictionary, MAX_PATH_LENGTH
+from .db_profile import init_sqlite_profile, prepare_engine_options
+from .analytics import init_analytics_bind, analytics_snapshot
+from .metrics import metrics, stats_collector
+from .jobs import job_queue
+from .assets import assets
+from .live import live_feed
+from .logs.report_cache import report_cache
 
 login_manager = LoginManager()
 login_manager.login_view = 'views.login'
@@ -16,29 +28,62 @@ login_manager.login_message_category = 'warning' # Категория для fla
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Берем снимок пользователя с ролью из кэша, в БД идем только при промахе
+    return user_cache.load(int(user_id))
 
 # Функция для логирования посещений
 def log_visit():
-    # Исключаем логирование запросов к статическим файлам и favicon
-    if request.endpoint and ('static' not in request.endpoint) and request.path != '/favicon.ico':
-        user_id = current_user.id if current_user.is_authenticated else None
-        # Ограничим длину path, чтобы избежать ошибок БД
-        path = request.path[:255] 
-        visit = VisitLog(path=path, user_id=user_id)
-        try:
-            db.session.add(visit)
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            print(f"Error logging visit: {e}") # Логгирование ошибки в консоль сервера
+    # Что записывать, решают правила из VISIT_LOG_RULES (статика, служебные эндпоинты, роботы)
+    if not request.endpoint:
+        return
+    path = request.path
+    weight = visit_rules.decide(request.endpoint, path, request.headers.get('User-Agent', ''))
+    if weight is None:
+        return
+    user_id = current_user.id if current_user.is_authenticated else None
+    # Запись не пишется в БД в рамках запроса, а ставится в очередь фонового потока;
+    # путь и шаблон маршрута заменяются номерами из словаря visit_paths при записи пачки.
+    # Длину path ограничиваем, чтобы избежать ошибок БД
+    created_at = datetime.utcnow()
+    visit_buffer.add({'path': path[:MAX_PATH_LENGTH], 'route': request.url_rule.rule, 'user_id': user_id,
+                      'created_at': created_at, 'sample_weight': weight})
+    # Лента /logs/live получает посещение из памяти, без чтения журнала из БД
+    live_feed.publish({'path': path[:MAX_PATH_LENGTH], 'route': request.url_rule.rule, 'user_id': user_id,
+                       'username': current_user.username if user_id is not None else None,
+                       'weight': weight, 'at': created_at.isoformat(timespec='seconds')}, weight)
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
+    prepare_engine_options(app)
     db.init_app(app)
+    init_analytics_bind(app)
+    init_sqlite_profile(app)
+    analytics_snapshot.init_app(app)
     login_manager.init_app(app)
+    visit_buffer.init_app(app)
+    path_dictionary.init_app(app)
+    user_cache.init_app(app)
+    role_registry.init_app(app)
+    report_cache.init_app(app)
+    visit_rules.init_app(app)
+    # Метрики регистрируются раньше log_visit, чтобы время запроса включало все хуки
+    metrics.init_app(app)
+    job_queue.init_app(app)
+    assets.init_app(app)
+    compression.init_app(app)
+    templating.init_app(app)
+    live_feed.init_app(app)
+    metrics.add_collector(stats_collector('visit_log_buffer', visit_buffer.stats, 'Visit log write buffer.'))
+    metrics.add_collector(stats_collector('user_cache', user_cache.stats, 'Current user identity cache.'))
+    metrics.add_collector(stats_collector('role_registry', role_registry.stats, 'Process role registry.'))
+    metrics.add_collector(stats_collector('visit_rules', visit_rules.stats, 'Visit logging rules.'))
+    metrics.add_collector(stats_collector('visit_paths', path_dictionary.stats, 'Visit path dictionary cache.'))
+    metrics.add_collector(stats_collector('report_cache', report_cache.stats, 'Rendered report cache.'))
+    metrics.add_collector(stats_collector('analytics_snapshot', analytics_snapshot.stats, 'Read-only report snapshot.'))
+    metrics.add_collector(stats_collector('jobs', job_queue.stats, 'Background jobs of this process.'))
+    metrics.add_collector(stats_collector('live_feed', live_feed.stats, 'Live visit feed of this process.'))
     
     # Регистрация обработчика before_request для логирования
     app.before_request(log_visit)
@@ -51,54 +96,25 @@ def create_app(config_class=Config):
     from .logs import logs_bp as logs_blueprint
     app.register_blueprint(logs_blueprint, url_prefix='/logs') # Добавляем префикс /logs
 
-    # Создание таблиц в базе данных и начальные данные
-    with app.app_context():
-        # Проверяем существование файла БД перед созданием таблиц
-        # Это важно для платформ вроде Render с эфемерной ФС
-        db_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
-        if not os.path.exists(db_path):
-             print(f"Database file not found at {db_path}. Creating tables...")
-             db.create_all()
-             print("Tables created.")
-        else:
-             # Если файл есть, можно все равно вызвать create_all - она безопасна
-             # но можно и пропустить для скорости
-             db.create_all() # Гарантирует создание новых таблиц, если их нет
-             print("Checked database schema.")
+    # Счетчики отчетов обновляются в фоновом потоке буфера после записи очередной пачки посещений.
+    # Без буфера (VISIT_LOG_BUFFERED=0) запись идет в запросе, и догонять счетчики там же слишком
+    # дорого для каждой страницы: их обновляет `flask logs refresh-rollups` по расписанию
+    if visit_buffer.enabled:
+        from .logs.rollups import refresh_rollups
+        visit_buffer.on_flush(refresh_rollups)
 
+    # Схема и начальные данные создаются командой `flask bootstrap` один раз при развертывании,
+    # а не при старте каждого воркера (см. app/bootstrap.py)
+    bootstrap.init_app(app)
+    search.init_app(app)
+    user_import.init_app(app)
+    if app.config.get('TEMPLATE_PRECOMPILE'):
+        # Шаблоны блюпринтов видны только после их регистрации
+        count, elapsed = templating.precompile_templates(app)
+        app.logger.debug('Precompiled %d template(s) in %.3fs', count, elapsed)
+    if app.config.get('AUTO_BOOTSTRAP'):
+        # Для платформ с эфемерной ФС (Render), где нет отдельного шага развертывания
+        with app.app_context():
+            bootstrap.bootstrap_database(log=app.logger.info)
 
-        # Создание ролей, если их нет
-        if not Role.query.first():
-            print("Creating default roles...")
-            roles = [
-                {'name': 'Admin', 'description': 'Administrator with full access'},
-                {'name': 'User', 'description': 'Regular user with limited access'}
-            ]
-            for role_data in roles:
-                role = Role(**role_data)
-                db.session.add(role)
-            db.session.commit()
-            print("Default roles created.")
-            
-        # Создание первого пользователя-администратора, если НЕТ ВООБЩЕ пользователей
-        if not User.query.first():
-             print("Creating default admin user...")
-             admin_role = Role.query.filter_by(name='Admin').first()
-             if admin_role: # Убедимся, что роль Admin создана
-                 admin_user = User(
-                     username='admin',
-                     first_name='Администратор',
-                     last_name='Системы',
-                     role=admin_role # Присваиваем роль
-                 )
-                 admin_user.password = 'Admin123!' # Используется сеттер для хеширования
-                 db.session.add(admin_user)
-                 db.session.commit()
-                 print('--- Default Admin User Created ---')
-                 print('Login: admin')
-                 print('Password: Admin123!')
-                 print('----------------------------------')
-             else:
-                 print("ERROR: Could not find 'Admin' role to create admin user.")
-    
     return app
\ No newline at end of file
@@ -0,0 +1,193 @@
+# app/analytics.py
+# База журнала посещений и отчетов. Модели журнала (VisitLog, словарь путей, счетчики,
+# сводки, архив) объявлены с __bind_key__ = 'analytics':
+# - по умолчанию это та же база, что и основная: ключ указывает на тот же движок;
+# - с ANALYTICS_DATABASE_URL журнал и отчеты живут в отдельной базе, и длинные выгрузки
+#   не конкурируют со входом пользователей за основную.
+# Дополнительно отчеты могут читать снимок аналитической базы только для чтения
+# (ANALYTICS_SNAPSHOT_PATH). Снимок обновляет задание `flask logs snapshot` (по cron или
+# с --every): оно догоняет счетчики и копирует базу через backup API SQLite. Копирование
+# держит только читающую транзакцию (в режиме WAL она не мешает записи), а отчеты
+# со снимка не берут блокировок в рабочей базе вовсе.
+# Если журнал уже накоплен в основной базе, при включении ANALYTICS_DATABASE_URL его переносит
+# `flask logs move-to-analytics` (при остановленных воркерах): иначе отчеты читали бы пустую базу.
+import os
+import sqlite3
+import time
+
+from flask import g
+from sqlalchemy import create_engine, func, inspect, literal, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from .models import db
+from .stamps import touch_stamp, read_stamp
+
+ANALYTICS_BIND = 'analytics'
+SNAPSHOT_STAMP = 'analytics-snapshot.version'
+MOVE_BATCH_SIZE = 5000
+
+
+def init_analytics_bind(app):
+    # Вызывается сразу после db.init_app. Без отдельного URL ключ 'analytics' получает
+    # основной движок, а не второй пул к тому же файлу SQLite: иначе одна сессия, пишущая
+    # в журнал и в users (удаление пользователя), ждала бы блокировку сама у себя
+    with app.app_context():
+        engines = db.engines
+        if ANALYTICS_BIND not in engines:
+            engines[ANALYTICS_BIND] = engines[None]
+
+
+def unique_engines():
+    # Движки без повторов (ключ 'analytics' может указывать на основной)
+    return list(dict.fromkeys(db.engines.values()))
+
+
+def analytics_is_separate():
+    return db.engines[ANALYTICS_BIND] is not db.engines[None]
+
+
+def _tables_in_main_database():
+    # Таблицы журнала и отчетов, оставшиеся в основной базе
+    inspector = inspect(db.engines[None])
+    return [table for table in db.metadatas[ANALYTICS_BIND].sorted_tables if inspector.has_table(table.name)]
+
+
+def _has_rows(conn, table):
+    return conn.execute(select(literal(1)).select_from(table).limit(1)).first() is not None
+
+
+def pending_analytics_move():
+    # {таблица: строк} в основной базе, если отдельная аналитическая база еще пуста;
+    # отчеты этих строк не видят, пока их не перенесет move_to_analytics
+    if not analytics_is_separate():
+        return {}
+    tables = _tables_in_main_database()
+    with db.engines[ANALYTICS_BIND].connect() as conn:
+        if any(_has_rows(conn, table) for table in db.metadatas[ANALYTICS_BIND].sorted_tables
+               if inspect(conn).has_table(table.name)):
+            return {}
+    with db.engines[None].connect() as conn:
+        counts = {table.name: conn.execute(select(func.count()).select_from(table)).scalar() for table in tables}
+    return {name: count for name, count in counts.items() if count}
+
+
+def move_to_analytics(drop_source=False, batch_size=MOVE_BATCH_SIZE, log=print):
+    # Копирует таблицы журнала и отчетов из основной базы в аналитическую с теми же id,
+    # одной транзакцией в целевой базе; с drop_source удаляет их из основной после копирования
+    if not analytics_is_separate():
+        raise RuntimeError('ANALYTICS_DATABASE_URL is not configured')
+    source, target = db.engines[None], db.engines[ANALYTICS_BIND]
+    db.metadatas[ANALYTICS_BIND].create_all(target)
+    tables = _tables_in_main_database()
+
+    source_inspector = inspect(source)
+    for table in tables:
+        existing = {column['name'] for column in source_inspector.get_columns(table.name)}
+        missing = [column.name for column in table.columns if column.name not in existing]
+        if missing:
+            raise RuntimeError(f'{table.name} in the main database lacks column(s) {", ".join(missing)}: '
+                               f'run `flask migrate` without ANALYTICS_DATABASE_URL first')
+    with target.connect() as conn:
+        busy = [table.name for table in tables if _has_rows(conn, table)]
+    if busy:
+        raise RuntimeError(f'The analytics database already has rows in {", ".join(busy)}')
+
+    moved = {}
+    with source.connect() as src, target.begin() as dst:
+        for table in tables:
+            started = time.perf_counter()
+            count = 0
+            result = src.execution_options(yield_per=batch_size).execute(select(*table.columns))
+            for rows in result.partitions():
+                dst.execute(table.insert(), [dict(row._mapping) for row in rows])
+                count += len(rows)
+            moved[table.name] = count
+            log(f'{table.name}: copied {count} row(s) in {time.perf_counter() - started:.1f}s')
+
+    if drop_source:
+        with source.begin() as conn:
+            for table in reversed(tables):
+                table.drop(conn)
+        log(f'Dropped {len(tables)} table(s) from the main database')
+    return moved
+
+
+class AnalyticsSnapshot:
+    def __init__(self, app=None):
+        self.path = None
+        self.engine = None
+        self.copies = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config.get('ANALYTICS_SNAPSHOT_PATH') or None
+        self.engine = None
+        if self.path:
+            # Файл снимка заменяется целиком (os.replace) и не меняется на месте, поэтому
+            # открывается как неизменяемый; без пула - каждое соединение видит текущий файл
+            self.engine = create_engine(f'sqlite:///file:{self.path}?mode=ro&immutable=1&uri=true',
+                                        poolclass=NullPool)
+        app.teardown_appcontext(self._close_session)
+        app.extensions['analytics_snapshot'] = self
+
+    @property
+    def enabled(self):
+        return self.engine is not None
+
+    def session(self):
+        # Сессия для чтения отчетов: снимок, если он настроен и уже создан, иначе db.session
+        if not self.enabled or not os.path.exists(self.path):
+            return db.session
+        session = g.get('_analytics_snapshot_session')
+        if session is None:
+            session = g._analytics_snapshot_session = Session(bind=self.engine)
+        return session
+
+    def version(self):
+        return read_stamp(SNAPSHOT_STAMP) if self.enabled and os.path.exists(self.path) else None
+
+    def refresh(self):
+        # Копия аналитической базы во временный файл и атомарная замена снимка
+        if not self.enabled:
+            raise RuntimeError('ANALYTICS_SNAPSHOT_PATH is not configured')
+        engine = db.engines[ANALYTICS_BIND]
+        if engine.dialect.name != 'sqlite' or not engine.url.database:
+            raise RuntimeError('Snapshots are supported only for a file-based SQLite analytics database')
+
+        started = time.perf_counter()
+        tmp_path = self.path + '.tmp'
+        source = sqlite3.connect(engine.url.database)
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target)
+            # Снимок открывается только для чтения: журнал WAL ему не нужен
+            target.execute('PRAGMA journal_mode=DELETE')
+            target.commit()
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp_path, self.path)
+        touch_stamp(SNAPSHOT_STAMP)
+        self.copies += 1
+        return time.perf_counter() - started
+
+    def stats(self):
+        stamp = self.version()
+        age = time.time() - stamp / 1e9 if stamp is not None else None
+        return {'enabled': self.enabled, 'copies': self.copies,
+                'age_seconds': round(age, 1) if age is not None else None}
+
+    def _close_session(self, exc):
+        session = g.pop('_analytics_snapshot_session', None)
+        if session is not None:
+            session.close()
+
+
+analytics_snapshot = AnalyticsSnapshot()
+
+
+# Сессия, из которой читают отчеты (см. AnalyticsSnapshot.session)
+def report_session():
+    return analytics_snapshot.session()
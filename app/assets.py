@@ -0,0 +1,139 @@
+# app/assets.py
+# Статические файлы (app/templates/static) с отпечатком содержимого в имени.
+# `flask assets build` при развертывании копирует каждый файл в ASSETS_BUILD_DIR под именем
+# с хешем (css/style.3f2a9c1b04de.css), рядом кладет сжатую копию .gz для текстовых файлов
+# и записывает manifest.json: исходное имя -> имя с хешем.
+# Шаблоны получают ссылки через asset_url('css/style.css'):
+# - файл из манифеста отдается с Cache-Control: immutable на год - при изменении содержимого
+#   меняется имя, поэтому браузер не перепроверяет его при повторных посещениях;
+#   клиенту с Accept-Encoding: gzip отдается готовая сжатая копия без сжатия на лету;
+# - пока сборки нет (разработка), ссылка ведет на исходный файл, который браузер перепроверяет.
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import request, send_from_directory, url_for
+from flask.cli import AppGroup
+from werkzeug.utils import safe_join
+
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Что имеет смысл сжимать заранее (картинки и шрифты уже сжаты)
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.map', '.html')
+
+
+class AssetManifest:
+    def __init__(self, app=None):
+        self.source_dir = None
+        self.build_dir = None
+        self.manifest = {}
+        self.hashed = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.source_dir = app.config.get('ASSETS_SOURCE_DIR') or os.path.join(app.root_path, 'templates', 'static')
+        self.build_dir = app.config.get('ASSETS_BUILD_DIR') or os.path.join(app.instance_path, 'assets')
+        url_path = app.config.get('ASSETS_URL_PATH', '/assets')
+        self.load()
+        app.add_url_rule(f'{url_path}/<path:filename>', 'asset', self.send)
+        app.add_template_global(self.url, 'asset_url')
+        app.extensions['assets'] = self
+        app.cli.add_command(assets_cli)
+
+    def load(self):
+        # Манифест читается при старте процесса: сборка - шаг развертывания перед запуском воркеров
+        try:
+            with open(os.path.join(self.build_dir, MANIFEST_NAME), encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+        self.hashed = set(self.manifest.values())
+
+    def url(self, filename):
+        return url_for('asset', filename=self.manifest.get(filename, filename))
+
+    def send(self, filename):
+        if filename not in self.hashed:
+            # Исходный файл без отпечатка: браузер перепроверяет его по ETag/Last-Modified
+            response = send_from_directory(self.source_dir, filename, max_age=0)
+            response.cache_control.no_cache = True
+            return response
+
+        gz_path = safe_join(self.build_dir, filename + '.gz')
+        if gz_path and os.path.isfile(gz_path) and request.accept_encodings['gzip'] > 0:
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = send_from_directory(self.build_dir, filename + '.gz', mimetype=mimetype,
+                                           max_age=IMMUTABLE_MAX_AGE)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_from_directory(self.build_dir, filename, max_age=IMMUTABLE_MAX_AGE)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.immutable = True
+        return response
+
+    def build(self, clean=False, log=print):
+        # Копирует исходные файлы под именами с хешем; старые копии по умолчанию остаются,
+        # чтобы страницы, закэшированные до обновления, могли загрузить свои файлы
+        os.makedirs(self.build_dir, exist_ok=True)
+        manifest = {}
+        compressed = 0
+        for root, _, files in os.walk(self.source_dir):
+            for name in sorted(files):
+                source = os.path.join(root, name)
+                logical = os.path.relpath(source, self.source_dir).replace(os.sep, '/')
+                with open(source, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+                base, ext = os.path.splitext(logical)
+                hashed = f'{base}.{digest}{ext}'
+                target = os.path.join(self.build_dir, *hashed.split('/'))
+                if not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.copyfile(source, target)
+                if ext.lower() in COMPRESSIBLE_EXTENSIONS and not os.path.exists(target + '.gz'):
+                    packed = gzip.compress(data, compresslevel=9, mtime=0)
+                    if len(packed) < len(data):
+                        with open(target + '.gz', 'wb') as f:
+                            f.write(packed)
+                        compressed += 1
+                manifest[logical] = hashed
+
+        tmp_path = os.path.join(self.build_dir, MANIFEST_NAME + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, os.path.join(self.build_dir, MANIFEST_NAME))
+        log(f'Built {len(manifest)} asset(s), {compressed} new gzip copy(ies) in {self.build_dir}')
+
+        if clean:
+            keep = set(manifest.values()) | {MANIFEST_NAME}
+            keep |= {name + '.gz' for name in manifest.values()}
+            removed = 0
+            for root, _, files in os.walk(self.build_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if os.path.relpath(path, self.build_dir).replace(os.sep, '/') not in keep:
+                        os.remove(path)
+                        removed += 1
+            log(f'Removed {removed} outdated file(s)')
+
+        self.manifest = manifest
+        self.hashed = set(manifest.values())
+        return manifest
+
+
+assets = AssetManifest()
+
+assets_cli = AppGroup('assets', help='Сборка статических файлов.')
+
+
+# flask assets build [--clean] - при развертывании, до запуска воркеров
+@assets_cli.command('build')
+@click.option('--clean', is_flag=True, help='Удалить копии, которых нет в новом манифесте.')
+def build_command(clean):
+    assets.build(clean=clean, log=click.echo)
@@ -0,0 +1,143 @@
+# app/bootstrap.py
+# Подготовка базы данных: создание таблиц, недостающих индексов и колонок, начальные данные.
+# Выполняется один раз командой `flask bootstrap` (или `flask migrate` - только схема),
+# а не при старте каждого воркера: create_app не обращается к БД.
+from datetime import datetime
+
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+
+from .analytics import pending_analytics_move
+from .models import db, User, Role
+from .roles import role_registry
+from .search import ensure_search_index
+from .visit_paths import migrate_legacy_paths
+from .logs.visitors import backfill_visitor_counts
+
+DEFAULT_ROLES = [
+    {'name': 'Admin', 'description': 'Administrator with full access'},
+    {'name': 'User', 'description': 'Regular user with limited access'},
+]
+DEFAULT_ADMIN_USERNAME = 'admin'
+DEFAULT_ADMIN_PASSWORD = 'Admin123!'
+
+
+# Таблицы всех баз (основной и 'analytics', см. app/analytics.py)
+def _all_tables():
+    for metadata in db.metadatas.values():
+        yield from metadata.sorted_tables
+
+
+# Создает индексы, объявленные в моделях, которых еще нет в базе
+# (create_all не добавляет новые индексы к уже существующим таблицам).
+# IF NOT EXISTS вместо checkfirst: индексы по выражению (lower(username)) не видны при отражении схемы
+def ensure_indexes():
+    for table in _all_tables():
+        engine = db.engines[table.metadata.info.get('bind_key')]
+        with engine.begin() as conn:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+# Добавляет в существующие таблицы колонки, появившиеся в моделях позже.
+# Поддерживаются только колонки, допускающие NULL или имеющие серверное значение по умолчанию.
+def ensure_columns(log=print):
+    for table in _all_tables():
+        engine = db.engines[table.metadata.info.get('bind_key')]
+        inspector = inspect(engine)
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+            if column.server_default is not None:
+                ddl += f' DEFAULT {column.server_default.arg}'
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+            log(f'Added column {table.name}.{column.name}')
+
+
+# Ключи сортировки списка пользователей не должны быть NULL (см. logs/pagination.py).
+# Пустая фамилия и NULL для full_name() равнозначны.
+def normalize_user_sort_keys(log=print):
+    updated = User.query.filter(User.last_name.is_(None)).update({'last_name': ''}, synchronize_session=False)
+    updated += User.query.filter(User.created_at.is_(None)).update({'created_at': datetime.utcnow()},
+                                                                    synchronize_session=False)
+    db.session.commit()
+    if updated:
+        log(f'Normalized sort keys of {updated} user row(s)')
+
+
+def migrate_schema(log=print):
+    db.create_all()
+    ensure_columns(log=log)
+    migrate_legacy_paths(log=log)
+    ensure_indexes()
+    backfill_visitor_counts(log=log)
+    normalize_user_sort_keys(log=log)
+    ensure_search_index(log=log)
+    pending = pending_analytics_move()
+    if pending:
+        rows = ', '.join(f'{name}: {count}' for name, count in pending.items())
+        log(f'WARNING: the analytics database is empty, but the main database still holds {rows}. '
+            f'Reports will not show this history until `flask logs move-to-analytics` copies it.')
+
+
+def seed_defaults(log=print):
+    # Создание ролей, если их нет
+    if not Role.query.first():
+        log("Creating default roles...")
+        for role_data in DEFAULT_ROLES:
+            db.session.add(Role(**role_data))
+        db.session.commit()
+        role_registry.invalidate()
+
+    # Создание первого пользователя-администратора, если НЕТ ВООБЩЕ пользователей
+    if not User.query.first():
+        admin_role = role_registry.by_name('Admin')
+        if admin_role is None: # Убедимся, что роль Admin создана
+            log("ERROR: Could not find 'Admin' role to create admin user.")
+            return
+        admin_user = User(
+            username=DEFAULT_ADMIN_USERNAME,
+            first_name='Администратор',
+            last_name='Системы',
+            role_id=admin_role.id # Присваиваем роль
+        )
+        admin_user.password = DEFAULT_ADMIN_PASSWORD # Используется сеттер для хеширования
+        db.session.add(admin_user)
+        db.session.commit()
+        log('--- Default Admin User Created ---')
+        log(f'Login: {DEFAULT_ADMIN_USERNAME}')
+        log(f'Password: {DEFAULT_ADMIN_PASSWORD}')
+        log('----------------------------------')
+
+
+def bootstrap_database(seed=True, log=print):
+    migrate_schema(log=log)
+    if seed:
+        seed_defaults(log=log)
+
+
+# flask bootstrap - схема и начальные данные (один раз при развертывании)
+@click.command('bootstrap')
+@click.option('--skip-seed', is_flag=True, help='Не создавать роли и администратора по умолчанию.')
+def bootstrap_command(skip_seed):
+    bootstrap_database(seed=not skip_seed, log=click.echo)
+    click.echo('Database is ready.')
+
+
+# flask migrate - только схема: новые таблицы, колонки и индексы
+@click.command('migrate')
+def migrate_command():
+    migrate_schema(log=click.echo)
+    click.echo('Schema is up to date.')
+
+
+def init_app(app):
+    app.cli.add_command(bootstrap_command)
+    app.cli.add_command(migrate_command)
@@ -0,0 +1,53 @@
+# app/compression.py
+# Сжатие gzip динамических ответов (HTML-страницы со списками и отчетами, CSV, JSON),
+# если клиент его принимает (Accept-Encoding). Ответ целиком сжимается, если он не меньше
+# COMPRESS_MIN_SIZE байт; потоковые ответы (выгрузки) сжимаются по мере отдачи блоков.
+# Статические файлы сюда не попадают: их сжатые копии готовит `flask assets build` (app/assets.py).
+import gzip
+
+from flask import request
+
+from .logs.export import gzip_stream
+
+DEFAULT_MIMETYPES = ('text/html', 'text/csv', 'text/plain', 'application/json', 'application/x-ndjson')
+
+
+def _accepts_gzip():
+    return request.accept_encodings['gzip'] > 0
+
+
+def _weaken_etag(response):
+    # Сжатое тело отличается от исходного побайтно: сильный ETag становится слабым
+    # (условные запросы сравнивают ETag слабо, 304 продолжает работать)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def init_app(app):
+    if not app.config.get('COMPRESS_ENABLED', True):
+        return
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+    level = app.config.get('COMPRESS_LEVEL', 6)
+    mimetypes = frozenset(app.config.get('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES))
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or request.method == 'HEAD' or response.direct_passthrough
+                or response.mimetype not in mimetypes or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        if not _accepts_gzip():
+            return response
+
+        if response.is_streamed:
+            response.response = gzip_stream(response.response, level=level, sync_flush=True)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < min_size:
+                return response
+            response.set_data(gzip.compress(body, compresslevel=level))
+        response.headers['Content-Encoding'] = 'gzip'
+        _weaken_etag(response)
+        return response
@@ -1,7 +1,182 @@
 # config.py
+import json
 import os
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'hard-to-guess-string'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///users.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Отдельная база для журнала посещений и отчетов (см. app/analytics.py);
+    # без ANALYTICS_DATABASE_URL журнал хранится в основной базе
+    SQLALCHEMY_BINDS = {'analytics': os.environ['ANALYTICS_DATABASE_URL']} if os.environ.get('ANALYTICS_DATABASE_URL') else {}
+    # Снимок аналитической базы только для чтения, из которого строятся отчеты (обновляет `flask logs snapshot`)
+    ANALYTICS_SNAPSHOT_PATH = os.environ.get('ANALYTICS_SNAPSHOT_PATH')
+
+    # Создавать схему и начальные данные при старте приложения (см. app/bootstrap.py).
+    # По умолчанию выключено: база готовится командой `flask bootstrap` при развертывании.
+    # Включается для окружений с эфемерной ФС, где такого шага нет (AUTO_BOOTSTRAP=1).
+    AUTO_BOOTSTRAP = os.environ.get('AUTO_BOOTSTRAP', '0') == '1'
+
+    # Профиль SQLite (см. app/db_profile.py): PRAGMA для каждого нового соединения
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL', # Читатели не блокируются писателем
+        'synchronous': 'NORMAL', # В режиме WAL безопасно и без fsync на каждый commit
+        'busy_timeout': 5000, # Мс ожидания блокировки вместо немедленной ошибки "database is locked"
+        'cache_size': -16000, # Отрицательное значение - размер в КиБ
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    }
+    # Пул соединений (для файловой SQLite SQLAlchemy использует QueuePool)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_recycle': 3600,
+    }
+
+    # Буферизованная запись журнала посещений (см. app/visit_buffer.py). Счетчики отчетов догоняет
+    # поток буфера после каждой пачки; при VISIT_LOG_BUFFERED=0 - только `flask logs refresh-rollups` (cron)
+    VISIT_LOG_BUFFERED = os.environ.get('VISIT_LOG_BUFFERED', '1') == '1'
+    VISIT_LOG_QUEUE_SIZE = int(os.environ.get('VISIT_LOG_QUEUE_SIZE', 10000))
+    VISIT_LOG_BATCH_SIZE = int(os.environ.get('VISIT_LOG_BATCH_SIZE', 500))
+    VISIT_LOG_FLUSH_INTERVAL_MS = int(os.environ.get('VISIT_LOG_FLUSH_INTERVAL_MS', 1000))
+    # Что делать при переполненной очереди: 'drop' - отбросить запись, 'block' - подождать
+    VISIT_LOG_FULL_POLICY = os.environ.get('VISIT_LOG_FULL_POLICY', 'drop')
+    VISIT_LOG_BLOCK_TIMEOUT_MS = int(os.environ.get('VISIT_LOG_BLOCK_TIMEOUT_MS', 100))
+
+    # Какие посещения записывать (см. app/visit_rules.py): первое подходящее правило решает,
+    # пропустить запрос или записать его с выборкой. Можно заменить списком в JSON из VISIT_LOG_RULES_JSON
+    VISIT_LOG_RULES = json.loads(os.environ['VISIT_LOG_RULES_JSON']) if os.environ.get('VISIT_LOG_RULES_JSON') else [
+        {'endpoint': ['static', '*.static', 'asset'], 'action': 'exclude'},
+        {'path_prefix': ['/favicon.ico', '/robots.txt', '/health'], 'action': 'exclude'},
+        # Служебные эндпоинты, которые опрашиваются мониторингом
+        {'endpoint': ['logs.prometheus_metrics', 'logs.visit_buffer_stats', 'logs.cache_stats', 'logs.live_stream'],
+         'action': 'exclude'},
+        # Поисковые роботы и скрипты: записывается 1 из 20 посещений с весом 20
+        {'user_agent': r'bot|crawl|spider|slurp|curl|wget|python-requests|httpclient|monitor|uptime',
+         'sample_rate': 0.05},
+    ]
+
+    # Сколько путей журнала держать в кэше словаря visit_paths (см. app/visit_paths.py)
+    VISIT_PATH_CACHE_SIZE = int(os.environ.get('VISIT_PATH_CACHE_SIZE', 10000))
+
+    # Журнал посещений: показывать ли общее (приблизительное) число записей и сколько секунд его кэшировать
+    VISIT_LOG_SHOW_TOTAL = os.environ.get('VISIT_LOG_SHOW_TOTAL', '1') == '1'
+    VISIT_LOG_TOTAL_CACHE_SECONDS = int(os.environ.get('VISIT_LOG_TOTAL_CACHE_SECONDS', 60))
+
+    # Максимум строк в одном ответе /logs/export/raw (дальше - продолжение через after_id)
+    RAW_EXPORT_MAX_ROWS = int(os.environ.get('RAW_EXPORT_MAX_ROWS', 1000000))
+
+    # Кэш готовых отчетов по страницам и пользователям (см. app/logs/report_cache.py):
+    # число отчетов, максимальный размер одного и сколько секунд можно отдавать отчет без проверки версии
+    REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 128))
+    REPORT_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES', 1024 * 1024))
+    REPORT_CACHE_STALE_SECONDS = float(os.environ.get('REPORT_CACHE_STALE_SECONDS', 0))
+
+    # Хранение журнала: сколько дней держать в visit_logs и куда складывать архивные месяцы
+    VISIT_LOG_RETENTION_DAYS = int(os.environ.get('VISIT_LOG_RETENTION_DAYS', 90))
+    VISIT_LOG_ARCHIVE_DIR = os.environ.get('VISIT_LOG_ARCHIVE_DIR') # По умолчанию instance/archive
+
+    # Кэш данных текущего пользователя (см. app/identity.py)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    # Как часто кэш сверяет метку изменений пользователей из других процессов
+    USER_CACHE_CHECK_SECONDS = int(os.environ.get('USER_CACHE_CHECK_SECONDS', 5))
+
+    # Как часто воркер проверяет, не изменились ли роли в другом процессе (см. app/roles.py)
+    ROLE_REGISTRY_CHECK_SECONDS = int(os.environ.get('ROLE_REGISTRY_CHECK_SECONDS', 5))
+
+    # Метрики запросов и SQL (см. app/metrics.py и /logs/metrics)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    # Токен для сборщика Prometheus (заголовок Authorization: Bearer <токен>); без него - только вход администратора
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Хеширование паролей (см. app/passwords.py): метод и стоимость в формате werkzeug,
+    # например 'pbkdf2:sha256:600000' или 'pbkdf2:sha512:210000'. При смене метода хеши
+    # пользователей пересчитываются при их следующем успешном входе.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+    # Число процессов для вычисления хешей; 0 - считать в потоке запроса
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
+    # Сколько проверок пароля при входе может идти одновременно и сколько секунд ждать свободного места
+    PASSWORD_LOGIN_CONCURRENCY = int(os.environ.get('PASSWORD_LOGIN_CONCURRENCY', 4))
+    PASSWORD_LOGIN_WAIT_SECONDS = float(os.environ.get('PASSWORD_LOGIN_WAIT_SECONDS', 2))
+    # Статические файлы (см. app/assets.py): сборка `flask assets build` кладет копии с хешем в имени
+    # в ASSETS_BUILD_DIR (по умолчанию instance/assets)
+    ASSETS_BUILD_DIR = os.environ.get('ASSETS_BUILD_DIR')
+    # Сжатие gzip динамических ответов (см. app/compression.py): ответы меньше COMPRESS_MIN_SIZE байт
+    # отдаются как есть
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+
+    # Шаблоны (см. app/templating.py): общий для воркеров кэш байткода на диске (по умолчанию
+    # instance/jinja-cache), компиляция всех шаблонов при старте и потоковый вывод больших страниц
+    JINJA_BYTECODE_CACHE = os.environ.get('JINJA_BYTECODE_CACHE', '1') == '1'
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR')
+    TEMPLATE_PRECOMPILE = os.environ.get('TEMPLATE_PRECOMPILE', '0') == '1'
+    TEMPLATE_STREAMING = os.environ.get('TEMPLATE_STREAMING', '1') == '1'
+
+    # Фоновые задания (см. app/jobs.py): поток-исполнитель в каждом веб-воркере
+    # (0 - задания выполняет отдельный процесс `flask jobs run`), период опроса очереди,
+    # через сколько секунд без heartbeat задание считается брошенным, размер порции и пауза между порциями
+    JOBS_WORKER_ENABLED = os.environ.get('JOBS_WORKER_ENABLED', '1') == '1'
+    JOBS_POLL_SECONDS = float(os.environ.get('JOBS_POLL_SECONDS', 5))
+    JOBS_STALE_SECONDS = int(os.environ.get('JOBS_STALE_SECONDS', 300))
+    JOBS_CHUNK_SIZE = int(os.environ.get('JOBS_CHUNK_SIZE', 1000))
+    JOBS_CHUNK_PAUSE_MS = int(os.environ.get('JOBS_CHUNK_PAUSE_MS', 20))
+    # Процессов для хеширования паролей при массовом импорте, если PASSWORD_HASH_WORKERS = 0
+    # (временный пул на время импорта, см. app/user_import.py)
+    USER_IMPORT_HASH_WORKERS = int(os.environ.get('USER_IMPORT_HASH_WORKERS', os.cpu_count() or 1))
+    # Загрузка через /user/import: файлы, где паролей для хеширования больше USER_IMPORT_SYNC_PASSWORDS,
+    # импортирует фоновое задание (около 12 паролей в секунду на ядро); файлы для него хранятся
+    # в USER_IMPORT_DIR (по умолчанию instance/imports)
+    USER_IMPORT_SYNC_PASSWORDS = int(os.environ.get('USER_IMPORT_SYNC_PASSWORDS', 50))
+    USER_IMPORT_DIR = os.environ.get('USER_IMPORT_DIR')
+    # Предельный размер тела запроса (загружаемого CSV), байт; больше - ответ 413
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
+
+    # Лента посещений в реальном времени /logs/live (см. app/live.py): сколько последних посещений
+    # держать в памяти процесса и показывать при открытии страницы, окно счетчиков по страницам, не чаще какого интервала отправлять пачку,
+    # период keepalive и предел одновременных подключений к ленте на процесс
+    LIVE_ENABLED = os.environ.get('LIVE_ENABLED', '1') == '1'
+    LIVE_BUFFER_SIZE = int(os.environ.get('LIVE_BUFFER_SIZE', 1000))
+    LIVE_INITIAL_VISITS = int(os.environ.get('LIVE_INITIAL_VISITS', 50))
+    LIVE_WINDOW_SECONDS = int(os.environ.get('LIVE_WINDOW_SECONDS', 300))
+    LIVE_PUSH_INTERVAL_MS = int(os.environ.get('LIVE_PUSH_INTERVAL_MS', 1000))
+    LIVE_KEEPALIVE_SECONDS = float(os.environ.get('LIVE_KEEPALIVE_SECONDS', 15))
+    LIVE_MAX_SUBSCRIBERS = int(os.environ.get('LIVE_MAX_SUBSCRIBERS', 50))
+
+
+# Пресеты для разработки и боевого окружения: выбираются переменной APP_CONFIG (см. run.py)
+class DevelopmentConfig(Config):
+    SQLITE_PRAGMAS = {
+        **Config.SQLITE_PRAGMAS,
+        'cache_size': -8000,
+        'mmap_size': 0,
+    }
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 2,
+        'max_overflow': 2,
+        'pool_recycle': 3600,
+    }
+
+class ProductionConfig(Config):
+    SQLITE_PRAGMAS = {
+        **Config.SQLITE_PRAGMAS,
+        'busy_timeout': 10000,
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'wal_autocheckpoint': 1000,
+    }
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10, # Не меньше числа потоков воркера gunicorn
+        'max_overflow': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    }
+
+config_by_name = {
+    'default': Config,
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
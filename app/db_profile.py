@@ -0,0 +1,64 @@
+# app/db_profile.py
+# Профиль подключения к SQLite: PRAGMA из конфигурации (SQLITE_PRAGMAS) выполняются
+# для каждого нового соединения пула. Главное - journal_mode=WAL: читатели не ждут
+# писателя, а запись журнала посещений не блокирует страницы статистики.
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from .analytics import unique_engines
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+# Параметры QueuePool: с другим пулом create_engine их не принимает
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_use_lifo')
+
+
+def _uses_queue_pool(url, options):
+    if 'poolclass' in options:
+        return False
+    url = make_url(url)
+    # Для SQLite в памяти Flask-SQLAlchemy выбирает StaticPool (одно соединение на процесс)
+    return not (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'))
+
+
+def _without_queue_pool_options(options):
+    return {name: value for name, value in options.items() if name not in QUEUE_POOL_OPTIONS}
+
+
+def prepare_engine_options(app):
+    # Вызывается до db.init_app: размеры пула из SQLALCHEMY_ENGINE_OPTIONS остаются только
+    # для движков с QueuePool (файловая SQLite, серверные СУБД). Конфигурация заменяется
+    # копиями, словари класса Config не меняются
+    options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    url = app.config.get('SQLALCHEMY_DATABASE_URI')
+    if url and not _uses_queue_pool(url, options):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = _without_queue_pool_options(options)
+    binds = {}
+    for key, value in (app.config.get('SQLALCHEMY_BINDS') or {}).items():
+        if isinstance(value, dict) and not _uses_queue_pool(value['url'], value):
+            value = _without_queue_pool_options(value)
+        binds[key] = value
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_sqlite_profile(app):
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    if not pragmas:
+        return
+    with app.app_context():
+        engines = unique_engines()
+    for engine in engines:
+        if engine.dialect.name != 'sqlite':
+            continue
+
+        @event.listens_for(engine, 'connect')
+        def _on_connect(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
@@ -1,26 +1,31 @@
 # forms.py
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, SelectField
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import Form, StringField, PasswordField, SubmitField, SelectField, BooleanField
 from wtforms.validators import DataRequired, Length, Regexp, ValidationError, EqualTo
-from .models import User, Role
+from .roles import role_registry
 
 class LoginForm(FlaskForm):
     username = StringField('Логин', validators=[DataRequired(), Length(min=5)])
     password = PasswordField('Пароль', validators=[DataRequired()])
     submit = SubmitField('Войти')
 
+# Правила логина и пароля общие для формы создания и массового импорта (см. app/user_import.py)
+USERNAME_VALIDATORS = [
+    DataRequired(),
+    Length(min=5),
+    Regexp('^[A-Za-z0-9]+$', message='Логин должен состоять только из латинских букв и цифр')
+]
+PASSWORD_VALIDATORS = [
+    DataRequired(),
+    Length(min=8, max=128),
+    Regexp(r'^(?=.*[a-zа-я])(?=.*[A-ZА-Я])(?=.*\d)(?!.*\s)[\w~!?@#$%^&*_\-+(){}\[\]><\\/|"\'.,;:]+$',
+          message='Пароль должен содержать как минимум одну заглавную букву, одну строчную букву, одну цифру и не содержать пробелов')
+]
+
 class UserForm(FlaskForm):
-    username = StringField('Логин', validators=[
-        DataRequired(), 
-        Length(min=5),
-        Regexp('^[A-Za-z0-9]+$', message='Логин должен состоять только из латинских букв и цифр')
-    ])
-    password = PasswordField('Пароль', validators=[
-        DataRequired(),
-        Length(min=8, max=128),
-        Regexp(r'^(?=.*[a-zа-я])(?=.*[A-ZА-Я])(?=.*\d)(?!.*\s)[\w~!?@#$%^&*_\-+(){}\[\]><\\/|"\'.,;:]+$',
-              message='Пароль должен содержать как минимум одну заглавную букву, одну строчную букву, одну цифру и не содержать пробелов')
-    ])
+    username = StringField('Логин', validators=USERNAME_VALIDATORS)
+    password = PasswordField('Пароль', validators=PASSWORD_VALIDATORS)
     last_name = StringField('Фамилия', validators=[DataRequired()])
     first_name = StringField('Имя', validators=[DataRequired()])
     middle_name = StringField('Отчество')
@@ -29,7 +34,26 @@ class UserForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super(UserForm, self).__init__(*args, **kwargs)
-        self.role.choices = [(0, 'Не выбрано')] + [(role.id, role.name) for role in Role.query.all()]
+        self.role.choices = role_registry.choices()
+
+# Проверка одной строки файла импорта по правилам UserForm (без CSRF: данные не из запроса).
+# Роль проверяется отдельно - в файле она указана названием
+class UserImportRowForm(Form):
+    username = StringField('Логин', validators=USERNAME_VALIDATORS)
+    password = StringField('Пароль', validators=PASSWORD_VALIDATORS)
+    last_name = StringField('Фамилия', validators=[DataRequired()])
+    first_name = StringField('Имя', validators=[DataRequired()])
+    middle_name = StringField('Отчество')
+
+class UserImportForm(FlaskForm):
+    file = FileField('Файл CSV', validators=[FileRequired(), FileAllowed(['csv'], 'Нужен файл CSV')])
+    role = SelectField('Роль по умолчанию', coerce=int) # Для строк без колонки role
+    dry_run = BooleanField('Только проверить, не создавать пользователей')
+    submit = SubmitField('Импортировать')
+
+    def __init__(self, *args, **kwargs):
+        super(UserImportForm, self).__init__(*args, **kwargs)
+        self.role.choices = role_registry.choices()
 
 class EditUserForm(FlaskForm):
     last_name = StringField('Фамилия', validators=[DataRequired()])
@@ -40,16 +64,11 @@ class EditUserForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super(EditUserForm, self).__init__(*args, **kwargs)
-        self.role.choices = [(0, 'Не выбрано')] + [(role.id, role.name) for role in Role.query.all()]
+        self.role.choices = role_registry.choices()
 
 class ChangePasswordForm(FlaskForm):
     old_password = PasswordField('Старый пароль', validators=[DataRequired()])
-    new_password = PasswordField('Новый пароль', validators=[
-        DataRequired(),
-        Length(min=8, max=128),
-        Regexp(r'^(?=.*[a-zа-я])(?=.*[A-ZА-Я])(?=.*\d)(?!.*\s)[\w~!?@#$%^&*_\-+(){}\[\]><\\/|"\'.,;:]+$',
-              message='Пароль должен содержать как минимум одну заглавную букву, одну строчную букву, одну цифру и не содержать пробелов')
-    ])
+    new_password = PasswordField('Новый пароль', validators=PASSWORD_VALIDATORS)
     confirm_password = PasswordField('Повторите новый пароль', validators=[
         DataRequired(),
         EqualTo('new_password', message='Пароли не совпадают')
@@ -0,0 +1,97 @@
+# app/identity.py
+# Кэш данных текущего пользователя для Flask-Login.
+# Вместо User.query.get и ленивой загрузки роли на каждый запрос current_user
+# берется из ограниченного LRU-кэша с TTL. В кэше лежат не ORM-объекты, а неизменяемые
+# снимки: они не привязаны к сессии БД и безопасно разделяются между потоками.
+# Изменения пользователей в других воркерах отмечаются меткой USERS_STAMP (app/stamps.py):
+# раз в USER_CACHE_CHECK_SECONDS кэш сравнивает ее со своей и при расхождении очищается.
+import time
+
+from flask_login import UserMixin
+
+from .cache import LRUCache
+from .models import db, User
+from .roles import role_registry
+from .stamps import read_stamp, USERS_STAMP
+
+
+class UserIdentity(UserMixin):
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.last_name = user.last_name
+        self.first_name = user.first_name
+        self.middle_name = user.middle_name
+        self.role_id = user.role_id
+        self.created_at = user.created_at # Список пользователей на главной показывает и свою строку
+
+    # Роль берется из реестра ролей процесса, а не из БД
+    @property
+    def role(self):
+        return role_registry.get(self.role_id)
+
+    def full_name(self):
+        if self.last_name:
+            return f"{self.last_name} {self.first_name} {self.middle_name or ''}"
+        return f"{self.first_name} {self.middle_name or ''}"
+
+    def is_admin(self):
+        role = self.role
+        return role is not None and role.name == 'Admin'
+
+    # ORM-объект для изменений (например, смены пароля)
+    def get_model(self):
+        return db.session.get(User, self.id)
+
+    def __repr__(self):
+        return f'<UserIdentity {self.username}>'
+
+
+class UserIdentityCache:
+    def __init__(self, app=None):
+        self._cache = LRUCache()
+        self._stamp = None
+        self._next_check = 0.0
+        self.check_interval = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Другие воркеры узнают об изменениях пользователя по метке, без нее - не позже чем через TTL
+        self._cache = LRUCache(maxsize=app.config.get('USER_CACHE_SIZE', 10000),
+                               ttl=app.config.get('USER_CACHE_TTL', 60))
+        self.check_interval = app.config.get('USER_CACHE_CHECK_SECONDS', 5)
+        app.extensions['user_identity_cache'] = self
+
+    def load(self, user_id):
+        self._ensure_fresh()
+        identity = self._cache.get(user_id)
+        if identity is None:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            identity = UserIdentity(user)
+            self._cache.set(user_id, identity)
+        return identity
+
+    def invalidate(self, user_id):
+        self._cache.invalidate(user_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        stamp = read_stamp(USERS_STAMP)
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._cache.clear()
+
+
+user_cache = UserIdentityCache()
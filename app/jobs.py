@@ -0,0 +1,287 @@
+# app/jobs.py
+# Фоновые задания: долгие изменения данных выполняются не в запросе, а в фоновом потоке
+# воркера (или отдельным процессом `flask jobs run`) порциями с короткими транзакциями.
+# Очередь хранится в таблице jobs, поэтому ее видят все воркеры: задание забирает тот,
+# кто первым переведет его из queued в running (UPDATE ... WHERE status = 'queued').
+# Во время работы обработчик отмечает прогресс и обновляет heartbeat_at; задание, у которого
+# heartbeat не обновлялся JOBS_STALE_SECONDS (воркер завершился), забирается снова -
+# поэтому обработчики должны быть идемпотентны. Что вернул обработчик, сохраняется в jobs.result (JSON).
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, or_
+
+from .models import db, Job, VisitLog
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+CLAIM_CANDIDATES = 5
+
+
+class JobContext:
+    # Передается обработчику: размер порции, отметка прогресса и пауза между порциями
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.job_id = job.id
+        self.chunk_size = queue.chunk_size
+
+    def progress(self, done, total=None):
+        # done - обработано всего; короткая отдельная транзакция
+        values = {'progress': done, 'heartbeat_at': datetime.utcnow()}
+        if total is not None:
+            values['total'] = total
+        Job.query.filter(Job.id == self.job_id).update(values, synchronize_session=False)
+        db.session.commit()
+
+    def pause(self):
+        # Между порциями даем записать журнал и остальным воркерам
+        if self.queue.chunk_pause:
+            time.sleep(self.queue.chunk_pause)
+
+
+class JobQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._handlers = {}
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {'enqueued': 0, 'done': 0, 'failed': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        # Без фонового потока в веб-воркерах задания выполняет `flask jobs run`
+        self.enabled = app.config.get('JOBS_WORKER_ENABLED', True)
+        self.poll_interval = app.config.get('JOBS_POLL_SECONDS', 5)
+        self.stale_after = timedelta(seconds=app.config.get('JOBS_STALE_SECONDS', 300))
+        self.chunk_size = app.config.get('JOBS_CHUNK_SIZE', 1000)
+        self.chunk_pause = app.config.get('JOBS_CHUNK_PAUSE_MS', 20) / 1000.0
+        app.extensions['jobs'] = self
+        app.cli.add_command(jobs_cli)
+        if self.enabled:
+            # Поток запускается с первым запросом, чтобы подхватить задания, оставшиеся в очереди
+            app.before_request(self._ensure_started)
+        atexit.register(self.close)
+
+    def handler(self, kind):
+        # Регистрация обработчика: @job_queue.handler('user_delete') def f(ctx, **params)
+        def register(func):
+            self._handlers[kind] = func
+            return func
+        return register
+
+    def enqueue(self, kind, created_by=None, delay=None, **params):
+        # Добавляет задание и фиксирует текущую транзакцию сессии вместе с ним:
+        # изменения, ради которых ставится задание, и само задание сохраняются атомарно.
+        # delay (timedelta) - выполнить не раньше, чем через это время
+        if kind not in self._handlers:
+            raise ValueError(f'Unknown job kind {kind!r}')
+        job = Job(kind=kind, params=json.dumps(params), status=STATUS_QUEUED, created_by=created_by,
+                  run_after=datetime.utcnow() + delay if delay else None)
+        db.session.add(job)
+        db.session.commit()
+        self._count('enqueued')
+        if self.enabled:
+            self._ensure_started()
+            self._wake.set()
+        return job
+
+    def get(self, job_id):
+        return db.session.get(Job, job_id)
+
+    def recent(self, limit=20):
+        return Job.query.order_by(Job.id.desc()).limit(limit).all()
+
+    def run_pending(self):
+        # Выполняет задания, пока очередь не опустеет; возвращает их число
+        count = 0
+        while True:
+            job = self._claim()
+            if job is None:
+                return count
+            self._execute(job)
+            count += 1
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._counters)
+        stats['enabled'] = self.enabled
+        return stats
+
+    # --- Внутренняя кухня ---
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._counters[name] += value
+
+    def _claimable(self, now):
+        # В очереди (и срок отложенного наступил) или брошено: running без heartbeat дольше stale_after
+        return or_(and_(Job.status == STATUS_QUEUED, or_(Job.run_after.is_(None), Job.run_after <= now)),
+                   and_(Job.status == STATUS_RUNNING, Job.heartbeat_at < now - self.stale_after))
+
+    def _claim(self):
+        now = datetime.utcnow()
+        candidates = [job_id for (job_id,) in db.session.query(Job.id).filter(self._claimable(now))
+                      .order_by(Job.id).limit(CLAIM_CANDIDATES)]
+        db.session.commit()
+        for job_id in candidates:
+            claimed = Job.query.filter(Job.id == job_id, self._claimable(now))\
+                .update({'status': STATUS_RUNNING, 'started_at': now, 'heartbeat_at': now, 'error': None},
+                        synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, job_id)
+        return None
+
+    def _finish(self, job_id, status, error=None, result=None):
+        values = {'status': status, 'error': error, 'finished_at': datetime.utcnow()}
+        if result is not None:
+            values['result'] = json.dumps(result, ensure_ascii=False)
+        Job.query.filter(Job.id == job_id).update(values, synchronize_session=False)
+        db.session.commit()
+        self._count(status)
+
+    def _execute(self, job):
+        job_id = job.id
+        handler = self._handlers.get(job.kind)
+        if handler is None:
+            self._finish(job_id, STATUS_FAILED, f'Unknown job kind {job.kind!r}')
+            return
+        try:
+            result = handler(JobContext(self, job), **json.loads(job.params))
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.exception('Job %d (%s) failed', job_id, job.kind)
+            self._finish(job_id, STATUS_FAILED, str(e))
+        else:
+            self._finish(job_id, STATUS_DONE, result=result)
+
+    def _ensure_started(self):
+        # Поток запускается лениво и заново после fork (как у буфера журнала, см. visit_buffer.py)
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._stop = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='job-worker', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.run_pending()
+            except Exception:
+                self.app.logger.exception('Job worker iteration failed')
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+job_queue = JobQueue()
+
+
+def describe(job):
+    # Состояние задания для JSON-ответа и CLI
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'error': job.error,
+        'params': json.loads(job.params),
+        'result': json.loads(job.result) if job.result else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'run_after': job.run_after.isoformat() if job.run_after else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# --- Обработчики ---
+
+@job_queue.handler('user_delete')
+def detach_user_visits(ctx, user_id, final=False):
+    # Записи журнала удаленного пользователя становятся неаутентифицированными порциями
+    # по chunk_size: выборка идет по индексу (user_id, created_at), каждая порция - своя транзакция.
+    # После удаления его посещения еще могут записать буферы журнала и воркеры, у которых
+    # пользователь остался в кэше, поэтому задание повторяется один раз (final) через
+    # VISIT_LOG_FLUSH_INTERVAL_MS + USER_CACHE_TTL, когда таких записей уже не появится.
+    from flask import current_app
+
+    from .logs.rollups import reassign_user_rollups
+
+    total = db.session.query(db.func.count(VisitLog.id)).filter(VisitLog.user_id == user_id).scalar()
+    db.session.commit()
+    ctx.progress(0, total)
+    done = 0
+    while True:
+        ids = [visit_id for (visit_id,) in db.session.query(VisitLog.id)
+               .filter(VisitLog.user_id == user_id).limit(ctx.chunk_size)]
+        if not ids:
+            break
+        VisitLog.query.filter(VisitLog.id.in_(ids)).update({'user_id': None}, synchronize_session=False)
+        db.session.commit()
+        done += len(ids)
+        ctx.progress(done)
+        ctx.pause()
+    # Счетчики отчетов - после журнала: записи, учтенные до этого, уже переписаны на пользователя
+    reassign_user_rollups(user_id)
+    db.session.commit()
+    if not final:
+        config = current_app.config
+        delay = timedelta(milliseconds=config.get('VISIT_LOG_FLUSH_INTERVAL_MS', 1000),
+                          seconds=config.get('USER_CACHE_TTL', 60))
+        ctx.queue.enqueue('user_delete', delay=delay, user_id=user_id, final=True)
+    return {'detached': done}
+
+
+# --- CLI ---
+
+jobs_cli = AppGroup('jobs', help='Фоновые задания.')
+
+
+# flask jobs run [--once] - отдельный процесс-исполнитель (при JOBS_WORKER_ENABLED=0)
+@jobs_cli.command('run')
+@click.option('--once', is_flag=True, help='Выполнить задания из очереди и выйти.')
+def run_command(once):
+    while True:
+        count = job_queue.run_pending()
+        if once:
+            click.echo(f'Ran {count} job(s).')
+            return
+        time.sleep(job_queue.poll_interval)
+
+
+# flask jobs list [--limit N]
+@jobs_cli.command('list')
+@click.option('--limit', type=int, default=20)
+def list_command(limit):
+    for job in job_queue.recent(limit):
+        info = describe(job)
+        total = f'/{info["total"]}' if info['total'] is not None else ''
+        line = f'{info["id"]:>6} {info["kind"]:<16} {info["status"]:<8} {info["progress"]}{total} {info["created_at"]}'
+        if info['error']:
+            line += f' error: {info["error"]}'
+        click.echo(line)
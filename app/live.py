@@ -0,0 +1,177 @@
+# app/live.py
+# Лента посещений в реальном времени для страницы /logs/live (Server-Sent Events).
+# log_visit публикует каждое записанное посещение в кольцевой буфер процесса (последние
+# LIVE_BUFFER_SIZE событий) и в скользящие счетчики по страницам за LIVE_WINDOW_SECONDS.
+# Подписчики (открытые страницы /logs/live) ждут новых событий на общем threading.Condition
+# и не обращаются к БД: событие сериализуется в JSON один раз при публикации, сводка счетчиков -
+# не чаще раза в секунду на все подключения, поэтому десятки наблюдателей стоят почти как один.
+# Каждое подключение занимает поток воркера на все время просмотра: нужен воркер с потоками
+# (gunicorn --threads N или gevent), подключений на процесс не больше LIVE_MAX_SUBSCRIBERS.
+# Буфер свой в каждом процессе: при нескольких воркерах лента показывает посещения,
+# обработанные тем воркером, к которому подключилась страница.
+import atexit
+import json
+import threading
+import time
+from collections import deque
+from heapq import nlargest
+
+TOP_PATHS = 20
+
+
+class RollingCounter:
+    # Сумма по ключам за последние window секунд: корзины по секундам + общий итог
+    def __init__(self, window):
+        self.window = window
+        self._buckets = deque() # (секунда, {ключ: число})
+        self._totals = {}
+
+    def add(self, key, count, now):
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append((second, {}))
+        bucket = self._buckets[-1][1]
+        bucket[key] = bucket.get(key, 0) + count
+        self._totals[key] = self._totals.get(key, 0) + count
+        self._expire(second)
+
+    def _expire(self, second):
+        totals = self._totals
+        while self._buckets and self._buckets[0][0] <= second - self.window:
+            _, bucket = self._buckets.popleft()
+            for key, count in bucket.items():
+                remaining = totals[key] - count
+                if remaining:
+                    totals[key] = remaining
+                else:
+                    del totals[key]
+
+    def top(self, n, now):
+        self._expire(int(now))
+        return nlargest(n, self._totals.items(), key=lambda item: item[1])
+
+    def total(self):
+        return sum(self._totals.values())
+
+
+class LiveFeed:
+    def __init__(self, app=None):
+        self.enabled = False
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=1000) # (номер, JSON события)
+        self._counter = RollingCounter(300)
+        self._seq = 0
+        self._subscribers = 0
+        self._closed = False
+        self._summary = (None, None) # (ключ, JSON сводки) - общая для всех подписчиков
+        self.published = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('LIVE_ENABLED', True)
+        self._events = deque(maxlen=app.config.get('LIVE_BUFFER_SIZE', 1000))
+        self._counter = RollingCounter(app.config.get('LIVE_WINDOW_SECONDS', 300))
+        self.max_subscribers = app.config.get('LIVE_MAX_SUBSCRIBERS', 50)
+        self.keepalive = app.config.get('LIVE_KEEPALIVE_SECONDS', 15)
+        self.push_interval = app.config.get('LIVE_PUSH_INTERVAL_MS', 1000) / 1000.0
+        app.extensions['live_feed'] = self
+        atexit.register(self.close)
+
+    # --- Публикация (из log_visit) ---
+
+    def publish(self, event, weight=1):
+        # event - словарь с полями посещения (path, route, user, at); weight - вес выборки
+        if not self.enabled:
+            return
+        data = json.dumps(event, ensure_ascii=False, default=str)
+        now = time.time()
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, data))
+            self._counter.add(event['path'], weight, now)
+            self.published += 1
+            self._cond.notify_all()
+
+    # --- Подписка ---
+
+    def subscribe(self):
+        # Возвращает номер последнего события или None, если мест нет
+        with self._cond:
+            if self._closed or self._subscribers >= self.max_subscribers:
+                return None
+            self._subscribers += 1
+            return self._seq
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+
+    def wait(self, after, timeout):
+        # Ждет событий с номером больше after; возвращает (номер последнего, [JSON событий], пропущено)
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after or self._closed, timeout)
+            if self._seq <= after:
+                return after, [], 0
+            events = [data for seq, data in self._events if seq > after]
+            missed = self._seq - after - len(events) # Вытеснены из буфера, пока подписчик отставал
+            return self._seq, events, missed
+
+    def summary(self):
+        # Сводка счетчиков за окно; пересчитывается не чаще раза в секунду и при новых событиях
+        now = time.time()
+        with self._cond:
+            key = (self._seq, int(now))
+            if self._summary[0] != key:
+                pages = self._counter.top(TOP_PATHS, now)
+                payload = {'window': self._counter.window, 'total': self._counter.total(), 'pages': pages}
+                self._summary = (key, json.dumps(payload, ensure_ascii=False))
+            return self._summary[1]
+
+    @property
+    def window(self):
+        return self._counter.window
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        # При остановке воркера открытые потоки завершаются, не дожидаясь keepalive
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'enabled': self.enabled, 'subscribers': self._subscribers, 'published': self.published,
+                    'buffered': len(self._events)}
+
+
+live_feed = LiveFeed()
+
+
+def sse_stream(feed, after):
+    # Поток text/event-stream для одного подписчика (место занято через subscribe и освобождается
+    # через unsubscribe при закрытии ответа); события с номером больше after, которые еще в буфере,
+    # отправляются сразу
+    yield f'retry: 3000\n\nevent: counters\ndata: {feed.summary()}\n\n'
+    last_push = 0.0
+    while not feed.closed:
+        seq, events, missed = feed.wait(after, feed.keepalive)
+        if seq == after:
+            # Keepalive: не дает прокси закрыть соединение, обнаруживает ушедших клиентов
+            # и обновляет счетчики, из окна которых ушли старые посещения
+            yield f': keepalive\n\nevent: counters\ndata: {feed.summary()}\n\n'
+            continue
+        # Частые посещения отдаются пачкой не чаще раза в push_interval
+        delay = feed.push_interval - (time.monotonic() - last_push)
+        if delay > 0:
+            time.sleep(delay)
+            seq, events, missed = feed.wait(after, 0)
+        after = seq
+        message = f'id: {seq}\nevent: visits\ndata: [{",".join(events)}]\n\n'
+        if missed:
+            message += f'event: missed\ndata: {missed}\n\n'
+        yield message + f'event: counters\ndata: {feed.summary()}\n\n'
+        last_push = time.monotonic()
@@ -0,0 +1,242 @@
+# app/logs/export.py
+# Потоковая выгрузка отчетов: строки читаются из курсора БД порциями и пишутся
+# в CSV крупными блоками, при необходимости сразу сжимаются в gzip.
+import csv
+import heapq
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+from itertools import islice
+
+from flask import Response, stream_with_context
+from sqlalchemy import func
+
+from ..visit_paths import path_dictionary
+
+# Сколько строк читать из курсора за раз и сколько писать в один блок ответа
+EXPORT_BATCH_SIZE = 2000
+# Минимальный размер блока, отдаваемого в сокет (для gzip - до сжатия)
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def iter_batches(db_session, query, batch_size=EXPORT_BATCH_SIZE):
+    # Серверный курсор: в памяти одновременно не более batch_size строк
+    result = db_session.execute(
+        query.statement.execution_options(stream_results=True, max_row_buffer=batch_size)
+    )
+    try:
+        for partition in result.partitions(batch_size):
+            yield partition
+    finally:
+        result.close()
+
+
+def gzip_stream(chunks, level=6, sync_flush=False):
+    # sync_flush - отдавать каждый блок целиком сразу (Z_SYNC_FLUSH), а не когда накопится
+    # буфер zlib: клиент получает потоковый ответ по мере формирования, а не в конце
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # wbits=31 - формат gzip
+    try:
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if sync_flush and chunk:
+                compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        # Исходный поток может держать контекст запроса и курсор БД: закрываем его и при обрыве
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def csv_stream(header, row_batches, chunk_bytes=EXPORT_CHUNK_BYTES):
+    # row_batches - итератор списков строк; каждая пачка пишется одним writerows
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for rows in row_batches:
+        writer.writerows(rows)
+        if buffer.tell() >= chunk_bytes:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def csv_response(header, row_batches, filename_prefix, gzip=False):
+    return stream_response(csv_stream(header, row_batches), filename_prefix, 'csv', 'text/csv', gzip)
+
+
+def stream_response(chunks, filename_prefix, extension, mimetype, gzip=False):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f'{filename_prefix}_{timestamp}.{extension}'
+    if gzip:
+        chunks = gzip_stream(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+
+def ndjson_stream(row_batches, columns, chunk_bytes=EXPORT_CHUNK_BYTES):
+    # Одна JSON-запись на строку; блоки собираются так же, как в csv_stream
+    parts = []
+    size = 0
+    for rows in row_batches:
+        for row in rows:
+            line = json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str)
+            parts.append(line)
+            size += len(line) + 1
+        if size >= chunk_bytes:
+            parts.append('')
+            yield '\n'.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+    if parts:
+        parts.append('')
+        yield '\n'.join(parts).encode('utf-8')
+
+
+# --- Выгрузка сырых записей журнала ---
+
+# route - шаблон маршрута из словаря путей (см. app/visit_paths.py)
+RAW_EXPORT_COLUMNS = ['id', 'created_at', 'user_id', 'path', 'sample_weight', 'route']
+RAW_EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+# Запас при переводе временных границ в границы id (см. resolve_id_bounds)
+ID_BOUNDS_SLACK = timedelta(minutes=5)
+# До скольких страниц префикса выгрузка идет отдельными проходами по индексу (path_id, id)
+RAW_EXPORT_MAX_PATH_WALKS = 64
+# До скольких номеров путей фильтр передается списком в запросе
+RAW_EXPORT_MAX_PATH_IDS = 500
+
+
+class RawExportFilter:
+    def __init__(self, start=None, end=None, user_id=None, path_prefix=None, after_id=0, until_id=None):
+        self.start = start # datetime, включительно
+        self.end = end # datetime, не включительно
+        self.user_id = user_id
+        self.path_prefix = path_prefix
+        self.after_id = after_id or 0 # Курсор для продолжения прерванной выгрузки
+        self.until_id = until_id # Верхняя граница id, зафиксированная в начале выгрузки
+
+
+def resolve_id_bounds(db_session, visit_model, flt):
+    # Границы диапазона id находим одним поиском по индексу created_at, дальше идем
+    # по первичному ключу. Записи попадают в БД пачками, поэтому порядок id и created_at
+    # может расходиться на время задержки записи - границы берем с запасом.
+    lower = flt.after_id
+    if flt.start is not None:
+        first = db_session.query(visit_model.id)\
+            .filter(visit_model.created_at >= flt.start - ID_BOUNDS_SLACK)\
+            .order_by(visit_model.created_at, visit_model.id).first()
+        if first is None:
+            return None, None
+        lower = max(lower, first.id - 1)
+    upper = flt.until_id
+    if upper is None:
+        upper = db_session.query(func.max(visit_model.id)).scalar() or 0
+    if flt.end is not None:
+        last = db_session.query(visit_model.id)\
+            .filter(visit_model.created_at < flt.end + ID_BOUNDS_SLACK)\
+            .order_by(visit_model.created_at.desc(), visit_model.id.desc()).first()
+        upper = min(upper, last.id if last is not None else 0)
+    return lower, upper
+
+
+def _keyset_walk(db_session, columns, id_column, conditions, lower, upper, batch_size):
+    # Строки по возрастанию id пачками по batch_size, каждая пачка - отдельный короткий запрос
+    while True:
+        rows = db_session.query(*columns)\
+            .filter(id_column > lower, id_column <= upper, *conditions)\
+            .order_by(id_column).limit(batch_size).all()
+        db_session.commit() # Не держим транзакцию чтения между пачками
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        lower = rows[-1].id
+
+
+def iter_raw_visits(db_session, visit_model, flt, limit=None, batch_size=EXPORT_BATCH_SIZE):
+    # Keyset-проход по id. С user_id - по индексу (user_id, id), с path_prefix - по индексу
+    # (path_id, id) для каждого подходящего пути с объединением по id: просматриваются только
+    # выгружаемые строки, а не весь диапазон id.
+    lower, upper = resolve_id_bounds(db_session, visit_model, flt)
+    if lower is None:
+        return
+    conditions = []
+    # Временные границы проверяем и внутри диапазона id: порядок id и created_at может не совпадать
+    if flt.start is not None:
+        conditions.append(visit_model.created_at >= flt.start)
+    if flt.end is not None:
+        conditions.append(visit_model.created_at < flt.end)
+    path_ids = None
+    if flt.path_prefix:
+        path_ids = path_dictionary.prefix_ids(db_session, flt.path_prefix)
+        if not path_ids:
+            return
+    columns = [visit_model.id, visit_model.created_at, visit_model.user_id, visit_model.path_id,
+               visit_model.sample_weight]
+    if flt.user_id is not None:
+        conditions.append(visit_model.user_id == flt.user_id)
+        if path_ids is not None:
+            conditions.append(_path_condition(visit_model, path_ids, flt.path_prefix))
+        rows = _keyset_walk(db_session, columns, visit_model.id, conditions, lower, upper, batch_size)
+    elif path_ids is not None and len(path_ids) <= RAW_EXPORT_MAX_PATH_WALKS:
+        walks = [_keyset_walk(db_session, columns, visit_model.id, conditions + [visit_model.path_id == path_id],
+                              lower, upper, batch_size) for path_id in path_ids]
+        rows = heapq.merge(*walks, key=lambda row: row.id)
+    else:
+        # Префикс охватывает много страниц - выгрузка близка к полной, идем по первичному ключу
+        if path_ids is not None:
+            conditions.append(_path_condition(visit_model, path_ids, flt.path_prefix))
+        rows = _keyset_walk(db_session, columns, visit_model.id, conditions, lower, upper, batch_size)
+    if limit is not None:
+        rows = islice(rows, limit)
+    for batch in iter(lambda: list(islice(rows, batch_size)), []):
+        entries = path_dictionary.entries({row.path_id for row in batch})
+        yield [(row.id, row.created_at.isoformat(), row.user_id, entries[row.path_id].path, row.sample_weight,
+                entries[row.path_id].route) for row in batch]
+
+
+def _path_condition(visit_model, path_ids, prefix):
+    # Короткий список номеров - константой в запросе, длинный - подзапросом к словарю
+    if len(path_ids) <= RAW_EXPORT_MAX_PATH_IDS:
+        return visit_model.path_id.in_(path_ids)
+    return path_dictionary.prefix_filter(visit_model.path_id, prefix)
+
+
+def _parse_moment(value, is_end=False):
+    # Принимает дату (ГГГГ-ММ-ДД) или дату и время в ISO 8601.
+    # Дата в качестве конца диапазона включает весь этот день.
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value)
+    if is_end and len(value) == 10:
+        moment += timedelta(days=1)
+    return moment
+
+
+def parse_raw_export_filter(args):
+    # args - request.args или словарь опций CLI; при ошибке формата - ValueError
+    def optional_int(name):
+        value = args.get(name)
+        return int(value) if value not in (None, '') else None
+
+    return RawExportFilter(
+        start=_parse_moment(args.get('start')),
+        end=_parse_moment(args.get('end'), is_end=True),
+        user_id=optional_int('user_id'),
+        path_prefix=args.get('path_prefix') or None,
+        after_id=optional_int('after_id') or 0,
+        until_id=optional_int('until_id'),
+    )
+
+
+def raw_export_chunks(db_session, visit_model, flt, fmt, limit=None):
+    batches = iter_raw_visits(db_session, visit_model, flt, limit=limit)
+    if fmt == 'ndjson':
+        return ndjson_stream(batches, RAW_EXPORT_COLUMNS)
+    return csv_stream(RAW_EXPORT_COLUMNS, batches)
@@ -0,0 +1,100 @@
+# app/logs/pagination.py
+# Keyset (курсорная) пагинация: вместо OFFSET и COUNT(*) следующая страница
+# выбирается условием (created_at, id) < (последняя запись), что использует индекс
+# и работает одинаково быстро на любой глубине. Используется журналом посещений
+# и списком пользователей.
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+DIRECTION_NEXT = 'n'
+DIRECTION_PREV = 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Значения ключа сортировки: даты передаются в курсоре в ISO-формате с пометкой типа
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    if value is not None and not isinstance(value, (str, int, float)):
+        raise TypeError(value)
+    return value
+
+
+def encode_cursor(sort_values, row_id, direction):
+    payload = json.dumps([[_dump_value(v) for v in sort_values], row_id, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        sort_values, row_id, direction = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in (DIRECTION_NEXT, DIRECTION_PREV):
+            raise ValueError(direction)
+        return [_load_value(v) for v in sort_values], int(row_id), direction
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor(f'Invalid pagination cursor: {token!r}') from e
+
+
+class KeysetPage:
+    def __init__(self, items, sort_keys, has_next, has_prev):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = None
+        self.prev_cursor = None
+        if items and has_next:
+            last = items[-1]
+            self.next_cursor = encode_cursor([getattr(last, key) for key in sort_keys], last.id, DIRECTION_NEXT)
+        if items and has_prev:
+            first = items[0]
+            self.prev_cursor = encode_cursor([getattr(first, key) for key in sort_keys], first.id, DIRECTION_PREV)
+
+
+def keyset_paginate(query, sort_columns, id_column, cursor=None, per_page=15, descending=True):
+    # Записи отдаются по (sort_columns..., id_column): по умолчанию по убыванию (новые сначала).
+    # sort_columns - колонка или кортеж колонок; значения в них не должны быть NULL,
+    # иначе сравнение кортежей не найдет продолжение
+    if not isinstance(sort_columns, (list, tuple)):
+        sort_columns = (sort_columns,)
+    columns = tuple(sort_columns) + (id_column,)
+    key = tuple_(*columns)
+    direction = DIRECTION_NEXT
+    if cursor:
+        sort_values, row_id, direction = decode_cursor(cursor)
+        if len(sort_values) != len(sort_columns):
+            raise InvalidCursor(f'Invalid pagination cursor: {cursor!r}')
+        bound = tuple_(*sort_values, row_id)
+        # "Вперед" по убыванию и "назад" по возрастанию - это записи меньше курсора
+        if (direction == DIRECTION_NEXT) == descending:
+            query = query.filter(key < bound)
+        else:
+            query = query.filter(key > bound)
+
+    if (direction == DIRECTION_NEXT) == descending:
+        query = query.order_by(*(column.desc() for column in columns))
+    else:
+        query = query.order_by(*(column.asc() for column in columns))
+
+    # Берем на одну запись больше, чтобы узнать, есть ли еще страница в этом направлении
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    sort_keys = [column.key for column in sort_columns]
+    if direction == DIRECTION_NEXT:
+        return KeysetPage(rows, sort_keys, has_next=has_more, has_prev=cursor is not None)
+    rows.reverse()
+    return KeysetPage(rows, sort_keys, has_next=True, has_prev=has_more)
@@ -0,0 +1,140 @@
+# app/logs/report_cache.py
+# Кэш готовых отчетов (HTML и CSV) и условные запросы к ним.
+# Версия отчета - номер последнего учтенного посещения (RollupState.last_visit_id) и метки
+# изменения пользователей и счетчиков (app/stamps.py). Запрос отчета только читает эту позицию:
+# счетчики догоняет фоновый поток буфера журнала или `flask logs refresh-rollups`, а не запрос.
+# Пока версия не изменилась:
+# - браузер с тем же ETag получает 304 Not Modified без тела;
+# - остальные получают ранее сформированный ответ из ограниченного LRU-кэша процесса.
+# Если отчеты читают снимок аналитической базы (app/analytics.py), версия - метка снимка:
+# счетчики в нем догоняет задание копирования, запрос к рабочей базе не обращается.
+# При REPORT_CACHE_STALE_SECONDS > 0 ответ из кэша отдается без проверки версии (и без
+# обращения к БД), если он был сформирован или подтвержден не раньше стольких секунд назад.
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from flask import Response, make_response, request, session
+from flask_login import current_user
+
+from ..cache import LRUCache
+from ..analytics import analytics_snapshot
+from ..stamps import read_stamp, USERS_STAMP, ROLLUPS_STAMP
+from .rollups import rollup_high_water
+
+# Заголовки исходного ответа, которые сохраняются вместе с телом
+KEPT_HEADERS = ('Content-Type', 'Content-Disposition')
+
+
+class CachedReport:
+    __slots__ = ('version', 'etag', 'body', 'headers', 'last_modified', 'checked_at')
+
+    def __init__(self, version, etag, body, headers, last_modified):
+        self.version = version
+        self.etag = etag
+        self.body = body
+        self.headers = headers
+        self.last_modified = last_modified
+        self.checked_at = time.monotonic()
+
+    def response(self):
+        response = Response(self.body, headers=self.headers)
+        return _conditional(response, self.etag, self.last_modified)
+
+
+class ReportCache:
+    def __init__(self, app=None):
+        self._cache = LRUCache()
+        self.max_bytes = 1024 * 1024
+        self.stale_seconds = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._cache = LRUCache(maxsize=app.config.get('REPORT_CACHE_SIZE', 128))
+        self.max_bytes = app.config.get('REPORT_CACHE_MAX_BYTES', 1024 * 1024)
+        self.stale_seconds = app.config.get('REPORT_CACHE_STALE_SECONDS', 0)
+        app.extensions['report_cache'] = self
+
+    def respond(self, kind, build, per_user=False):
+        # build() формирует ответ (render_template или потоковый CSV) по счетчикам
+        # на позицию rollup_high_water(). per_user - HTML со страницей навигации,
+        # где выводится имя текущего пользователя: кэшируется отдельно для каждого
+        if per_user and session.get('_flashes'):
+            # Страница покажет flash-сообщения: ее нельзя ни кэшировать, ни отдать из кэша
+            return build()
+
+        key = (kind, tuple(sorted(request.args.items(multi=True))), current_user.get_id() if per_user else None)
+        entry = self._cache.get(key)
+        if entry is not None and self.stale_seconds and time.monotonic() - entry.checked_at <= self.stale_seconds:
+            return entry.response()
+
+        version = _report_version()
+        if entry is not None and entry.version == version:
+            entry.checked_at = time.monotonic()
+            return entry.response()
+
+        etag = hashlib.sha1(repr((key, version)).encode()).hexdigest()[:20]
+        # Слабое сравнение: ответ, сжатый на лету, отдается со слабым ETag (см. app/compression.py)
+        if request.if_none_match.contains_weak(etag):
+            # Версия у клиента актуальна, а в кэше процесса ответа нет (вытеснен или другой воркер)
+            return _conditional(Response(status=304), etag, None)
+
+        last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        response = make_response(build())
+        headers = [(name, response.headers[name]) for name in KEPT_HEADERS if name in response.headers]
+        if response.is_streamed:
+            # Потоковый ответ запоминается по мере отдачи, если уложился в max_bytes
+            response.response = self._tee(response.response, key, version, etag, headers, last_modified)
+        else:
+            body = response.get_data()
+            if len(body) <= self.max_bytes:
+                self._cache.set(key, CachedReport(version, etag, body, headers, last_modified))
+        return _conditional(response, etag, last_modified)
+
+    def _tee(self, chunks, key, version, etag, headers, last_modified):
+        parts = []
+        size = 0
+        try:
+            for chunk in chunks:
+                if parts is not None:
+                    size += len(chunk)
+                    if size <= self.max_bytes:
+                        parts.append(chunk)
+                    else:
+                        parts = None
+                yield chunk
+        finally:
+            # Исходный поток держит контекст запроса и курсор БД: закрываем его и при обрыве соединения
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        if parts is not None:
+            self._cache.set(key, CachedReport(version, etag, b''.join(parts), headers, last_modified))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return dict(self._cache.stats(), stale_seconds=self.stale_seconds)
+
+
+def _report_version():
+    snapshot = analytics_snapshot.version()
+    if snapshot is not None:
+        return ('snapshot', snapshot, read_stamp(USERS_STAMP))
+    return (rollup_high_water(), read_stamp(USERS_STAMP), read_stamp(ROLLUPS_STAMP))
+
+
+def _conditional(response, etag, last_modified):
+    # Отчеты видны только администраторам: браузер может хранить копию, но обязан ее проверять
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if response.status_code == 304:
+        return response
+    return response.make_conditional(request)
+
+
+report_cache = ReportCache()
@@ -0,0 +1,166 @@
+# app/logs/retention.py
+# Хранение журнала посещений: в visit_logs остается "горячее" окно последних дней,
+# более старые записи помесячно переносятся в сжатые файлы NDJSON (gzip) в каталоге архива.
+# Счетчики отчетов (rollups) при этом не удаляются, поэтому статистика за архивные
+# месяцы остается доступной без чтения самих файлов.
+import gzip
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, text
+
+from ..models import db, VisitLog, VisitLogArchive
+from ..stamps import touch_stamp, ROLLUPS_STAMP
+from ..analytics import report_session
+from .export import RawExportFilter, iter_raw_visits, ndjson_stream, RAW_EXPORT_COLUMNS
+from .rollups import refresh_rollups
+
+DELETE_BATCH_SIZE = 5000
+
+
+def archive_dir():
+    path = current_app.config.get('VISIT_LOG_ARCHIVE_DIR') or os.path.join(current_app.instance_path, 'archive')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def archive_boundary():
+    # Дата, до которой (не включительно) журнал перенесен в архив; None - архива нет (для отчетов)
+    return report_session().query(func.max(VisitLogArchive.period_end)).scalar()
+
+
+def retention_cutoff(retention_days, today=None):
+    # Архивируются только целые месяцы, закончившиеся раньше начала горячего окна
+    today = today or datetime.utcnow().date()
+    window_start = today - timedelta(days=retention_days)
+    return window_start.replace(day=1)
+
+
+def _day_start(day):
+    return datetime.combine(day, datetime.min.time())
+
+
+def _month_filter(period_start, period_end):
+    return (VisitLog.created_at >= _day_start(period_start), VisitLog.created_at < _day_start(period_end))
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _months_to_archive(cutoff):
+    oldest = db.session.query(func.min(VisitLog.created_at)).scalar()
+    if oldest is None:
+        return
+    month = oldest.date().replace(day=1)
+    while month < cutoff:
+        yield month, _next_month(month)
+        month = _next_month(month)
+
+
+def _delete_month_rows(period_start, period_end, first_id, last_id):
+    # Удаление короткими транзакциями, чтобы не блокировать запись журнала надолго
+    deleted = 0
+    lower = first_id - 1
+    while lower < last_id:
+        upper = min(last_id, lower + DELETE_BATCH_SIZE)
+        deleted += VisitLog.query.filter(
+            VisitLog.id > lower, VisitLog.id <= upper, *_month_filter(period_start, period_end)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        lower = upper
+    return deleted
+
+
+def _delete_segment_rows(segment):
+    # Удаляет строки сегмента и отмечает это: повторно сегмент не просматривается
+    deleted = _delete_month_rows(segment.period_start, segment.period_end, segment.first_id, segment.last_id)
+    segment.deleted_at = datetime.utcnow()
+    db.session.commit()
+    return deleted
+
+
+def _write_segment(period_start, period_end):
+    month = period_start.strftime('%Y-%m')
+    segment_no = VisitLogArchive.query.filter_by(month=month).count() + 1
+    file_name = f'visit_logs_{month}.{segment_no}.ndjson.gz'
+    path = os.path.join(archive_dir(), file_name)
+    tmp_path = path + '.tmp'
+
+    stats = {'row_count': 0, 'first_id': None, 'last_id': None}
+
+    def tracked_batches():
+        flt = RawExportFilter(start=_day_start(period_start), end=_day_start(period_end))
+        for batch in iter_raw_visits(db.session, VisitLog, flt):
+            if stats['first_id'] is None:
+                stats['first_id'] = batch[0][0]
+            stats['last_id'] = batch[-1][0]
+            stats['row_count'] += len(batch)
+            yield batch
+
+    with gzip.open(tmp_path, 'wb') as f:
+        for chunk in ndjson_stream(tracked_batches(), RAW_EXPORT_COLUMNS):
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+    if not stats['row_count']:
+        os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, path)
+
+    segment = VisitLogArchive(month=month, period_start=period_start, period_end=period_end,
+                              file_name=file_name, **stats)
+    db.session.add(segment)
+    db.session.commit()
+    return segment
+
+
+def archive_old_visits(retention_days=None, dry_run=False, log=print):
+    # Возвращает список созданных сегментов архива
+    if retention_days is None:
+        retention_days = current_app.config.get('VISIT_LOG_RETENTION_DAYS', 90)
+    cutoff = retention_cutoff(retention_days)
+
+    # Все, что уходит в архив, должно быть уже учтено в счетчиках отчетов
+    refresh_rollups()
+
+    # Доудаляем строки сегментов, архивирование которых было прервано после записи файла
+    if not dry_run:
+        for segment in VisitLogArchive.query.filter(VisitLogArchive.deleted_at.is_(None)).all():
+            deleted = _delete_segment_rows(segment)
+            log(f'{segment.month}: finished interrupted archive {segment.file_name}, deleted {deleted}')
+
+    created = []
+    for period_start, period_end in list(_months_to_archive(cutoff)):
+        if dry_run:
+            rows = VisitLog.query.filter(*_month_filter(period_start, period_end)).count()
+            if rows:
+                log(f'{period_start:%Y-%m}: {rows} row(s) would be archived')
+            continue
+        segment = _write_segment(period_start, period_end)
+        if segment is None:
+            continue
+        deleted = _delete_segment_rows(segment)
+        log(f'{segment.month}: archived {segment.row_count} row(s) to {segment.file_name}, deleted {deleted}')
+        created.append(segment)
+    if created:
+        # Граница отчетов по умолчанию сдвинулась: кэшированные отчеты устарели
+        touch_stamp(ROLLUPS_STAMP)
+    return created
+
+
+def vacuum_database():
+    # Возвращает место на диске после удаления строк. При auto_vacuum=INCREMENTAL
+    # достаточно incremental_vacuum, иначе нужен полный VACUUM (блокирует БД на время работы)
+    engine = db.session.get_bind(mapper=VisitLog.__mapper__)
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        mode = conn.execute(text('PRAGMA auto_vacuum')).scalar()
+        if mode == 2:
+            conn.execute(text('PRAGMA incremental_vacuum'))
+        else:
+            conn.execute(text('VACUUM'))
+
@@ -0,0 +1,158 @@
+# app/logs/rollups.py
+# Инкрементальное обновление дневных счетчиков посещений по страницам и пользователям.
+# Отчеты читают эти таблицы вместо GROUP BY по всему visit_logs, поэтому их стоимость
+# зависит от числа различных страниц/пользователей, а не от числа посещений.
+from datetime import date
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from ..models import db, VisitLog, PageVisitRollup, RouteVisitRollup, UserVisitRollup, RollupState, VisitLogArchive
+from ..stamps import touch_stamp, ROLLUPS_STAMP
+from ..visit_paths import path_dictionary
+from ..analytics import report_session
+from .visitors import update_sketches, clear_sketches
+
+ROLLUP_STATE_NAME = 'visits'
+ANONYMOUS_USER_ID = 0
+REFRESH_BATCH_SIZE = 50000
+
+
+def _upsert(model, rows, key_columns):
+    # INSERT ... ON CONFLICT DO UPDATE SET visit_count = visit_count + excluded.visit_count
+    if not rows:
+        return
+    dialect = db.session.get_bind(mapper=model.__mapper__).dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    stmt = insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={'visit_count': model.visit_count + stmt.excluded.visit_count},
+    )
+    db.session.execute(stmt, rows)
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+
+def _aggregate_range(first_id, last_id):
+    # Агрегирует посещения с id в (first_id, last_id] и добавляет их к счетчикам
+    day = func.date(VisitLog.created_at)
+    id_range = (VisitLog.id > first_id, VisitLog.id <= last_id)
+    # Записи из выборки учитываются с весом (sample_weight), поэтому счетчики - оценка числа посещений
+    visits = func.sum(func.coalesce(VisitLog.sample_weight, 1))
+
+    # Группировка по номеру пути; строки путей и шаблоны маршрутов берутся из словаря visit_paths
+    page_rows = db.session.query(day, VisitLog.path_id, visits)\
+        .filter(*id_range).group_by(day, VisitLog.path_id).all()
+    entries = path_dictionary.entries({path_id for _, path_id, _ in page_rows})
+    route_counts = {}
+    for d, path_id, n in page_rows:
+        key = (_as_date(d), entries[path_id].route or '')
+        route_counts[key] = route_counts.get(key, 0) + n
+    _upsert(PageVisitRollup,
+            [{'day': _as_date(d), 'path': entries[path_id].path, 'visit_count': n} for d, path_id, n in page_rows],
+            ['day', 'path'])
+    _upsert(RouteVisitRollup,
+            [{'day': d, 'route': route, 'visit_count': n} for (d, route), n in route_counts.items()],
+            ['day', 'route'])
+
+    user_key = func.coalesce(VisitLog.user_id, ANONYMOUS_USER_ID)
+    user_rows = db.session.query(day, user_key, visits)\
+        .filter(*id_range).group_by(day, user_key).all()
+    _upsert(UserVisitRollup,
+            [{'day': _as_date(d), 'user_id': user_id, 'visit_count': n} for d, user_id, n in user_rows],
+            ['day', 'user_id'])
+
+    # Уникальные посетители и самые посещаемые страницы (см. visitors.py)
+    update_sketches(first_id, last_id)
+
+
+def refresh_rollups(batch_size=REFRESH_BATCH_SIZE):
+    # Догоняет счетчики до текущего конца журнала порциями по batch_size записей.
+    # Каждая порция - отдельная короткая транзакция; позиция сдвигается условным UPDATE,
+    # поэтому если параллельно то же самое сделал другой воркер, наша порция откатывается.
+    # Опирается на то, что id в SQLite выдаются в порядке фиксации транзакций.
+    processed = 0
+    while True:
+        state = db.session.get(RollupState, ROLLUP_STATE_NAME)
+        if state is None:
+            state = RollupState(name=ROLLUP_STATE_NAME, last_visit_id=0)
+            db.session.add(state)
+            db.session.flush()
+        first_id = state.last_visit_id
+        max_id = db.session.query(func.max(VisitLog.id)).scalar() or 0
+        if max_id <= first_id:
+            db.session.commit()
+            return processed
+        last_id = min(max_id, first_id + batch_size)
+
+        _aggregate_range(first_id, last_id)
+        moved = db.session.query(RollupState)\
+            .filter(RollupState.name == ROLLUP_STATE_NAME, RollupState.last_visit_id == first_id)\
+            .update({'last_visit_id': last_id}, synchronize_session=False)
+        if not moved:
+            db.session.rollback()
+            continue
+        db.session.commit()
+        processed += last_id - first_id
+
+
+def rebuild_rollups():
+    # Полный пересчет: очищает счетчики и заново проходит весь журнал.
+    # Счетчики за месяцы, уже перенесенные в архив, сохраняются - исходных строк для них нет.
+    boundary = db.session.query(func.max(VisitLogArchive.period_end)).scalar()
+    for model in (PageVisitRollup, RouteVisitRollup, UserVisitRollup):
+        rollups = db.session.query(model)
+        if boundary is not None:
+            rollups = rollups.filter(model.day >= boundary)
+        rollups.delete(synchronize_session=False)
+    clear_sketches(boundary)
+    db.session.query(RollupState).filter(RollupState.name == ROLLUP_STATE_NAME).delete()
+    db.session.commit()
+    processed = refresh_rollups()
+    touch_stamp(ROLLUPS_STAMP)
+    return processed
+
+
+# Номер последнего посещения, учтенного в счетчиках (версия отчетов, см. report_cache.py)
+def rollup_high_water():
+    state = db.session.get(RollupState, ROLLUP_STATE_NAME)
+    return state.last_visit_id if state is not None else 0
+
+
+def reassign_user_rollups(user_id):
+    # Переносит счетчики удаляемого пользователя в неаутентифицированных (в рамках текущей транзакции)
+    rows = db.session.query(UserVisitRollup.day, UserVisitRollup.visit_count)\
+        .filter(UserVisitRollup.user_id == user_id).all()
+    _upsert(UserVisitRollup,
+            [{'day': d, 'user_id': ANONYMOUS_USER_ID, 'visit_count': n} for d, n in rows],
+            ['day', 'user_id'])
+    db.session.query(UserVisitRollup).filter(UserVisitRollup.user_id == user_id)\
+        .delete(synchronize_session=False)
+
+
+# Запросы отчетов читают снимок аналитической базы, если он настроен (см. app/analytics.py)
+def _in_range(query, day_column, start=None, end=None):
+    if start is not None:
+        query = query.filter(day_column >= start)
+    if end is not None:
+        query = query.filter(day_column <= end)
+    return query
+
+
+def page_stats_query(start=None, end=None, by_route=False):
+    # by_route - по шаблонам маршрутов (/user/<int:id>) вместо конкретных путей; колонка все равно path
+    model, key = (RouteVisitRollup, RouteVisitRollup.route) if by_route else (PageVisitRollup, PageVisitRollup.path)
+    visit_count = func.sum(model.visit_count).label('visit_count')
+    query = report_session().query(key.label('path'), visit_count)
+    query = _in_range(query, model.day, start, end)
+    return query.group_by(key).order_by(visit_count.desc(), key)
+
+
+def user_stats_query(start=None, end=None):
+    visit_count = func.sum(UserVisitRollup.visit_count).label('visit_count')
+    query = report_session().query(UserVisitRollup.user_id, visit_count)
+    query = _in_range(query, UserVisitRollup.day, start, end)
+    return query.group_by(UserVisitRollup.user_id).order_by(visit_count.desc(), UserVisitRollup.user_id)
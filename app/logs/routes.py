@@ -1,164 +1,385 @@
 # app/logs/routes.py
-from flask import render_template, request, abort, Response, stream_with_context
+from flask import render_template, request, abort, jsonify, current_app, Response
 from flask_login import current_user, login_required
-from sqlalchemy import func, desc
+from sqlalchemy import func
 from . import logs_bp # Импорт Blueprint из текущего пакета (__init__.py)
 from ..models import db, VisitLog, User # Импорт моделей из родительского пакета
 from ..decorators import check_rights # Импорт декоратора
-import csv
-import io
-from datetime import datetime
+from ..visit_buffer import visit_buffer
+from ..identity import user_cache
+from ..roles import role_registry
+from ..cache import LRUCache
+from ..metrics import metrics
+from ..visit_paths import path_dictionary
+from ..analytics import analytics_snapshot, report_session, move_to_analytics
+from ..templating import render_page, RowStream
+from ..live import live_feed, sse_stream
+from .pagination import keyset_paginate, InvalidCursor
+from .export import (iter_batches, csv_response, stream_response, parse_raw_export_filter,
+                     raw_export_chunks, gzip_stream, RAW_EXPORT_FORMATS)
+from .report_cache import report_cache
+from .retention import archive_boundary, archive_old_visits, vacuum_database
+from .rollups import refresh_rollups, rebuild_rollups, page_stats_query, user_stats_query, ANONYMOUS_USER_ID
+from .visitors import unique_visitors, top_pages, HIT_SKETCH_RETENTION_HOURS
+import click
+import hmac
+import time
+from datetime import date
 
 # Константа для количества записей на странице
 LOGS_PER_PAGE = 15
 
-# 1. Главная страница журнала посещений (с пагинацией)
+# Кэш приблизительного числа записей журнала (ключ - user_id или None для админа)
+_total_cache = LRUCache(maxsize=4096)
+
+def _visit_log_total(user_id):
+    ttl = current_app.config.get('VISIT_LOG_TOTAL_CACHE_SECONDS', 60)
+    if user_id is None:
+        # Для всего журнала COUNT(*) слишком дорог: оценка по диапазону первичного ключа
+        def count():
+            min_id, max_id = db.session.query(func.min(VisitLog.id), func.max(VisitLog.id)).one()
+            return (max_id - min_id + 1) if max_id is not None else 0
+    else:
+        # Для одного пользователя COUNT идет по индексу (user_id, created_at)
+        def count():
+            return db.session.query(func.count(VisitLog.id)).filter(VisitLog.user_id == user_id).scalar()
+    return _total_cache.get_or_set(user_id, count, ttl=ttl)
+
+# 1. Главная страница журнала посещений (с курсорной пагинацией)
 @logs_bp.route('/')
 @login_required
 # @check_rights('User') # Доступен всем залогиненным, но фильтрация ниже
 def visit_log_index():
-    page = request.args.get('page', 1, type=int)
-    query = VisitLog.query.order_by(VisitLog.created_at.desc())
+    cursor = request.args.get('cursor')
+    query = VisitLog.query
+    is_admin = current_user.is_admin()
 
     # Фильтрация для роли 'User': видит только свои логи
-    if not current_user.is_admin():
-        query = query.filter(VisitLog.user_id == current_user.id)
+    filter_user_id = None if is_admin else current_user.id
+    if filter_user_id is not None:
+        query = query.filter(VisitLog.user_id == filter_user_id)
 
-    # Выполняем запрос с пагинацией
-    pagination = query.paginate(page=page, per_page=LOGS_PER_PAGE, error_out=False)
+    try:
+        pagination = keyset_paginate(query, VisitLog.created_at, VisitLog.id,
+                                     cursor=cursor, per_page=LOGS_PER_PAGE)
+    except InvalidCursor:
+        abort(400)
     logs = pagination.items
 
     # Получаем пользователей для отображения имен (оптимизируем запрос)
     user_ids = {log.user_id for log in logs if log.user_id}
     users = User.query.filter(User.id.in_(user_ids)).all()
     users_map = {user.id: user for user in users}
+    paths_map = path_dictionary.entries({log.path_id for log in logs})
+
+    total = None
+    if current_app.config.get('VISIT_LOG_SHOW_TOTAL', True):
+        total = _visit_log_total(filter_user_id)
 
     return render_template('logs/visit_log_index.html', 
                            logs=logs, 
                            users_map=users_map, 
+                           paths_map=paths_map,
                            pagination=pagination,
-                           is_admin=current_user.is_admin()) # Передаем флаг админа
+                           total=total,
+                           is_admin=is_admin) # Передаем флаг админа
+
+ANONYMOUS_USER_NAME = "Неаутентифицированный пользователь"
+
+# Диапазон дат отчета из параметров ?start=ГГГГ-ММ-ДД&end=ГГГГ-ММ-ДД (обе границы включительно)
+def _report_date_range():
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = date.fromisoformat(start) if start else None
+        end = date.fromisoformat(end) if end else None
+    except ValueError:
+        abort(400)
+    # Месяцы, перенесенные в архив, попадают в отчет только по запросу (?archived=1)
+    # или если начало диапазона задано явно
+    archived_before = None
+    if start is None and request.args.get('archived') != '1':
+        archived_before = archive_boundary()
+        start = archived_before
+    return start, end, archived_before
+
+# Группировка отчета по страницам: ?group=route - по шаблонам маршрутов (/user/<int:id>)
+def _group_by_route():
+    return request.args.get('group') == 'route'
+
+# Выгрузка в gzip по параметру ?gzip=1
+def _export_gzip():
+    return request.args.get('gzip', '0') not in ('', '0', 'false')
+
+# Подписи пользователей для отчета: имена подгружаем одним запросом на пачку строк
+def _with_user_names(records):
+    user_ids = [record.user_id for record in records if record.user_id != ANONYMOUS_USER_ID]
+    users_map = {user.id: user for user in User.query.filter(User.id.in_(user_ids)).all()} if user_ids else {}
+
+    # Формируем данные, обрабатывая неаутентифицированных и удаленных пользователей
+    processed_stats = []
+    for record in records:
+        user = users_map.get(record.user_id)
+        if record.user_id == ANONYMOUS_USER_ID:
+            user_name = ANONYMOUS_USER_NAME
+        elif user is None:
+            user_name = f"Пользователь ID: {record.user_id} (удален?)"
+        else:
+            parts = [user.last_name, user.first_name, user.middle_name]
+            user_name = " ".join(filter(None, parts)) or user.username # Используем username если ФИО пустое
+        processed_stats.append({
+            'user_name': user_name,
+            'visit_count': record.visit_count,
+            'user_id': record.user_id if user is not None else None # Для ссылки на профиль
+        })
+    return processed_stats
 
 # 2. Отчет по страницам
+# Отчеты и их выгрузки отдаются через кэш отчетов (см. report_cache.py): он же перед
+# формированием догоняет дневные счетчики до конца журнала и отвечает 304 на повторные запросы
 @logs_bp.route('/pages')
 @login_required
 @check_rights('Admin') # Только админ может смотреть статистику
 def page_stats():
-    stats = db.session.query(
-        VisitLog.path,
-        func.count(VisitLog.id).label('visit_count')
-    ).group_by(VisitLog.path)\
-     .order_by(desc('visit_count'))\
-     .all()
-    
-    return render_template('logs/page_stats.html', stats=stats)
+    def build():
+        start, end, archived_before = _report_date_range()
+        by_route = _group_by_route()
+        # Строки читаются из курсора пачками, пока страница отдается потоком
+        stats = RowStream(iter_batches(report_session(), page_stats_query(start, end, by_route=by_route)))
+        return render_page('logs/page_stats.html', stats=stats, start=start, end=end,
+                           archived_before=archived_before, group='route' if by_route else None)
+    return report_cache.respond('page_stats', build, per_user=True)
 
 # 3. Экспорт отчета по страницам в CSV
 @logs_bp.route('/pages/export')
 @login_required
 @check_rights('Admin')
 def export_page_stats_csv():
-    stats = db.session.query(
-        VisitLog.path,
-        func.count(VisitLog.id).label('visit_count')
-    ).group_by(VisitLog.path)\
-     .order_by(desc('visit_count'))\
-     .all()
-
-    # Используем stream_with_context для генерации больших файлов без хранения в памяти
-    def generate():
-        data = io.StringIO()
-        writer = csv.writer(data)
-        
-        # Заголовок CSV
-        writer.writerow(['Страница', 'Количество посещений'])
-        yield data.getvalue() # Отправляем заголовок
-        data.seek(0)
-        data.truncate(0)
-        
-        # Строки данных
-        for i, record in enumerate(stats):
-            writer.writerow([record.path, record.visit_count])
-            yield data.getvalue()
-            data.seek(0)
-            data.truncate(0)
-
-    response = Response(stream_with_context(generate()), mimetype='text/csv')
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    response.headers['Content-Disposition'] = f'attachment; filename=page_stats_{timestamp}.csv'
-    return response
+    def build():
+        start, end, archived_before = _report_date_range()
+        by_route = _group_by_route()
+
+        # Строки читаются из курсора пачками прямо во время отдачи ответа
+        def rows():
+            for batch in iter_batches(report_session(), page_stats_query(start, end, by_route=by_route)):
+                yield [(record.path, record.visit_count) for record in batch]
+
+        header = 'Маршрут' if by_route else 'Страница'
+        return csv_response([header, 'Количество посещений'], rows(), 'page_stats', gzip=_export_gzip())
+    return report_cache.respond('page_stats_csv', build)
 
 # 4. Отчет по пользователям
 @logs_bp.route('/users')
 @login_required
 @check_rights('Admin')
 def user_stats():
-    stats = db.session.query(
-        VisitLog.user_id,
-        User.last_name,
-        User.first_name,
-        User.middle_name,
-        User.username, # На случай если ФИО нет
-        func.count(VisitLog.id).label('visit_count')
-    ).outerjoin(User, VisitLog.user_id == User.id)\
-     .group_by(VisitLog.user_id, User.last_name, User.first_name, User.middle_name, User.username)\
-     .order_by(desc('visit_count'))\
-     .all()
-
-    # Формируем данные для шаблона, обрабатывая неаутентифицированных пользователей
-    processed_stats = []
-    for record in stats:
-        if record.user_id is None:
-            user_name = "Неаутентифицированный пользователь"
-        else:
-             parts = [record.last_name, record.first_name, record.middle_name]
-             user_name = " ".join(filter(None, parts)) or record.username # Используем username если ФИО пустое
-        processed_stats.append({
-            'user_name': user_name,
-            'visit_count': record.visit_count,
-            'user_id': record.user_id # Может понадобиться для ссылки на профиль
-        })
-
-    return render_template('logs/user_stats.html', stats=processed_stats)
+    def build():
+        start, end, archived_before = _report_date_range()
+        batches = iter_batches(report_session(), user_stats_query(start, end))
+        processed_stats = RowStream(_with_user_names(batch) for batch in batches)
+        return render_page('logs/user_stats.html', stats=processed_stats, start=start, end=end,
+                           archived_before=archived_before)
+    return report_cache.respond('user_stats', build, per_user=True)
 
 # 5. Экспорт отчета по пользователям в CSV
 @logs_bp.route('/users/export')
 @login_required
 @check_rights('Admin')
 def export_user_stats_csv():
-    stats = db.session.query(
-        VisitLog.user_id,
-        User.last_name,
-        User.first_name,
-        User.middle_name,
-        User.username, 
-        func.count(VisitLog.id).label('visit_count')
-    ).outerjoin(User, VisitLog.user_id == User.id)\
-     .group_by(VisitLog.user_id, User.last_name, User.first_name, User.middle_name, User.username)\
-     .order_by(desc('visit_count'))\
-     .all()
-
-    def generate():
-        data = io.StringIO()
-        writer = csv.writer(data)
-        
-        writer.writerow(['Пользователь', 'Количество посещений'])
-        yield data.getvalue()
-        data.seek(0)
-        data.truncate(0)
-        
-        for record in stats:
-            if record.user_id is None:
-                user_name = "Неаутентифицированный пользователь"
-            else:
-                 parts = [record.last_name, record.first_name, record.middle_name]
-                 user_name = " ".join(filter(None, parts)) or record.username
-            writer.writerow([user_name, record.visit_count])
-            yield data.getvalue()
-            data.seek(0)
-            data.truncate(0)
-
-    response = Response(stream_with_context(generate()), mimetype='text/csv')
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    response.headers['Content-Disposition'] = f'attachment; filename=user_stats_{timestamp}.csv'
-    return response
\ No newline at end of file
+    def build():
+        start, end, archived_before = _report_date_range()
+
+        def rows():
+            for batch in iter_batches(report_session(), user_stats_query(start, end)):
+                yield [(record['user_name'], record['visit_count']) for record in _with_user_names(batch)]
+
+        return csv_response(['Пользователь', 'Количество посещений'], rows(), 'user_stats', gzip=_export_gzip())
+    return report_cache.respond('user_stats_csv', build)
+
+# 5a. Уникальные посетители по страницам и дням (оценка HyperLogLog, см. visitors.py)
+@logs_bp.route('/visitors')
+@login_required
+@check_rights('Admin')
+def unique_visitors_stats():
+    def build():
+        start, end, archived_before = _report_date_range()
+        report = unique_visitors(start, end)
+        return render_template('logs/unique_visitors.html', report=report, start=start, end=end,
+                               archived_before=archived_before)
+    return report_cache.respond('unique_visitors', build, per_user=True)
+
+# 5b. Самые посещаемые страницы за последние часы: ?hours=24&limit=20
+@logs_bp.route('/top')
+@login_required
+@check_rights('Admin')
+def top_pages_stats():
+    def build():
+        hours = request.args.get('hours', 24, type=int)
+        limit = request.args.get('limit', 20, type=int)
+        report = top_pages(hours=hours, limit=max(1, min(limit, 100)))
+        return render_template('logs/top_pages.html', report=report, hours=hours,
+                               max_hours=HIT_SKETCH_RETENTION_HOURS)
+    return report_cache.respond('top_pages', build, per_user=True)
+
+# 6. Выгрузка сырых записей журнала: ?start=&end=&user_id=&path_prefix=&format=csv|ndjson&gzip=1
+# Ответ ограничен RAW_EXPORT_MAX_ROWS строками; продолжить можно с ?after_id=<последний id>
+# и ?until_id=<значение заголовка X-Export-Until-Id>, чтобы набор данных не менялся.
+@logs_bp.route('/export/raw')
+@login_required
+@check_rights('Admin')
+def export_raw_visits():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in RAW_EXPORT_FORMATS:
+        abort(400)
+    try:
+        flt = parse_raw_export_filter(request.args)
+    except ValueError:
+        abort(400)
+    max_rows = current_app.config.get('RAW_EXPORT_MAX_ROWS', 1000000)
+    limit = min(request.args.get('limit', max_rows, type=int), max_rows)
+    # Длинная выгрузка читает снимок аналитической базы, если он настроен
+    session = report_session()
+    if flt.until_id is None:
+        flt.until_id = session.query(func.max(VisitLog.id)).scalar() or 0
+
+    chunks = raw_export_chunks(session, VisitLog, flt, fmt, limit=limit)
+    response = stream_response(chunks, 'visit_logs', fmt, RAW_EXPORT_FORMATS[fmt], gzip=_export_gzip())
+    response.headers['X-Export-Until-Id'] = str(flt.until_id)
+    return response
+
+# 7. Счетчики буфера записи журнала (в очереди, записано, отброшено)
+@logs_bp.route('/buffer')
+@login_required
+@check_rights('Admin')
+def visit_buffer_stats():
+    return jsonify(visit_buffer.stats())
+
+# 8. Статистика кэшей процесса (попадания/промахи)
+@logs_bp.route('/caches')
+@login_required
+@check_rights('Admin')
+def cache_stats():
+    return jsonify({'users': user_cache.stats(), 'roles': role_registry.stats(), 'reports': report_cache.stats(),
+                    'paths': path_dictionary.stats(), 'snapshot': analytics_snapshot.stats()})
+
+
+# 8a. Посещения в реальном времени: страница подписывается на /logs/live/stream (Server-Sent Events).
+# Лента берется из памяти процесса (app/live.py), поэтому ни страница, ни поток не читают журнал из БД.
+@logs_bp.route('/live')
+@login_required
+@check_rights('Admin')
+def live_visits():
+    return render_template('logs/live.html', enabled=live_feed.enabled, window=live_feed.window)
+
+@logs_bp.route('/live/stream')
+@login_required
+@check_rights('Admin')
+def live_stream():
+    if not live_feed.enabled:
+        abort(404)
+    last_seq = live_feed.subscribe()
+    if last_seq is None:
+        # Каждое подключение держит поток воркера: сверх предела браузер переподключится позже
+        response = Response('Too many live viewers\n', status=503, mimetype='text/plain')
+        response.headers['Retry-After'] = '30'
+        return response
+    # При переподключении EventSource присылает Last-Event-ID: досылаем пропущенное из буфера.
+    # При первом подключении (или если номер из другого процесса) - последние посещения из буфера
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None or after > last_seq:
+        after = max(0, last_seq - current_app.config.get('LIVE_INITIAL_VISITS', 50))
+    # Поток не держит контекст запроса (stream_with_context не нужен): он читает только буфер
+    response = Response(sse_stream(live_feed, after), mimetype='text/event-stream')
+    # Место освобождается и при обрыве до первого события (незапущенный генератор не выполняет finally)
+    response.call_on_close(live_feed.unsubscribe)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # nginx не должен копить поток в буфере
+    return response
+
+
+# 9. Метрики процесса в текстовом формате Prometheus.
+# Сборщик может передать METRICS_TOKEN в заголовке Authorization вместо входа администратора.
+@logs_bp.route('/metrics')
+def prometheus_metrics():
+    token = current_app.config.get('METRICS_TOKEN')
+    # Сравниваем байты: compare_digest не принимает строки с не-ASCII символами
+    authorization = request.headers.get('Authorization', '').encode()
+    if not (token and hmac.compare_digest(authorization, f'Bearer {token}'.encode())):
+        if not current_user.is_authenticated or not current_user.is_admin():
+            abort(403)
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Команды CLI: flask logs refresh-rollups [--rebuild]
+@logs_bp.cli.command('refresh-rollups')
+@click.option('--rebuild', is_flag=True, help='Пересчитать счетчики заново по всему журналу.')
+def refresh_rollups_command(rebuild):
+    processed = rebuild_rollups() if rebuild else refresh_rollups()
+    click.echo(f'Processed {processed} visit log record(s).')
+
+
+# flask logs snapshot [--every SECONDS] - обновить снимок аналитической базы для отчетов
+# (один раз - для cron, с --every - в цикле как отдельный процесс)
+@logs_bp.cli.command('snapshot')
+@click.option('--every', type=float, help='Повторять каждые столько секунд.')
+def snapshot_command(every):
+    if not analytics_snapshot.enabled:
+        raise click.ClickException('ANALYTICS_SNAPSHOT_PATH is not configured.')
+    while True:
+        processed = refresh_rollups()
+        try:
+            elapsed = analytics_snapshot.refresh()
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'Processed {processed} visit log record(s), snapshot copied in {elapsed:.2f}s.')
+        if not every:
+            return
+        time.sleep(every)
+
+
+# flask logs move-to-analytics [--drop-source] - один раз при включении ANALYTICS_DATABASE_URL,
+# пока воркеры остановлены: перенос накопленного журнала и счетчиков в отдельную базу
+@logs_bp.cli.command('move-to-analytics')
+@click.option('--drop-source', is_flag=True, help='Удалить перенесенные таблицы из основной базы.')
+def move_to_analytics_command(drop_source):
+    try:
+        moved = move_to_analytics(drop_source=drop_source, log=click.echo)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Moved {sum(moved.values())} row(s) from {len(moved)} table(s).')
+
+
+# flask logs export-raw [--start ...] [--end ...] [--user-id N] [--path-prefix /x] [--format ndjson] [--gzip] [-o FILE]
+@logs_bp.cli.command('export-raw')
+@click.option('--start', help='Начало диапазона (ГГГГ-ММ-ДД или ISO 8601).')
+@click.option('--end', help='Конец диапазона (дата включительно или ISO 8601).')
+@click.option('--user-id', type=int)
+@click.option('--path-prefix')
+@click.option('--after-id', type=int, default=0, help='Продолжить после записи с этим id.')
+@click.option('--format', 'fmt', type=click.Choice(list(RAW_EXPORT_FORMATS)), default='csv')
+@click.option('--gzip', 'use_gzip', is_flag=True)
+@click.option('-o', '--output', type=click.File('wb'), default='-')
+def export_raw_command(fmt, use_gzip, output, **options):
+    try:
+        flt = parse_raw_export_filter(options)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    chunks = raw_export_chunks(db.session, VisitLog, flt, fmt)
+    if use_gzip:
+        chunks = gzip_stream(chunks)
+    for chunk in chunks:
+        output.write(chunk)
+
+
+# flask logs archive [--retention-days N] [--vacuum] [--dry-run]
+@logs_bp.cli.command('archive')
+@click.option('--retention-days', type=int, help='Размер горячего окна в днях (по умолчанию VISIT_LOG_RETENTION_DAYS).')
+@click.option('--vacuum', is_flag=True, help='Освободить место в файле БД после удаления строк.')
+@click.option('--dry-run', is_flag=True, help='Только показать, что будет перенесено.')
+def archive_command(retention_days, vacuum, dry_run):
+    segments = archive_old_visits(retention_days, dry_run=dry_run, log=click.echo)
+    if not dry_run:
+        click.echo(f'Created {len(segments)} archive segment(s).')
+        if vacuum:
+            vacuum_database()
+            click.echo('Database vacuumed.')
@@ -0,0 +1,228 @@
+# app/logs/visitors.py
+# Уникальные посетители страниц по дням и самые посещаемые страницы за последние часы.
+# Точный подсчет потребовал бы COUNT(DISTINCT user_id) по всему visit_logs; вместо этого
+# новые записи журнала при обновлении дневных счетчиков (rollups.refresh_rollups) добавляются
+# в объединяемые сводки (app/sketches.py, там же - оценки погрешности):
+# - HyperLogLog на (день, страница) и на день по всем страницам - уникальные посетители;
+# - Count-Min с кандидатами в лидеры на каждый час - посещения страниц.
+# Отчет за период сливает сводки его дней (часов), поэтому его стоимость не зависит от объема
+# журнала. Чтобы она не росла и с числом страниц, рядом со сводкой хранится ее оценка за день:
+# страницы ранжируются по сумме дневных оценок в SQL, а сводки сливаются только для
+# VISITOR_CANDIDATES первых, из которых в отчет попадают VISITOR_PAGES_LIMIT.
+# Посетитель - вошедший пользователь: журнал не хранит ничего, что различало бы
+# неаутентифицированных посетителей, поэтому их посещения в число уникальных не входят.
+# Из HyperLogLog нельзя удалить значение: посещения удаленного пользователя остаются учтенными.
+from datetime import date, datetime, timedelta
+from heapq import nsmallest
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from ..models import db, VisitLog, PageVisitorSketch, PageHitSketch
+from ..sketches import HyperLogLog, CountMinSketch
+from ..visit_paths import path_dictionary
+from ..analytics import report_session
+
+ALL_PAGES = '' # Ключ сводки дня по всем страницам
+HLL_PRECISION = 12
+CMS_WIDTH = 1024
+CMS_DEPTH = 4
+TOP_CANDIDATES = 64
+VISITOR_PAGES_LIMIT = 50 # Страниц в отчете об уникальных посетителях
+VISITOR_CANDIDATES = 100 # Сколько страниц с наибольшей суммой дневных оценок сливать
+BACKFILL_BATCH_SIZE = 1000
+HIT_SKETCH_RETENTION_HOURS = 7 * 24 # Часовые сводки старше удаляются
+
+
+def _dialect():
+    return db.session.get_bind(mapper=VisitLog.__mapper__).dialect.name
+
+
+def _replace(model, rows, key_columns, columns=('sketch',)):
+    # INSERT ... ON CONFLICT DO UPDATE SET sketch = excluded.sketch (и другие columns)
+    if not rows:
+        return
+    insert = postgresql.insert if _dialect() == 'postgresql' else sqlite.insert
+    stmt = insert(model)
+    stmt = stmt.on_conflict_do_update(index_elements=key_columns,
+                                      set_={column: stmt.excluded[column] for column in columns})
+    db.session.execute(stmt, rows)
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def _hour(column):
+    if _dialect() == 'postgresql':
+        return func.date_trunc('hour', column)
+    return func.strftime('%Y-%m-%d %H:00:00', column)
+
+
+def _hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _update_visitor_sketches(id_range):
+    day = func.date(VisitLog.created_at)
+    rows = db.session.query(day, VisitLog.path_id, VisitLog.user_id)\
+        .filter(*id_range, VisitLog.user_id.isnot(None)).distinct().all()
+    if not rows:
+        return
+    entries = path_dictionary.entries({path_id for _, path_id, _ in rows})
+    new_sketches = {}
+    for d, path_id, user_id in rows:
+        d = _as_date(d)
+        path = entries[path_id].path
+        for key in ((d, path), (d, ALL_PAGES)):
+            sketch = new_sketches.get(key)
+            if sketch is None:
+                sketch = new_sketches[key] = HyperLogLog(HLL_PRECISION)
+            sketch.add(user_id)
+
+    days = {d for d, _ in new_sketches}
+    paths = {path for _, path in new_sketches}
+    stored = db.session.query(PageVisitorSketch)\
+        .filter(PageVisitorSketch.day.in_(days), PageVisitorSketch.path.in_(paths))
+    for record in stored:
+        sketch = new_sketches.get((record.day, record.path))
+        if sketch is not None:
+            sketch.merge(HyperLogLog.from_bytes(record.sketch))
+    _replace(PageVisitorSketch,
+             [{'day': d, 'path': path, 'sketch': s.to_bytes(), 'visitors': s.count()}
+              for (d, path), s in new_sketches.items()],
+             ['day', 'path'], columns=('sketch', 'visitors'))
+
+
+def _update_hit_sketches(id_range):
+    hour = _hour(VisitLog.created_at)
+    visits = func.sum(func.coalesce(VisitLog.sample_weight, 1))
+    rows = db.session.query(hour, VisitLog.path_id, visits)\
+        .filter(*id_range).group_by(hour, VisitLog.path_id).all()
+    if not rows:
+        return
+    entries = path_dictionary.entries({path_id for _, path_id, _ in rows})
+    horizon = _hour_start(datetime.utcnow()) - timedelta(hours=HIT_SKETCH_RETENTION_HOURS)
+    counts = {}
+    for bucket, path_id, n in rows:
+        bucket = _as_datetime(bucket)
+        if bucket >= horizon:
+            counts.setdefault(bucket, {})[entries[path_id].path] = n
+    new_sketches = {}
+    for bucket, bucket_counts in counts.items():
+        sketch = new_sketches[bucket] = CountMinSketch(CMS_WIDTH, CMS_DEPTH, TOP_CANDIDATES)
+        sketch.update(bucket_counts)
+    stored = db.session.query(PageHitSketch).filter(PageHitSketch.bucket_start.in_(list(new_sketches)))
+    for record in stored:
+        new_sketches[record.bucket_start].merge(CountMinSketch.from_bytes(record.sketch))
+    _replace(PageHitSketch,
+             [{'bucket_start': bucket, 'sketch': s.to_bytes()} for bucket, s in new_sketches.items()],
+             ['bucket_start'])
+    db.session.query(PageHitSketch).filter(PageHitSketch.bucket_start < horizon)\
+        .delete(synchronize_session=False)
+
+
+def update_sketches(first_id, last_id):
+    # Добавляет посещения с id в (first_id, last_id] в сводки (в транзакции обновления счетчиков)
+    id_range = (VisitLog.id > first_id, VisitLog.id <= last_id)
+    _update_visitor_sketches(id_range)
+    _update_hit_sketches(id_range)
+
+
+def clear_sketches(boundary=None):
+    # Для полного пересчета: сводки за дни до boundary (архивные месяцы) сохраняются
+    visitor_sketches = db.session.query(PageVisitorSketch)
+    hit_sketches = db.session.query(PageHitSketch)
+    if boundary is not None:
+        visitor_sketches = visitor_sketches.filter(PageVisitorSketch.day >= boundary)
+        boundary_start = datetime.combine(boundary, datetime.min.time())
+        hit_sketches = hit_sketches.filter(PageHitSketch.bucket_start >= boundary_start)
+    visitor_sketches.delete(synchronize_session=False)
+    hit_sketches.delete(synchronize_session=False)
+
+
+def backfill_visitor_counts(log=print):
+    # Оценки для сводок, записанных до появления колонки visitors (flask migrate)
+    filled = 0
+    while True:
+        batch = db.session.query(PageVisitorSketch)\
+            .filter(PageVisitorSketch.visitors.is_(None)).limit(BACKFILL_BATCH_SIZE).all()
+        if not batch:
+            break
+        for record in batch:
+            record.visitors = HyperLogLog.from_bytes(record.sketch).count()
+        db.session.commit()
+        filled += len(batch)
+    if filled:
+        log(f'Estimated visitors for {filled} page visitor sketch(es)')
+
+
+class UniqueVisitorsReport:
+    __slots__ = ('pages', 'page_count', 'days', 'total')
+
+    def __init__(self, pages, page_count, days, total):
+        self.pages = pages # [(страница, уникальных)] по убыванию, не больше VISITOR_PAGES_LIMIT
+        self.page_count = page_count # Всего страниц с посетителями за период
+        self.days = days # [(день, уникальных по всем страницам)]
+        self.total = total # Уникальных за весь период (не сумма по дням)
+
+
+def unique_visitors(start=None, end=None, limit=VISITOR_PAGES_LIMIT):
+    session = report_session()
+    period = []
+    if start is not None:
+        period.append(PageVisitorSketch.day >= start)
+    if end is not None:
+        period.append(PageVisitorSketch.day <= end)
+
+    days = []
+    overall = HyperLogLog(HLL_PRECISION)
+    for d, data in session.query(PageVisitorSketch.day, PageVisitorSketch.sketch)\
+            .filter(*period, PageVisitorSketch.path == ALL_PAGES).order_by(PageVisitorSketch.day):
+        sketch = HyperLogLog.from_bytes(data)
+        days.append((d, sketch.count()))
+        overall.merge(sketch)
+
+    # Кандидаты - по сумме дневных оценок (верхняя граница числа уникальных за период);
+    # точнее ранжируются уже слитые сводки кандидатов
+    page_filter = (*period, PageVisitorSketch.path != ALL_PAGES)
+    score = func.sum(func.coalesce(PageVisitorSketch.visitors, 0))
+    scores = session.query(PageVisitorSketch.path, score).filter(*page_filter)\
+        .group_by(PageVisitorSketch.path).all()
+    candidates = [path for path, _ in nsmallest(max(limit, VISITOR_CANDIDATES), scores,
+                                                 key=lambda item: (-item[1], item[0]))]
+    by_path = {}
+    if candidates:
+        for path, data in session.query(PageVisitorSketch.path, PageVisitorSketch.sketch)\
+                .filter(*page_filter, PageVisitorSketch.path.in_(candidates)):
+            sketch = HyperLogLog.from_bytes(data)
+            if path in by_path:
+                by_path[path].merge(sketch)
+            else:
+                by_path[path] = sketch
+    pages = sorted(((path, s.count()) for path, s in by_path.items()), key=lambda item: (-item[1], item[0]))
+    return UniqueVisitorsReport(pages[:limit], len(scores), days, overall.count())
+
+
+class TopPagesReport:
+    __slots__ = ('pages', 'total', 'error_bound', 'since')
+
+    def __init__(self, pages, total, error_bound, since):
+        self.pages = pages # [(страница, оценка числа посещений)] по убыванию
+        self.total = total # Всего посещений за окно
+        self.error_bound = error_bound # Оценки завышены не больше чем на столько (с вероятностью ~98%)
+        self.since = since
+
+
+def top_pages(hours=24, limit=20, now=None):
+    # Самые посещаемые страницы за последние hours часов (включая текущий)
+    hours = max(1, min(hours, HIT_SKETCH_RETENTION_HOURS))
+    since = _hour_start(now or datetime.utcnow()) - timedelta(hours=hours - 1)
+    merged = CountMinSketch(CMS_WIDTH, CMS_DEPTH, TOP_CANDIDATES)
+    stored = report_session().query(PageHitSketch.sketch).filter(PageHitSketch.bucket_start >= since)
+    merged.merge_many(CountMinSketch.from_bytes(data) for (data,) in stored)
+    return TopPagesReport(merged.top(limit), merged.total, merged.error_bound(), since)
@@ -0,0 +1,223 @@
+# app/metrics.py
+# Метрики запросов процесса: время обработки по эндпоинтам (гистограммы), коды ответа,
+# размер ответа, число и время SQL-запросов на запрос. Собираются хуками Flask
+# (before_request/after_request) и событиями SQLAlchemy before/after_cursor_execute
+# и отдаются в текстовом формате Prometheus (см. /logs/metrics).
+# Счетчики хранятся в памяти процесса: каждый воркер gunicorn отдает свои, метка pid
+# позволяет различать их при сборе. На запрос приходится несколько обращений к словарям
+# под одной блокировкой, поэтому сбор можно оставлять включенным в боевом окружении.
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+from .analytics import unique_engines
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Эндпоинт для запросов, не сопоставленных ни с одним маршрутом (404): ограничивает число меток
+UNMATCHED_ENDPOINT = '<unmatched>'
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Последний - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestMetrics:
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._latency = {} # (endpoint, method) -> Histogram
+        self._responses = {} # (endpoint, method, status) -> count
+        self._sizes = {} # endpoint -> Histogram
+        self._queries = {} # endpoint -> Histogram числа запросов
+        self._query_seconds = {} # endpoint -> суммарное время SQL
+        self._background = {'queries': 0, 'seconds': 0.0} # SQL вне запросов (фоновые потоки, CLI)
+        self._collectors = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self._collectors = []
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        with app.app_context():
+            engines = unique_engines()
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    # Дополнительные метрики (буфер журнала, кэши): функция возвращает список
+    # (имя, тип, справка, [(метки, значение), ...])
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    # --- Хуки запроса ---
+
+    def _before_request(self):
+        g._metrics_started = time.perf_counter()
+        g._metrics_queries = 0
+        g._metrics_query_seconds = 0.0
+
+    def _after_request(self, response):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or UNMATCHED_ENDPOINT
+        method = request.method
+        # Для потоковых ответов длина неизвестна, а время - до начала передачи тела
+        size = None if response.is_streamed else response.calculate_content_length()
+        queries = g.get('_metrics_queries', 0)
+        query_seconds = g.get('_metrics_query_seconds', 0.0)
+        with self._lock:
+            histogram = self._latency.get((endpoint, method))
+            if histogram is None:
+                histogram = self._latency[(endpoint, method)] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(elapsed)
+            key = (endpoint, method, response.status_code)
+            self._responses[key] = self._responses.get(key, 0) + 1
+            if size is not None:
+                histogram = self._sizes.get(endpoint)
+                if histogram is None:
+                    histogram = self._sizes[endpoint] = Histogram(SIZE_BUCKETS)
+                histogram.observe(size)
+            histogram = self._queries.get(endpoint)
+            if histogram is None:
+                histogram = self._queries[endpoint] = Histogram(QUERY_COUNT_BUCKETS)
+            histogram.observe(queries)
+            self._query_seconds[endpoint] = self._query_seconds.get(endpoint, 0.0) + query_seconds
+        return response
+
+    # --- События SQLAlchemy ---
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get('_metrics_started')
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        if has_request_context() and '_metrics_started' in g:
+            g._metrics_queries += 1
+            g._metrics_query_seconds += elapsed
+        else:
+            with self._lock:
+                self._background['queries'] += 1
+                self._background['seconds'] += elapsed
+
+    # --- Экспорт ---
+
+    def render(self):
+        pid = str(os.getpid())
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def sample(name, labels, value):
+            labels = dict(labels, pid=pid)
+            rendered = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f'{name}{{{rendered}}} {_number(value)}')
+
+        def histogram(name, labels, hist):
+            cumulative = 0
+            for bound, count in zip(hist.buckets + (float('inf'),), hist.counts):
+                cumulative += count
+                sample(f'{name}_bucket', dict(labels, le=_number(bound)), cumulative)
+            sample(f'{name}_sum', labels, hist.sum)
+            sample(f'{name}_count', labels, hist.count)
+
+        with self._lock:
+            header('http_request_duration_seconds', 'histogram', 'Request latency by endpoint.')
+            for (endpoint, method), hist in sorted(self._latency.items()):
+                histogram('http_request_duration_seconds', {'endpoint': endpoint, 'method': method}, hist)
+
+            header('http_responses_total', 'counter', 'Responses by endpoint and status code.')
+            for (endpoint, method, status), count in sorted(self._responses.items()):
+                sample('http_responses_total', {'endpoint': endpoint, 'method': method, 'status': status}, count)
+
+            header('http_response_size_bytes', 'histogram', 'Response body size (non-streamed responses).')
+            for endpoint, hist in sorted(self._sizes.items()):
+                histogram('http_response_size_bytes', {'endpoint': endpoint}, hist)
+
+            header('db_queries_per_request', 'histogram', 'SQL statements executed per request.')
+            for endpoint, hist in sorted(self._queries.items()):
+                histogram('db_queries_per_request', {'endpoint': endpoint}, hist)
+
+            header('db_query_seconds_total', 'counter', 'Time spent in SQL statements per endpoint.')
+            for endpoint, seconds in sorted(self._query_seconds.items()):
+                sample('db_query_seconds_total', {'endpoint': endpoint}, seconds)
+
+            header('db_background_queries_total', 'counter', 'SQL statements executed outside requests.')
+            sample('db_background_queries_total', {}, self._background['queries'])
+            header('db_background_query_seconds_total', 'counter', 'Time spent in SQL outside requests.')
+            sample('db_background_query_seconds_total', {}, self._background['seconds'])
+
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                header(name, kind, help_text)
+                for labels, value in samples:
+                    sample(name, labels, value)
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._responses.clear()
+            self._sizes.clear()
+            self._queries.clear()
+            self._query_seconds.clear()
+            self._background = {'queries': 0, 'seconds': 0.0}
+
+
+# Сборщик для словаря статистики компонента (stats() буфера, кэшей): числовые поля -> gauge
+def stats_collector(prefix, stats, help_text):
+    def collect():
+        result = []
+        for key, value in sorted(stats().items()):
+            if isinstance(value, (bool, int, float)):
+                result.append((f'{prefix}_{key}', 'gauge', help_text, [({}, value)]))
+        return result
+    return collect
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+metrics = RequestMetrics()
@@ -2,7 +2,7 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from .passwords import password_hasher
 
 db = SQLAlchemy()
 
@@ -19,15 +19,19 @@ class Role(db.Model):
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Сортировка списка пользователей по ФИО (см. views.index)
+        db.Index('ix_users_last_name_first_name', 'last_name', 'first_name'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, index=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False) # С запасом под более длинные методы хеширования
     last_name = db.Column(db.String(64))
     first_name = db.Column(db.String(64), nullable=False)
     middle_name = db.Column(db.String(64))
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     @property
     def password(self):
@@ -35,10 +39,17 @@ class User(UserMixin, db.Model):
     
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.check(self.password_hash, password)
+
+    # Пересчет хеша, если он записан не текущим методом/стоимостью (вызывается после успешного входа)
+    def rehash_password_if_needed(self, password):
+        if password_hasher.needs_rehash(self.password_hash):
+            self.password = password
+            return True
+        return False
     
     def full_name(self):
         if self.last_name:
@@ -52,14 +63,164 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
-# Новая модель для логирования посещений
+# Поиск по началу логина без учета регистра (см. search.py)
+db.Index('ix_users_username_lower', db.func.lower(User.username))
+
+# Фоновые задания (см. app/jobs.py)
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Поиск следующего задания в очереди
+        db.Index('ix_jobs_status_id', 'status', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}') # JSON
+    status = db.Column(db.String(16), nullable=False, default='queued') # queued, running, done, failed
+    progress = db.Column(db.Integer, nullable=False, default=0) # Обработано строк
+    total = db.Column(db.Integer) # Оценка общего объема работы, если известна
+    error = db.Column(db.Text)
+    result = db.Column(db.Text) # JSON: итог, который вернул обработчик
+    created_by = db.Column(db.Integer) # id администратора; без внешнего ключа - пользователь может быть удален
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    run_after = db.Column(db.DateTime) # Отложенное задание: не забирается раньше этого времени
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime) # Обновляется во время выполнения; по нему находят брошенные задания
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind}: {self.status}>'
+
+# Новая модель для логирования посещений.
+# Модели журнала и отчетов привязаны к базе 'analytics' (см. app/analytics.py)
 class VisitLog(db.Model):
     __tablename__ = 'visit_logs'
+    __bind_key__ = 'analytics'
+    __table_args__ = (
+        # Журнал обычного пользователя: фильтр по user_id + сортировка по дате без сканирования таблицы
+        db.Index('ix_visit_logs_user_id_created_at', 'user_id', 'created_at'),
+        # Выгрузка по пользователю или по страницам: проход по id внутри одного user_id/path_id
+        db.Index('ix_visit_logs_user_id_id', 'user_id', 'id'),
+        db.Index('ix_visit_logs_path_id_id', 'path_id', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    path = db.Column(db.String(255), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True) # Может быть NULL для неаутентифицированных
+    # Номер пути в словаре visit_paths (строка пути хранится там один раз, см. app/visit_paths.py)
+    path_id = db.Column(db.Integer, db.ForeignKey('visit_paths.id'), nullable=False)
+    # Может быть NULL для неаутентифицированных. Без внешнего ключа на users: журнал может
+    # лежать в отдельной базе (см. app/analytics.py)
+    user_id = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True) # Индекс для сортировки
+    # Сколько посещений представляет запись: при выборке 1 из N записывается N (см. app/visit_rules.py)
+    sample_weight = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    def __repr__(self):
+        return f'<VisitLog path:{self.path_id} by User ID:{self.user_id} at {self.created_at}>'
+
+# Словарь путей и шаблонов маршрутов журнала посещений
+class VisitPath(db.Model):
+    __tablename__ = 'visit_paths'
+    __bind_key__ = 'analytics'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(255), unique=True, nullable=False)
+    # Шаблон маршрута, которым обработан путь (request.url_rule) - тоже строка словаря
+    route_id = db.Column(db.Integer, db.ForeignKey('visit_paths.id'))
+
+    def __repr__(self):
+        return f'<VisitPath {self.id}: {self.value}>'
+
+# Предагрегированные счетчики посещений по дням (см. app/logs/rollups.py)
+class PageVisitRollup(db.Model):
+    __tablename__ = 'page_visit_rollups'
+    __bind_key__ = 'analytics'
+
+    day = db.Column(db.Date, primary_key=True)
+    path = db.Column(db.String(255), primary_key=True)
+    visit_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<PageVisitRollup {self.day} {self.path}: {self.visit_count}>'
+
+class RouteVisitRollup(db.Model):
+    __tablename__ = 'route_visit_rollups'
+    __bind_key__ = 'analytics'
+
+    day = db.Column(db.Date, primary_key=True)
+    route = db.Column(db.String(255), primary_key=True) # '' - путь не сопоставлен ни с одним маршрутом
+    visit_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<RouteVisitRollup {self.day} {self.route}: {self.visit_count}>'
+
+class UserVisitRollup(db.Model):
+    __tablename__ = 'user_visit_rollups'
+    __bind_key__ = 'analytics'
+
+    day = db.Column(db.Date, primary_key=True)
+    # 0 - неаутентифицированные посетители (NULL не годится для первичного ключа)
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    visit_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<UserVisitRollup {self.day} user:{self.user_id}: {self.visit_count}>'
+
+# Позиция, до которой журнал уже учтен в счетчиках
+class RollupState(db.Model):
+    __tablename__ = 'rollup_state'
+    __bind_key__ = 'analytics'
+
+    name = db.Column(db.String(64), primary_key=True)
+    last_visit_id = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<RollupState {self.name}: {self.last_visit_id}>'
+
+# Сводки HyperLogLog уникальных посетителей по дням и страницам (см. app/logs/visitors.py)
+class PageVisitorSketch(db.Model):
+    __tablename__ = 'page_visitor_sketches'
+    __bind_key__ = 'analytics'
+    __table_args__ = (
+        # Выбор страниц для отчета по оценкам, без чтения самих сводок
+        db.Index('ix_page_visitor_sketches_day_path_visitors', 'day', 'path', 'visitors'),
+    )
+
+    day = db.Column(db.Date, primary_key=True)
+    path = db.Column(db.String(255), primary_key=True) # '' - все страницы за день
+    sketch = db.Column(db.LargeBinary, nullable=False)
+    visitors = db.Column(db.Integer) # Оценка уникальных за день по этой сводке
+
+    def __repr__(self):
+        return f'<PageVisitorSketch {self.day} {self.path!r}>'
+
+# Сводки Count-Min посещений страниц по часам для списка самых посещаемых
+class PageHitSketch(db.Model):
+    __tablename__ = 'page_hit_sketches'
+    __bind_key__ = 'analytics'
+
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    sketch = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f'<PageHitSketch {self.bucket_start}>'
+
+# Сегменты журнала, перенесенные из visit_logs в сжатые архивные файлы (см. app/logs/retention.py)
+class VisitLogArchive(db.Model):
+    __tablename__ = 'visit_log_archives'
+    __bind_key__ = 'analytics'
+
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), nullable=False, index=True) # ГГГГ-ММ
+    period_start = db.Column(db.Date, nullable=False)
+    period_end = db.Column(db.Date, nullable=False) # Не включительно
+    file_name = db.Column(db.String(255), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Когда строки сегмента удалены из visit_logs; NULL - удаление было прервано
+    deleted_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
-        return f'<VisitLog {self.path} by User ID:{self.user_id} at {self.created_at}>'
\ No newline at end of file
+        return f'<VisitLogArchive {self.month} ({self.row_count} rows) -> {self.file_name}>'
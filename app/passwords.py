@@ -0,0 +1,122 @@
+# app/passwords.py
+# Хеширование паролей с настраиваемым методом и стоимостью.
+# - PASSWORD_HASH_METHOD / PASSWORD_SALT_LENGTH задают алгоритм (формат werkzeug);
+# - при PASSWORD_HASH_WORKERS > 0 вычисления выполняются в пуле процессов и не
+#   занимают GIL воркера, обслуживающего остальные запросы;
+# - PASSWORD_LOGIN_CONCURRENCY ограничивает число одновременных проверок пароля при входе.
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'pbkdf2:sha256:260000'
+DEFAULT_SALT_LENGTH = 16
+
+
+class LoginThrottled(Exception):
+    pass
+
+
+def _generate(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _check(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    def __init__(self):
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._login_slots = None
+        self._normalized_methods = {}
+
+    def _config(self):
+        config = current_app.config
+        return (config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+                config.get('PASSWORD_SALT_LENGTH', DEFAULT_SALT_LENGTH),
+                config.get('PASSWORD_HASH_WORKERS', 0))
+
+    def _pool(self, workers):
+        # Пул создается лениво и заново в каждом процессе после fork
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=workers)
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _run(self, func, *args):
+        workers = self._config()[2]
+        if workers > 0:
+            return self._pool(workers).submit(func, *args).result()
+        return func(*args)
+
+    def hash(self, password):
+        method, salt_length, _ = self._config()
+        return self._run(_generate, password, method, salt_length)
+
+    def hash_many(self, passwords, workers=None):
+        # Для массовых операций: пароли хешируются параллельно во всех процессах пула
+        with self.bulk(workers) as hash_batch:
+            return hash_batch(passwords)
+
+    @contextmanager
+    def bulk(self, workers=None):
+        # Функция хеширования списка паролей для нескольких порций подряд (импорт пользователей).
+        # Если пул не настроен (PASSWORD_HASH_WORKERS = 0), а workers > 1, на время блока
+        # создается один временный пул из workers процессов
+        method, salt_length, pool_workers = self._config()
+        if pool_workers > 0:
+            pool = self._pool(pool_workers)
+            yield lambda passwords: self._map(pool, pool_workers, list(passwords), method, salt_length)
+        elif workers and workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                yield lambda passwords: self._map(pool, workers, list(passwords), method, salt_length)
+        else:
+            yield lambda passwords: [_generate(p, method, salt_length) for p in passwords]
+
+    @staticmethod
+    def _map(pool, workers, passwords, method, salt_length):
+        # Пароли уходят в процессы пачками, а не по одному: меньше накладных расходов на передачу
+        chunksize = max(1, len(passwords) // (workers * 4))
+        return list(pool.map(_generate, passwords, repeat(method, len(passwords)),
+                             repeat(salt_length, len(passwords)), chunksize=chunksize))
+
+    def check(self, pwhash, password):
+        return self._run(_check, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # Хеш устарел, если записан другим методом или с другой стоимостью.
+        # Метод в нормализованном виде (как его записывает werkzeug) вычисляется один раз.
+        method, salt_length, _ = self._config()
+        normalized = self._normalized_methods.get(method)
+        if normalized is None:
+            normalized = generate_password_hash('', method=method, salt_length=1).split('$', 1)[0]
+            self._normalized_methods[method] = normalized
+        return pwhash.split('$', 1)[0] != normalized
+
+    @contextmanager
+    def login_slot(self):
+        # Не больше PASSWORD_LOGIN_CONCURRENCY проверок пароля одновременно в процессе;
+        # остальные ждут до PASSWORD_LOGIN_WAIT_SECONDS и получают LoginThrottled
+        if self._login_slots is None:
+            with self._lock:
+                if self._login_slots is None:
+                    limit = current_app.config.get('PASSWORD_LOGIN_CONCURRENCY', 4)
+                    self._login_slots = threading.BoundedSemaphore(limit)
+        if not self._login_slots.acquire(timeout=current_app.config.get('PASSWORD_LOGIN_WAIT_SECONDS', 2)):
+            raise LoginThrottled()
+        try:
+            yield
+        finally:
+            self._login_slots.release()
+
+
+password_hasher = PasswordHasher()
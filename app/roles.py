@@ -0,0 +1,116 @@
+# app/roles.py
+# Реестр ролей процесса. Роли меняются крайне редко, поэтому они читаются из БД один раз
+# и дальше используются для списков выбора в формах, поиска роли по id/имени и проверки прав.
+# Чтобы другие воркеры узнали об изменении ролей, после него вызывается invalidate():
+# она обновляет время изменения файла-метки в instance/, а каждый воркер не чаще раза
+# в ROLE_REGISTRY_CHECK_SECONDS сравнивает его со своим и при расхождении перечитывает роли.
+import os
+import threading
+import time
+from collections import namedtuple
+
+import click
+from flask.cli import AppGroup
+
+from .models import db, Role
+
+RoleInfo = namedtuple('RoleInfo', ['id', 'name', 'description'])
+
+EMPTY_CHOICE = (0, 'Не выбрано')
+
+
+class RoleRegistry:
+    def __init__(self, app=None):
+        self.app = None
+        self._roles = None # id -> RoleInfo
+        self._by_name = {}
+        self._sorted = []
+        self._stamp = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.stamp_path = os.path.join(app.instance_path, 'roles.version')
+        self.check_interval = app.config.get('ROLE_REGISTRY_CHECK_SECONDS', 5)
+        app.extensions['role_registry'] = self
+        app.add_template_global(self, 'role_registry')
+        app.cli.add_command(roles_cli)
+
+    # --- Чтение ---
+
+    def all(self):
+        self._ensure_fresh()
+        return self._sorted
+
+    def get(self, role_id):
+        if not role_id:
+            return None
+        self._ensure_fresh()
+        return self._roles.get(role_id)
+
+    def by_name(self, name):
+        self._ensure_fresh()
+        return self._by_name.get(name)
+
+    def role_name(self, role_id):
+        role = self.get(role_id)
+        return role.name if role else None
+
+    def choices(self):
+        # Список для SelectField: "Не выбрано" + роли по алфавиту
+        return [EMPTY_CHOICE] + [(role.id, role.name) for role in self.all()]
+
+    # --- Обновление ---
+
+    def refresh(self):
+        roles = [RoleInfo(r.id, r.name, r.description) for r in db.session.query(Role).order_by(Role.name)]
+        with self._lock:
+            self._roles = {role.id: role for role in roles}
+            self._by_name = {role.name: role for role in roles}
+            self._sorted = roles
+            self._stamp = self._read_stamp()
+            self._next_check = time.monotonic() + self.check_interval
+            self.loads += 1
+
+    def invalidate(self):
+        # Вызывается после изменения ролей в БД: обновляет метку для всех воркеров и перечитывает роли
+        os.makedirs(os.path.dirname(self.stamp_path), exist_ok=True)
+        with open(self.stamp_path, 'a'):
+            os.utime(self.stamp_path, None)
+        self.refresh()
+
+    def stats(self):
+        return {'roles': len(self._roles or {}), 'loads': self.loads}
+
+    def _read_stamp(self):
+        try:
+            return os.stat(self.stamp_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _ensure_fresh(self):
+        if self._roles is None:
+            self.refresh()
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        if self._read_stamp() != self._stamp:
+            self.refresh()
+
+
+role_registry = RoleRegistry()
+
+roles_cli = AppGroup('roles', help='Управление реестром ролей.')
+
+
+# flask roles refresh - после ручного изменения таблицы roles
+@roles_cli.command('refresh')
+def refresh_roles_command():
+    role_registry.invalidate()
+    click.echo(f'Role registry refreshed: {len(role_registry.all())} role(s).')
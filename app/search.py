@@ -0,0 +1,169 @@
+# app/search.py
+# Поиск пользователей по логину и ФИО.
+# В SQLite используется полнотекстовый индекс FTS5 users_fts: токенизатор unicode61 приводит
+# к одному регистру в том числе кириллицу, "ё" в индексе и в запросе заменяется на "е",
+# а префиксные индексы ускоряют поиск по началу слова для автодополнения.
+# Индекс поддерживается триггерами на users, поэтому создание, изменение и удаление
+# пользователей (в том числе массовые) синхронизируют его сами.
+# Логин, начинающийся с запроса (и точное совпадение - первым), находится отдельно по индексу
+# lower(username): он попадает в выдачу, даже если запрос совпал с сотнями тысяч записей.
+# Таблица и триггеры создаются командой `flask bootstrap`/`flask migrate`; пока их нет
+# (или в другой СУБД) поиск выполняется через LIKE.
+import re
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, or_, text
+
+from .models import db, User
+
+FTS_TABLE = 'users_fts'
+FTS_COLUMNS = ('username', 'last_name', 'first_name', 'middle_name')
+# Веса bm25 по колонкам: совпадение в логине и фамилии важнее, чем в отчестве
+FTS_WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+
+SEARCH_LIMIT = 20
+MAX_TERMS = 5
+# Сколько совпадений ранжируется по bm25. Меньшие наборы ранжируются целиком (20 тыс. - около
+# 20 мс на 300 тыс. пользователей); двухбуквенный префикс частого имени может совпасть со 100+ тыс.
+# записей, их полное ранжирование занимает 0,2-0,7 с - тогда ранжируется первая часть совпадений,
+# а совпадения по логину добавляет поиск по индексу (_username_matches)
+MAX_CANDIDATES = 20000
+_USERNAME_RE = re.compile(r'^[A-Za-z0-9]+$')
+
+
+# Значение колонки в индексе: unicode61 не отождествляет "ё" и "е", поэтому "ё" заменяется заранее
+def _indexed(prefix, column):
+    return f"replace(replace({prefix}{column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _indexed_values(prefix):
+    return ', '.join(_indexed(prefix, column) for column in FTS_COLUMNS)
+
+
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        {', '.join(FTS_COLUMNS)},
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {', '.join(FTS_COLUMNS)}) VALUES (new.id, {_indexed_values('new.')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF {', '.join(FTS_COLUMNS)} ON users BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE}(rowid, {', '.join(FTS_COLUMNS)}) VALUES (new.id, {_indexed_values('new.')});
+    END""",
+]
+
+FTS_REBUILD = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"INSERT INTO {FTS_TABLE}(rowid, {', '.join(FTS_COLUMNS)}) SELECT id, {_indexed_values('')} FROM users",
+]
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# Есть ли users_fts в базе (проверяется один раз на процесс)
+_fts_ready = None
+
+
+def ensure_search_index(log=print):
+    global _fts_ready
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"),
+                              {'name': FTS_TABLE}).first() is not None
+        for ddl in FTS_SCHEMA:
+            conn.execute(text(ddl))
+        if not exists:
+            # Индекс только что создан: заполняем его из уже существующих пользователей
+            for statement in FTS_REBUILD:
+                conn.execute(text(statement))
+            log(f'Created full-text index {FTS_TABLE}')
+    _fts_ready = True
+    return True
+
+
+def rebuild_search_index():
+    with db.engine.begin() as conn:
+        for statement in FTS_REBUILD:
+            conn.execute(text(statement))
+
+
+def _fts_available():
+    global _fts_ready
+    if _fts_ready is None:
+        if db.engine.dialect.name != 'sqlite':
+            _fts_ready = False
+        else:
+            _fts_ready = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"),
+                {'name': FTS_TABLE}).first() is not None
+    return _fts_ready
+
+
+def search_terms(query):
+    query = (query or '').replace('ё', 'е').replace('Ё', 'Е')
+    return _TERM_RE.findall(query)[:MAX_TERMS]
+
+
+def _fts_match(terms):
+    # Каждое слово - префикс ("ива"*), слова объединяются через AND.
+    # Слова состоят только из \w, поэтому синтаксис FTS5 во вводе пользователя не интерпретируется.
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _username_matches(term, limit):
+    # Логины, начинающиеся с term, по индексу lower(username): в порядке индекса точное
+    # совпадение идет первым. Логин - латинские буквы и цифры, все они меньше '~'
+    if not _USERNAME_RE.match(term):
+        return []
+    prefix = term.lower()
+    username = func.lower(User.username)
+    return [user_id for (user_id,) in db.session.query(User.id)
+            .filter(username >= prefix, username < prefix + '~').order_by(username).limit(limit)]
+
+
+def search_users(query, limit=SEARCH_LIMIT):
+    terms = search_terms(query)
+    if not terms:
+        return []
+    if _fts_available():
+        # Совпадение логина важнее всего (у него наибольший вес и в bm25), поэтому идет первым
+        head = _username_matches(terms[0], limit) if len(terms) == 1 else []
+        ranked = db.session.execute(
+            text(f"SELECT rowid FROM ("
+                 f"SELECT rowid, bm25({FTS_TABLE}, {', '.join(map(str, FTS_WEIGHTS))}) AS score "
+                 f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match LIMIT :candidates"
+                 f") ORDER BY score LIMIT :limit"),
+            {'match': _fts_match(terms), 'candidates': MAX_CANDIDATES, 'limit': limit}).scalars().all()
+        ranked = list(dict.fromkeys(head + ranked))[:limit]
+        if not ranked:
+            return []
+        users = {user.id: user for user in User.query.filter(User.id.in_(ranked))}
+        return [users[user_id] for user_id in ranked if user_id in users]
+
+    # Запасной вариант без FTS: совпадение по началу поля для каждого слова
+    conditions = [or_(*(getattr(User, column).ilike(f'{term}%') for column in FTS_COLUMNS)) for term in terms]
+    return User.query.filter(*conditions).order_by(User.last_name, User.first_name, User.id).limit(limit).all()
+
+
+search_cli = AppGroup('search', help='Полнотекстовый индекс пользователей.')
+
+
+# flask search rebuild - после изменения users в обход триггеров (например, восстановления из копии)
+@search_cli.command('rebuild')
+def rebuild_search_command():
+    if not ensure_search_index(log=click.echo):
+        click.echo('Full-text search is only available for SQLite.')
+        return
+    rebuild_search_index()
+    click.echo(f'Search index {FTS_TABLE} rebuilt.')
+
+
+def init_app(app):
+    app.cli.add_command(search_cli)
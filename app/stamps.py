@@ -0,0 +1,28 @@
+# app/stamps.py
+# Файлы-метки версий в instance/: изменение данных в одном воркере отмечается обновлением
+# времени изменения файла, остальные воркеры сравнивают его со своим значением
+# (так же устроен реестр ролей, см. app/roles.py).
+import os
+
+from flask import current_app
+
+USERS_STAMP = 'users.version' # Изменены ФИО или удалены пользователи
+ROLLUPS_STAMP = 'rollups.version' # Счетчики отчетов пересчитаны или часть журнала ушла в архив
+
+
+def _stamp_path(name):
+    return os.path.join(current_app.instance_path, name)
+
+
+def touch_stamp(name):
+    path = _stamp_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a'):
+        os.utime(path, None)
+
+
+def read_stamp(name):
+    try:
+        return os.stat(_stamp_path(name)).st_mtime_ns
+    except OSError:
+        return None
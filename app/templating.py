@@ -0,0 +1,104 @@
+# app/templating.py
+# Компиляция и вывод шаблонов Jinja.
+# - Байткод скомпилированных шаблонов хранится на диске (JINJA_BYTECODE_CACHE_DIR, по умолчанию
+#   instance/jinja-cache) и общий для всех воркеров: новый воркер загружает готовый байткод
+#   вместо разбора и компиляции исходника. Запись в кэш атомарная (временный файл + rename),
+#   а устаревший байткод Jinja отбрасывает по контрольной сумме исходника.
+# - TEMPLATE_PRECOMPILE=1 компилирует все шаблоны при старте воркера (с --preload gunicorn -
+#   один раз в мастер-процессе), `flask templates compile` заполняет кэш байткода при развертывании.
+# - render_page отдает большие страницы потоком (TEMPLATE_STREAMING): первые байты уходят клиенту
+#   до того, как сформирована последняя строка таблицы. Строки таблицы можно передать как
+#   RowStream - тогда и они читаются из курсора БД порциями во время отдачи.
+import os
+import time
+
+import click
+from flask import Response, current_app, get_flashed_messages, render_template, stream_template
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+
+TEMPLATE_EXTENSIONS = ('.html',)
+STREAM_CHUNK_CHARS = 16 * 1024
+
+
+def init_app(app):
+    if app.config.get('JINJA_BYTECODE_CACHE', True):
+        cache_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja-cache')
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    app.cli.add_command(templates_cli)
+
+
+def template_names(app):
+    # Шаблоны приложения и блюпринтов; статика лежит в app/templates/static и в список не входит
+    return [name for name in app.jinja_env.list_templates()
+            if name.endswith(TEMPLATE_EXTENSIONS) and not name.startswith('static/')]
+
+
+def precompile_templates(app):
+    # Загружает все шаблоны в кэш окружения Jinja (и в кэш байткода, если их там еще нет)
+    started = time.perf_counter()
+    names = template_names(app)
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names), time.perf_counter() - started
+
+
+def _buffered(chunks, size=STREAM_CHUNK_CHARS):
+    # Jinja отдает поток мелкими фрагментами (по одному на каждый вывод): собираем их в блоки
+    # и отдаем байтами, как остальные потоковые ответы (их сжимают и кэшируют побайтно)
+    parts = []
+    length = 0
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            length += len(chunk)
+            if length >= size:
+                yield ''.join(parts).encode('utf-8')
+                parts = []
+                length = 0
+        if parts:
+            yield ''.join(parts).encode('utf-8')
+    finally:
+        # Поток шаблона держит контекст запроса (и курсор БД в RowStream): закрываем и при обрыве
+        chunks.close()
+
+
+def render_page(template_name, **context):
+    if not current_app.config.get('TEMPLATE_STREAMING', True):
+        return render_template(template_name, **context)
+    # Cookie сессии уходит с заголовками, до вывода шаблона: flash-сообщения забираем
+    # из сессии заранее, иначе они показались бы и на следующей странице
+    get_flashed_messages()
+    return Response(_buffered(stream_template(template_name, **context)), mimetype='text/html')
+
+
+class RowStream:
+    # Строки для цикла в шаблоне, читаемые пачками во время вывода страницы.
+    # batches - итератор списков строк; {% if rows %} читает только первую пачку
+    def __init__(self, batches):
+        self._batches = iter(batches)
+        self._first = None
+
+    def _peek(self):
+        if self._first is None:
+            self._first = next(self._batches, [])
+        return self._first
+
+    def __bool__(self):
+        return bool(self._peek())
+
+    def __iter__(self):
+        yield from self._peek()
+        for batch in self._batches:
+            yield from batch
+
+
+templates_cli = AppGroup('templates', help='Шаблоны Jinja.')
+
+
+# flask templates compile - заполнить кэш байткода до запуска воркеров
+@templates_cli.command('compile')
+def compile_command():
+    count, elapsed = precompile_templates(current_app)
+    click.echo(f'Compiled {count} template(s) in {elapsed:.2f}s.')
@@ -0,0 +1,311 @@
+# app/user_import.py
+# Массовый импорт пользователей из CSV (загрузка на /user/import или `flask users import`)
+# и потоковая выгрузка справочника пользователей (/user/export, `flask users export`).
+# Импорт не создает пользователей по одному, как user_create:
+# - строки проверяются по правилам UserForm одним экземпляром формы (UserImportRowForm);
+# - занятые логины находятся одним запросом на пачку логинов, повторы внутри файла - по множеству;
+# - пароли хешируются параллельно в процессах (PasswordHasher.bulk) порциями по IMPORT_BATCH_SIZE,
+#   каждая порция сразу вставляется одной транзакцией.
+# Ошибочные строки не прерывают импорт: они пропускаются и попадают в отчет с номером строки.
+# Вместо пароля строка может содержать готовый хеш (колонка password_hash в формате werkzeug) -
+# так переносят пользователей между экземплярами приложения без долгого хеширования.
+# Хеширование - основная цена импорта: pbkdf2:sha256:260000 - около 12 паролей в секунду на ядро,
+# поэтому загрузка через веб выполняется в запросе только для проверки файла и для файлов,
+# где паролей не больше USER_IMPORT_SYNC_PASSWORDS; остальные импортирует фоновое задание
+# (app/jobs.py), а страница показывает его прогресс по /jobs/<id>.
+import csv
+import io
+import os
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from .forms import UserImportRowForm
+from .jobs import job_queue
+from .logs.export import iter_batches, csv_stream, gzip_stream
+from .models import db, User
+from .passwords import password_hasher
+from .roles import role_registry
+from .stamps import touch_stamp, USERS_STAMP
+
+REQUIRED_COLUMNS = ('username', 'last_name', 'first_name')
+EXPORT_COLUMNS = ['id', 'username', 'last_name', 'first_name', 'middle_name', 'role', 'created_at']
+IMPORT_BATCH_SIZE = 1000
+LOOKUP_CHUNK_SIZE = 500
+IMPORT_ERRORS_SHOWN = 200 # Сколько ошибочных строк показывать на странице и хранить в итоге задания
+
+RowError = namedtuple('RowError', ['line', 'username', 'messages'])
+
+
+class ImportResult:
+    __slots__ = ('total', 'created', 'errors', 'dry_run', 'seconds')
+
+    def __init__(self, dry_run=False):
+        self.total = 0 # Строк данных в файле
+        self.created = 0
+        self.errors = [] # [RowError] по порядку строк
+        self.dry_run = dry_run
+        self.seconds = 0.0
+
+
+def read_csv(stream):
+    # stream - бинарный поток (загруженный файл или файл CLI); BOM от Excel отбрасывается.
+    # Возвращает итератор (номер строки, {колонка: значение}); при неверном заголовке - ValueError
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text_stream)
+    header = [name.strip().lower() for name in next(reader, [])]
+    missing = [name for name in REQUIRED_COLUMNS if name not in header]
+    if 'password' not in header and 'password_hash' not in header:
+        missing.append('password')
+    if missing:
+        raise ValueError(f'В файле нет колонок: {", ".join(missing)}')
+
+    def rows():
+        for values in reader:
+            if not any(value.strip() for value in values):
+                continue
+            yield reader.line_num, {name: value.strip() for name, value in zip(header, values)}
+    return rows()
+
+
+def _valid_hash(value):
+    # Формат werkzeug: метод$соль$хеш
+    method, _, rest = value.partition('$')
+    return bool(method) and rest.count('$') == 1
+
+
+def _validate(rows, default_role_id, result):
+    # Проверка полей и ролей; возвращает [(номер строки, запись для вставки, пароль или None)]
+    form = UserImportRowForm()
+    default_role = role_registry.get(default_role_id)
+    seen = {} # логин -> номер строки, где он встретился впервые
+    valid = []
+    for line, row in rows:
+        result.total += 1
+        username = row.get('username', '')
+        password_hash = row.get('password_hash') or None
+        form.process(data=row)
+        form.validate()
+        messages = [f'{form[name].label.text}: {message}'
+                    for name, field_errors in form.errors.items()
+                    if not (name == 'password' and password_hash)
+                    for message in field_errors]
+        if password_hash and not _valid_hash(password_hash):
+            messages.append('Неверный формат password_hash')
+
+        role_name = row.get('role')
+        role = role_registry.by_name(role_name) if role_name else default_role
+        if role_name and role is None:
+            messages.append(f'Неизвестная роль "{role_name}"')
+        elif role is None:
+            messages.append('Необходимо выбрать роль для пользователя.')
+
+        if username in seen:
+            messages.append(f'Логин уже встречается в строке {seen[username]}')
+        elif username:
+            seen[username] = line
+
+        if messages:
+            result.errors.append(RowError(line, username, messages))
+            continue
+        record = {
+            'username': username,
+            'password_hash': password_hash,
+            'last_name': row['last_name'],
+            'first_name': row['first_name'],
+            'middle_name': row.get('middle_name') or None,
+            'role_id': role.id,
+        }
+        valid.append((line, record, None if password_hash else row['password']))
+    return valid
+
+
+def _existing_usernames(usernames):
+    existing = set()
+    usernames = list(usernames)
+    for i in range(0, len(usernames), LOOKUP_CHUNK_SIZE):
+        chunk = usernames[i:i + LOOKUP_CHUNK_SIZE]
+        existing.update(username for (username,) in
+                        db.session.query(User.username).filter(User.username.in_(chunk)))
+    return existing
+
+
+def _reject_existing(valid, result):
+    existing = _existing_usernames(record['username'] for _, record, _ in valid)
+    if not existing:
+        return valid
+    kept = []
+    for line, record, password in valid:
+        if record['username'] in existing:
+            result.errors.append(RowError(line, record['username'], ['Пользователь с таким логином уже существует']))
+        else:
+            kept.append((line, record, password))
+    return kept
+
+
+def _insert_batch(batch, result):
+    try:
+        db.session.execute(insert(User), [record for _, record in batch])
+        db.session.commit()
+        return len(batch)
+    except IntegrityError:
+        # Логин успели занять после проверки (например, через форму создания): отбрасываем
+        # занятые и повторяем пачку без них
+        db.session.rollback()
+        taken = _existing_usernames(record['username'] for _, record in batch)
+        if not taken:
+            raise
+        rest = []
+        for line, record in batch:
+            if record['username'] in taken:
+                result.errors.append(RowError(line, record['username'], ['Пользователь с таким логином уже существует']))
+            else:
+                rest.append((line, record))
+        return _insert_batch(rest, result) if rest else 0
+
+
+def count_plain_passwords(rows):
+    # Сколько паролей придется хешировать (строки без готового password_hash)
+    return sum(1 for _, row in rows if row.get('password') and not row.get('password_hash'))
+
+
+def import_users(rows, default_role_id=None, dry_run=False, hash_workers=None, progress=None):
+    # rows - итератор (номер строки, {колонка: значение}), см. read_csv;
+    # progress(обработано, всего) вызывается после каждой вставленной пачки
+    started = time.perf_counter()
+    result = ImportResult(dry_run=dry_run)
+    valid = _reject_existing(_validate(rows, default_role_id, result), result)
+    if dry_run or not valid:
+        result.errors.sort(key=lambda error: error.line)
+        result.seconds = time.perf_counter() - started
+        return result
+
+    if hash_workers is None:
+        hash_workers = current_app.config.get('USER_IMPORT_HASH_WORKERS', 0)
+    # Одно время создания на весь импорт: порядок внутри него задает id
+    created_at = datetime.utcnow()
+    with password_hasher.bulk(hash_workers) as hash_batch:
+        for i in range(0, len(valid), IMPORT_BATCH_SIZE):
+            chunk = valid[i:i + IMPORT_BATCH_SIZE]
+            plain = [(record, password) for _, record, password in chunk if password is not None]
+            for (record, _), password_hash in zip(plain, hash_batch([password for _, password in plain])):
+                record['password_hash'] = password_hash
+            batch = [(line, dict(record, created_at=created_at)) for line, record, _ in chunk]
+            result.created += _insert_batch(batch, result)
+            if progress is not None:
+                progress(i + len(chunk), len(valid))
+    result.errors.sort(key=lambda error: error.line)
+    if result.created:
+        touch_stamp(USERS_STAMP) # Имена в отчете по пользователям
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def result_summary(result, errors_shown):
+    # Итог импорта для JSON (результат фонового задания): первые errors_shown ошибок
+    return {
+        'total': result.total,
+        'created': result.created,
+        'error_count': len(result.errors),
+        'errors': [error._asdict() for error in result.errors[:errors_shown]],
+        'seconds': round(result.seconds, 1),
+    }
+
+
+# --- Фоновый импорт ---
+
+def _upload_dir():
+    path = current_app.config.get('USER_IMPORT_DIR') or os.path.join(current_app.instance_path, 'imports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def enqueue_import(data, default_role_id=None, created_by=None):
+    # Файл сохраняется в USER_IMPORT_DIR (общий каталог для воркеров и `flask jobs run`)
+    # и удаляется заданием после импорта
+    path = os.path.join(_upload_dir(), f'{uuid.uuid4().hex}.csv')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return job_queue.enqueue('user_import', created_by=created_by, path=path, default_role_id=default_role_id)
+
+
+@job_queue.handler('user_import')
+def run_import(ctx, path, default_role_id=None):
+    # При повторном запуске после сбоя воркера уже созданные пользователи попадут в ошибки
+    # как занятые логины, остальные строки будут импортированы
+    try:
+        with open(path, 'rb') as f:
+            result = import_users(read_csv(f), default_role_id, progress=ctx.progress)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return result_summary(result, IMPORT_ERRORS_SHOWN)
+
+
+# --- Выгрузка ---
+
+def iter_user_batches():
+    # Серверный курсор по users, порциями (см. logs/export.iter_batches); роль - названием
+    query = db.session.query(User.id, User.username, User.last_name, User.first_name, User.middle_name,
+                             User.role_id, User.created_at).order_by(User.id)
+    for batch in iter_batches(db.session, query):
+        yield [(user_id, username, last_name, first_name, middle_name, role_registry.role_name(role_id),
+                created_at.isoformat() if created_at else None)
+               for user_id, username, last_name, first_name, middle_name, role_id, created_at in batch]
+
+
+def user_export_chunks():
+    # Колонки совпадают с колонками импорта (кроме пароля), файл можно дополнить паролями и загрузить
+    return csv_stream(EXPORT_COLUMNS, iter_user_batches())
+
+
+# --- CLI ---
+
+users_cli = AppGroup('users', help='Массовый импорт и выгрузка пользователей.')
+
+
+# flask users import FILE [--role User] [--dry-run] [--workers N]
+@users_cli.command('import')
+@click.argument('source', type=click.File('rb'))
+@click.option('--role', 'role_name', help='Роль для строк без колонки role.')
+@click.option('--dry-run', is_flag=True, help='Только проверить файл.')
+@click.option('--workers', type=int, help='Процессов для хеширования паролей (по умолчанию USER_IMPORT_HASH_WORKERS).')
+def import_command(source, role_name, dry_run, workers):
+    default_role = None
+    if role_name:
+        default_role = role_registry.by_name(role_name)
+        if default_role is None:
+            raise click.BadParameter(f'Unknown role "{role_name}"', param_hint='--role')
+    try:
+        rows = read_csv(source)
+        result = import_users(rows, default_role.id if default_role else None, dry_run=dry_run, hash_workers=workers)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise click.ClickException(str(e))
+    for error in result.errors:
+        click.echo(f'line {error.line} ({error.username}): {"; ".join(error.messages)}', err=True)
+    action = 'Checked' if dry_run else 'Created'
+    count = result.total - len(result.errors) if dry_run else result.created
+    click.echo(f'{action} {count} of {result.total} user(s), {len(result.errors)} error(s) in {result.seconds:.1f}s.')
+
+
+# flask users export [--gzip] [-o FILE]
+@users_cli.command('export')
+@click.option('--gzip', 'use_gzip', is_flag=True)
+@click.option('-o', '--output', type=click.File('wb'), default='-')
+def export_command(use_gzip, output):
+    chunks = user_export_chunks()
+    if use_gzip:
+        chunks = gzip_stream(chunks)
+    for chunk in chunks:
+        output.write(chunk)
+
+
+def init_app(app):
+    app.cli.add_command(users_cli)
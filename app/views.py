@@ -1,24 +1,87 @@
 # views.py
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+import io
+
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, jsonify, current_app
 from flask_login import login_user, login_required, logout_user, current_user
-from .models import db, User, Role, VisitLog 
-from .forms import LoginForm, UserForm, EditUserForm, ChangePasswordForm
+from sqlalchemy.orm import load_only
+from .models import db, User
+from .forms import LoginForm, UserForm, EditUserForm, ChangePasswordForm, UserImportForm
 from .decorators import check_rights
+from .logs.pagination import keyset_paginate, InvalidCursor
+from .identity import user_cache
+from .roles import role_registry
+from .passwords import password_hasher, LoginThrottled
+from .search import search_users, SEARCH_LIMIT
+from .stamps import touch_stamp, USERS_STAMP
+from .user_import import (read_csv, import_users, count_plain_passwords, enqueue_import, user_export_chunks,
+                          IMPORT_ERRORS_SHOWN)
+from .logs.export import stream_response
+from .jobs import job_queue, describe
+from .templating import render_page
 
 views = Blueprint('views', __name__)
 
+USERS_PER_PAGE = 20
+SEARCH_PAGE_LIMIT = 50
+
+# Сортировки списка пользователей: колонки ключа (каждая покрыта индексом) и направление по умолчанию
+USER_SORTS = {
+    'name': ((User.last_name, User.first_name), False),
+    'username': ((User.username,), False),
+    'created_at': ((User.created_at,), True),
+}
+
 @views.route('/')
 # @login_required # Главная страница доступна всем, но список будет пуст без входа
 def index():
     # Показываем всех пользователей только админу
     users = []
-    if current_user.is_authenticated and current_user.is_admin():
-        users = User.query.order_by(User.last_name, User.first_name).all()
+    pagination = None
+    sort = request.args.get('sort', 'name')
+    if sort not in USER_SORTS:
+        sort = 'name'
+    sort_columns, descending = USER_SORTS[sort]
+    order = request.args.get('order')
+    if order in ('asc', 'desc'):
+        descending = order == 'desc'
+
+    search_query = request.args.get('q', '').strip()
+
+    if current_user.is_authenticated and current_user.is_admin() and search_query:
+        # Результаты поиска упорядочены по релевантности, без пагинации
+        users = search_users(search_query, limit=SEARCH_PAGE_LIMIT)
+    elif current_user.is_authenticated and current_user.is_admin():
+        # Страница выбирается по индексу сортировки (keyset), без OFFSET и загрузки всей таблицы;
+        # названия ролей берутся из реестра ролей, поэтому на страницу приходится один запрос
+        query = User.query.options(load_only(User.id, User.username, User.last_name, User.first_name,
+                                             User.middle_name, User.role_id, User.created_at))
+        try:
+            pagination = keyset_paginate(query, sort_columns, User.id, cursor=request.args.get('cursor'),
+                                         per_page=USERS_PER_PAGE, descending=descending)
+        except InvalidCursor:
+            abort(400)
+        users = pagination.items
     elif current_user.is_authenticated:
-        # Обычный пользователь видит только себя в списке (или пустой список)
-        users = User.query.filter_by(id=current_user.id).all()
+        # Обычный пользователь видит только себя в списке
+        users = [current_user]
         
-    return render_template('index.html', users=users)
+    return render_page('index.html', users=users, pagination=pagination, search_query=search_query,
+                       sort=sort, order='desc' if descending else 'asc')
+
+# Поиск пользователей для автодополнения: /user/search?q=ива&limit=10
+@views.route('/user/search')
+@login_required
+@check_rights('Admin')
+def user_search():
+    limit = min(request.args.get('limit', SEARCH_LIMIT, type=int) or SEARCH_LIMIT, SEARCH_PAGE_LIMIT)
+    users = search_users(request.args.get('q', ''), limit=limit)
+    return jsonify([{
+        'id': user.id,
+        'username': user.username,
+        'full_name': user.full_name().strip(),
+        'role': role_registry.role_name(user.role_id),
+        'url': url_for('views.user_view', id=user.id),
+    } for user in users])
 
 @views.route('/login', methods=['GET', 'POST'])
 def login():
@@ -30,11 +93,28 @@ def login():
         # Сначала проверяем, что пользователь найден
         if user is None:
             flash('Пользователь с таким логином не найден.', 'warning')
+            return render_template('login.html', form=form)
+
+        # Число одновременных проверок пароля ограничено, чтобы волна входов не заняла все воркеры
+        try:
+            with password_hasher.login_slot():
+                password_ok = user.verify_password(form.password.data)
+                rehashed = password_ok and user.rehash_password_if_needed(form.password.data)
+        except LoginThrottled:
+            flash('Слишком много одновременных попыток входа. Повторите попытку через несколько секунд.', 'warning')
+            return render_template('login.html', form=form), 503
+
         # Затем проверяем пароль
-        elif not user.verify_password(form.password.data):
+        if not password_ok:
             flash('Неверный пароль.', 'warning')
         # Если все ОК
         else:
+            if rehashed:
+                # Хеш пересчитан под текущие настройки стоимости
+                try:
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
             login_user(user)
             next_page = request.args.get('next')
             if not next_page or not next_page.startswith('/'):
@@ -73,15 +153,13 @@ def user_view(id):
 @login_required
 @check_rights('Admin') # Только Admin может создавать пользователей
 def user_create():
-    form = UserForm()
-    # Динамически заполняем роли в форме перед валидацией
-    form.role.choices = [(0, 'Не выбрано')] + [(r.id, r.name) for r in Role.query.order_by('name').all()]
+    form = UserForm() # Роли для выбора форма берет из реестра ролей, без запроса к БД
 
     if form.validate_on_submit():
         # ... (код создания пользователя без изменений) ...
         # Проверяем, что выбрана роль
         role_id = form.role.data
-        selected_role = Role.query.get(role_id) if role_id != 0 else None
+        selected_role = role_registry.get(role_id)
         if not selected_role:
              flash('Необходимо выбрать роль для пользователя.', 'warning')
              # Передаем текущие данные обратно в форму
@@ -96,7 +174,7 @@ def user_create():
             last_name=form.last_name.data,
             first_name=form.first_name.data,
             middle_name=form.middle_name.data,
-            role=selected_role # Присваиваем объект роли
+            role_id=selected_role.id # Присваиваем роль
         )
         user.password = form.password.data # Хеширование через сеттер
         
@@ -113,6 +191,62 @@ def user_create():
     return render_template('user_create.html', form=form)
 
 
+# Массовое создание пользователей из CSV: Только Админ (см. app/user_import.py).
+# Проверка файла и небольшие файлы - в запросе; если паролей для хеширования больше
+# USER_IMPORT_SYNC_PASSWORDS, импорт выполняет фоновое задание, а страница (?job=<id>) показывает его ход
+@views.route('/user/import', methods=['GET', 'POST'])
+@login_required
+@check_rights('Admin')
+def user_import():
+    form = UserImportForm()
+    result = None
+    job = None
+    if form.validate_on_submit():
+        data = form.file.data.read()
+        default_role_id = form.role.data or None
+        try:
+            plain = count_plain_passwords(read_csv(io.BytesIO(data)))
+            if form.dry_run.data or plain <= current_app.config.get('USER_IMPORT_SYNC_PASSWORDS', 50):
+                # Без временного пула процессов: в запросе хешируется не больше нескольких десятков паролей
+                result = import_users(read_csv(io.BytesIO(data)), default_role_id,
+                                      dry_run=form.dry_run.data, hash_workers=0)
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f'Не удалось прочитать файл: {e}', 'danger')
+        else:
+            if result is None:
+                job = enqueue_import(data, default_role_id, created_by=current_user.id)
+                flash(f'Импорт поставлен в очередь: паролей для хеширования {plain}.', 'info')
+                return redirect(url_for('views.user_import', job=job.id))
+            if result.dry_run:
+                flash(f'Проверено строк: {result.total}, с ошибками: {len(result.errors)}.', 'info')
+            else:
+                flash(f'Создано пользователей: {result.created} из {result.total}.',
+                      'warning' if result.errors else 'success')
+    elif request.args.get('job', type=int):
+        job = job_queue.get(request.args.get('job', type=int))
+        if job is None or job.kind != 'user_import':
+            abort(404)
+    return render_template('user_import.html', form=form, result=result, job=describe(job) if job else None,
+                           errors_shown=IMPORT_ERRORS_SHOWN)
+
+# Загрузка больше MAX_CONTENT_LENGTH: на странице импорта - сообщение вместо страницы ошибки 413
+@views.app_errorhandler(413)
+def request_too_large(e):
+    if request.endpoint != 'views.user_import':
+        return e
+    limit_mb = current_app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024)
+    flash(f'Файл слишком большой: не больше {limit_mb:.0f} МБ.', 'danger')
+    return redirect(url_for('views.user_import'))
+
+# Выгрузка справочника пользователей в CSV потоком (?gzip=1 - сжатая): Только Админ
+@views.route('/user/export')
+@login_required
+@check_rights('Admin')
+def user_export():
+    use_gzip = request.args.get('gzip', '0') not in ('', '0', 'false')
+    return stream_response(user_export_chunks(), 'users', 'csv', 'text/csv', gzip=use_gzip)
+
+
 # Редактирование пользователя: Админ редактирует всех, Пользователь только себя (без роли)
 @views.route('/user/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -125,9 +259,14 @@ def user_edit(id):
         flash('У вас недостаточно прав для редактирования этого пользователя.', 'danger')
         return redirect(url_for('views.index'))
 
-    form = EditUserForm(obj=user_to_edit) # Заполняем форму данными пользователя
-     # Динамически заполняем роли, даже если поле будет отключено
-    form.role.choices = [(0, 'Не выбрано')] + [(r.id, r.name) for r in Role.query.order_by('name').all()]
+    # Заполняем форму данными пользователя. Роль передаем как id, а не через obj,
+    # чтобы не загружать связь user.role из БД (список ролей форма берет из реестра)
+    form = EditUserForm(data={
+        'last_name': user_to_edit.last_name,
+        'first_name': user_to_edit.first_name,
+        'middle_name': user_to_edit.middle_name,
+        'role': user_to_edit.role_id or 0,
+    })
 
     # Отключаем поле роли для обычного пользователя
     is_editing_self_as_user = not current_user.is_admin() and current_user.id == user_to_edit.id
@@ -143,16 +282,18 @@ def user_edit(id):
         # Роль обновляем только если редактирует Админ
         if current_user.is_admin():
              role_id = form.role.data
-             selected_role = Role.query.get(role_id) if role_id != 0 else None
+             selected_role = role_registry.get(role_id)
              if not selected_role and role_id != 0: # Если выбрано что-то кроме "Не выбрано", но роль не найдена
                  flash('Выбрана неверная роль.', 'danger')
                  # Важно вернуть шаблон с текущими данными формы
                  return render_template('user_edit.html', form=form, user=user_to_edit, is_editing_self_as_user=is_editing_self_as_user)
-             user_to_edit.role = selected_role
+             user_to_edit.role_id = selected_role.id if selected_role else None
         # Если редактирует обычный пользователь, роль не меняется (поле отключено)
 
         try:
             db.session.commit()
+            user_cache.invalidate(user_to_edit.id)
+            touch_stamp(USERS_STAMP) # Имена в отчете по пользователям
             flash('Данные пользователя успешно обновлены.', 'success')
             return redirect(url_for('views.user_view', id=user_to_edit.id)) # Возврат к просмотру профиля
         except Exception as e:
@@ -161,7 +302,7 @@ def user_edit(id):
             
     elif request.method == 'GET':
         # При GET запросе устанавливаем текущую роль пользователя в форму
-        # obj=user_to_edit в конструкторе уже должен был это сделать, но для надежности:
+        # (data в конструкторе уже должен был это сделать, но для надежности)
         form.role.data = user_to_edit.role_id or 0
         
     # Передаем флаг в шаблон, чтобы можно было скрыть/показать информацию о роли
@@ -180,20 +321,42 @@ def user_delete(id):
         flash('Вы не можете удалить свою учетную запись.', 'danger')
         return redirect(url_for('views.index'))
         
+    user_id = user_to_delete.id
+    user_name = user_to_delete.full_name()
     try:
-        # Перед удалением пользователя, возможно, нужно обработать связанные логи
-        # Например, установить user_id в NULL в visit_logs
-        VisitLog.query.filter_by(user_id=user_to_delete.id).update({'user_id': None})
-        # Теперь можно удалять пользователя
+        # Записи журнала и счетчики отчетов удаленного пользователя переходят к неаутентифицированным
+        # в фоновом задании небольшими порциями (см. app/jobs.py), поэтому запрос не ждет прохода
+        # по журналу. Удаление пользователя и задание фиксируются одной транзакцией (enqueue)
         db.session.delete(user_to_delete)
-        db.session.commit()
-        flash(f'Пользователь "{user_to_delete.full_name()}" успешно удален.', 'success')
+        job = job_queue.enqueue('user_delete', created_by=current_user.id, user_id=user_id)
+        user_cache.invalidate(user_id)
+        touch_stamp(USERS_STAMP)
+        flash(f'Пользователь "{user_name}" успешно удален. Журнал посещений обновляется в фоне '
+              f'(задание №{job.id}).', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Ошибка при удалении пользователя: {str(e)}', 'danger')
     
     return redirect(url_for('views.index'))
 
+# Состояние фонового задания для опроса: Только Админ
+@views.route('/jobs/<int:id>')
+@login_required
+@check_rights('Admin')
+def job_status(id):
+    job = job_queue.get(id)
+    if job is None:
+        abort(404)
+    return jsonify(describe(job))
+
+# Последние задания: /jobs?limit=20
+@views.route('/jobs')
+@login_required
+@check_rights('Admin')
+def job_list():
+    limit = min(request.args.get('limit', 20, type=int) or 20, 100)
+    return jsonify([describe(job) for job in job_queue.recent(limit)])
+
 # Изменение пароля: Любой залогиненный пользователь для себя
 @views.route('/change-password', methods=['GET', 'POST'])
 @login_required # Достаточно @login_required, так как пользователь меняет свой пароль
@@ -201,14 +364,16 @@ def change_password():
     # ... (код без изменений) ...
     form = ChangePasswordForm()
     if form.validate_on_submit():
-        if not current_user.verify_password(form.old_password.data):
+        user = current_user.get_model() # current_user - снимок из кэша, проверяем и меняем ORM-объект
+        if not user.verify_password(form.old_password.data):
             flash('Старый пароль введен неверно.', 'warning')
         elif form.new_password.data == form.old_password.data:
              flash('Новый пароль не должен совпадать со старым.', 'warning')
         else:
-            current_user.password = form.new_password.data # Используем сеттер
+            user.password = form.new_password.data # Используем сеттер
             try:
                 db.session.commit()
+                user_cache.invalidate(user.id)
                 flash('Пароль успешно изменен.', 'success')
                 # После смены пароля хорошо бы перенаправить на страницу профиля или главную
                 return redirect(url_for('views.user_view', id=current_user.id)) 
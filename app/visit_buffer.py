@@ -0,0 +1,182 @@
+# app/visit_buffer.py
+# Буферизованная запись журнала посещений.
+# Запросы только кладут запись в ограниченную очередь в памяти, а фоновый поток
+# пачкой вставляет накопленное в visit_logs: каждые N записей или каждые T мс.
+import atexit
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import insert
+
+from .models import db, VisitLog
+from .visit_paths import path_dictionary
+
+
+class VisitLogBuffer:
+    # Политики поведения при переполненной очереди
+    POLICY_DROP = 'drop'
+    POLICY_BLOCK = 'block'
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {'queued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+        self._flush_listeners = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('VISIT_LOG_BUFFERED', True)
+        self.queue_size = app.config.get('VISIT_LOG_QUEUE_SIZE', 10000)
+        self.batch_size = app.config.get('VISIT_LOG_BATCH_SIZE', 500)
+        self.flush_interval = app.config.get('VISIT_LOG_FLUSH_INTERVAL_MS', 1000) / 1000.0
+        self.full_policy = app.config.get('VISIT_LOG_FULL_POLICY', self.POLICY_DROP)
+        self.block_timeout = app.config.get('VISIT_LOG_BLOCK_TIMEOUT_MS', 100) / 1000.0
+        if self.full_policy not in (self.POLICY_DROP, self.POLICY_BLOCK):
+            raise ValueError(f"Unknown VISIT_LOG_FULL_POLICY: {self.full_policy!r}")
+        app.extensions['visit_buffer'] = self
+        # При штатном завершении воркера сбрасываем все, что осталось в очереди
+        atexit.register(self.close)
+
+    def add(self, record):
+        # record - словарь с полями VisitLog (user_id, created_at, sample_weight), но вместо
+        # path_id - строки path и route: номера из словаря подставляются при записи пачки
+        if not self.enabled:
+            self._write([record])
+            return True
+
+        self._ensure_started()
+        try:
+            if self.full_policy == self.POLICY_BLOCK:
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('queued')
+        return True
+
+    def on_flush(self, listener):
+        # listener() вызывается в контексте приложения после каждой записанной пачки
+        # (например, для обновления счетчиков отчетов)
+        if listener not in self._flush_listeners:
+            self._flush_listeners.append(listener)
+        return listener
+
+    def flush(self):
+        # Синхронно записывает все, что накопилось в очереди на данный момент
+        if self._queue is None or self._pid != os.getpid():
+            return 0
+        written = 0
+        while True:
+            batch = self._drain_nowait()
+            if not batch:
+                return written
+            self._write(batch)
+            written += len(batch)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval * 2 + 1)
+        self.flush()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._counters)
+        stats['pending'] = self._queue.qsize() if self._queue is not None else 0
+        stats['enabled'] = self.enabled
+        stats['full_policy'] = self.full_policy if self.app is not None else None
+        return stats
+
+    # --- Внутренняя кухня ---
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._counters[name] += value
+
+    def _ensure_started(self):
+        # Поток запускается лениво и заново после fork (воркеры gunicorn с --preload
+        # получают копию родительского объекта без работающего потока)
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            if self._queue is None or self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+            self._stop = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='visit-log-flusher', daemon=True)
+            self._thread.start()
+
+    def _drain_nowait(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            # Добираем пачку до batch_size, но ждем не дольше flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            with self.app.app_context():
+                db.session.execute(insert(VisitLog), _with_path_ids(batch))
+                db.session.commit()
+                self._count('flushed', len(batch))
+                self._count('batches')
+                self._notify_listeners()
+        except Exception:
+            self._count('failed', len(batch))
+            self.app.logger.exception('Error writing %d visit log record(s)', len(batch))
+
+    def _notify_listeners(self):
+        for listener in self._flush_listeners:
+            try:
+                listener()
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('Visit log flush listener %r failed', listener)
+
+
+def _with_path_ids(batch):
+    path_ids = path_dictionary.intern({record['path']: record.get('route') for record in batch})
+    rows = []
+    for record in batch:
+        row = {key: value for key, value in record.items() if key not in ('path', 'route')}
+        row['path_id'] = path_ids[record['path']]
+        rows.append(row)
+    return rows
+
+
+visit_buffer = VisitLogBuffer()
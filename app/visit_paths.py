@@ -0,0 +1,192 @@
+# app/visit_paths.py
+# Словарь путей журнала посещений. Запись visit_logs хранит вместо строки пути номер строки
+# в visit_paths; у пути в словаре есть ссылка на шаблон маршрута, которым он был обработан
+# (request.url_rule, например /user/<int:id>), - шаблоны хранятся в том же словаре.
+# Так отчеты могут группировать посещения и по конкретным страницам, и по маршрутам.
+# Строки словаря не меняются и не удаляются, поэтому соответствия строка <-> номер
+# кэшируются в памяти процесса без сброса.
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from flask import current_app
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.exceptions import HTTPException, MethodNotAllowed
+from werkzeug.routing import RequestRedirect
+
+from .cache import LRUCache
+from .models import db, VisitLog, VisitPath, PageVisitRollup, RouteVisitRollup
+
+PathEntry = namedtuple('PathEntry', ['path', 'route'])
+
+MAX_PATH_LENGTH = 255
+LOOKUP_CHUNK_SIZE = 500
+MIGRATE_BATCH_SIZE = 50000
+
+
+class PathDictionary:
+    def __init__(self, app=None):
+        self._ids = LRUCache(maxsize=10000) # строка -> номер
+        self._entries = LRUCache(maxsize=10000) # номер -> PathEntry
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        size = app.config.get('VISIT_PATH_CACHE_SIZE', 10000)
+        self._ids = LRUCache(maxsize=size)
+        self._entries = LRUCache(maxsize=size)
+        app.extensions['visit_paths'] = self
+
+    def intern(self, routes):
+        # routes - {путь: шаблон маршрута или None}; возвращает {путь: номер}.
+        # Новые строки добавляются отдельной короткой транзакцией, поэтому номера в кэше
+        # не пропадут, даже если вызывающая транзакция будет откачена
+        ids = {}
+        for path in routes:
+            path_id = self._ids.get(path)
+            if path_id is not None:
+                ids[path] = path_id
+        missing = {path: route for path, route in routes.items() if path not in ids}
+        if not missing:
+            return ids
+
+        # Сначала шаблоны маршрутов, затем пути со ссылками на них
+        route_ids = self._ensure({route: None for route in missing.values() if route})
+        ids.update(self._ensure({path: route_ids.get(route) for path, route in missing.items()}))
+        return ids
+
+    def entries(self, path_ids):
+        # {номер: PathEntry(путь, шаблон)} для номеров из записей журнала
+        result = {}
+        missing = set()
+        for path_id in path_ids:
+            entry = self._entries.get(path_id)
+            if entry is None:
+                missing.add(path_id)
+            else:
+                result[path_id] = entry
+        missing = list(missing)
+        for i in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+            chunk = missing[i:i + LOOKUP_CHUNK_SIZE]
+            rows = db.session.query(VisitPath.id, VisitPath.value, VisitPath.route_id)\
+                .filter(VisitPath.id.in_(chunk)).all()
+            route_values = self._values({route_id for _, _, route_id in rows if route_id})
+            for path_id, value, route_id in rows:
+                entry = PathEntry(value, route_values.get(route_id))
+                self._entries.set(path_id, entry)
+                result[path_id] = entry
+        return result
+
+    def prefix_ids(self, session, prefix):
+        # Номера путей, начинающихся с prefix: диапазон по уникальному индексу value
+        # (LIKE в SQLite индекс не использует), startswith уточняет его при другой сортировке строк
+        return [path_id for (path_id,) in session.query(VisitPath.id)
+                .filter(VisitPath.value >= prefix, VisitPath.value < prefix + '\U0010ffff',
+                        VisitPath.value.startswith(prefix, autoescape=True))]
+
+    def prefix_filter(self, column, prefix):
+        # Условие "путь начинается с prefix" для колонки с номером пути
+        matching = select(VisitPath.id).where(VisitPath.value.startswith(prefix, autoescape=True))
+        return column.in_(matching)
+
+    def stats(self):
+        ids, entries = self._ids.stats(), self._entries.stats()
+        return {'size': ids['size'], 'hits': ids['hits'], 'misses': ids['misses'],
+                'entries_size': entries['size'], 'entries_hits': entries['hits'],
+                'entries_misses': entries['misses']}
+
+    def clear(self):
+        self._ids.clear()
+        self._entries.clear()
+
+    # --- Внутренняя кухня ---
+
+    def _values(self, path_ids):
+        if not path_ids:
+            return {}
+        rows = db.session.query(VisitPath.id, VisitPath.value).filter(VisitPath.id.in_(list(path_ids))).all()
+        return dict(rows)
+
+    def _ensure(self, values):
+        # values - {строка: номер шаблона или None}; возвращает {строка: номер}
+        if not values:
+            return {}
+        rows = [{'value': value, 'route_id': route_id} for value, route_id in values.items()]
+        dialect = db.session.get_bind(mapper=VisitPath.__mapper__).dialect.name
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(VisitPath)
+        # Строка могла уже попасть в словарь как шаблон маршрута ('/'): ссылку на шаблон дописываем
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['value'],
+            set_={'route_id': func.coalesce(VisitPath.route_id, stmt.excluded.route_id)},
+        )
+        db.session.execute(stmt, rows)
+        db.session.commit()
+
+        ids = {}
+        keys = list(values)
+        for i in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            chunk = keys[i:i + LOOKUP_CHUNK_SIZE]
+            ids.update(db.session.query(VisitPath.value, VisitPath.id).filter(VisitPath.value.in_(chunk)).all())
+        for value, path_id in ids.items():
+            self._ids.set(value, path_id)
+        return ids
+
+
+path_dictionary = PathDictionary()
+
+
+def route_for_path(path, method='GET'):
+    # Шаблон маршрута для пути из старых записей журнала (у новых он берется из request.url_rule)
+    adapter = current_app.url_map.bind('localhost')
+    try:
+        rule, _ = adapter.match(path, method=method, return_rule=True)
+    except RequestRedirect as e:
+        return route_for_path(urlsplit(e.new_url).path, method)
+    except MethodNotAllowed as e:
+        # Например, POST /user/delete/<id>
+        return route_for_path(path, e.valid_methods[0]) if method == 'GET' and e.valid_methods else None
+    except HTTPException:
+        return None
+    return rule.rule
+
+
+def migrate_legacy_paths(log=print):
+    # Переводит visit_logs со строковой колонки path на номера в словаре visit_paths
+    # (колонку path_id к этому моменту уже добавил ensure_columns) и удаляет колонку path
+    engine = db.session.get_bind(mapper=VisitLog.__mapper__)
+    columns = {column['name'] for column in inspect(engine).get_columns(VisitLog.__tablename__)}
+    if 'path' not in columns:
+        return
+
+    with engine.connect() as conn:
+        paths = [path for (path,) in conn.execute(text('SELECT DISTINCT path FROM visit_logs'))]
+        max_id = conn.execute(text('SELECT MAX(id) FROM visit_logs')).scalar() or 0
+    paths += [path for (path,) in db.session.query(PageVisitRollup.path).distinct()]
+    routes = {path: route_for_path(path) for path in set(paths)}
+    path_dictionary.intern(routes)
+
+    for lower in range(0, max_id, MIGRATE_BATCH_SIZE):
+        with engine.begin() as conn:
+            conn.execute(text(
+                'UPDATE visit_logs SET path_id = (SELECT id FROM visit_paths WHERE value = visit_logs.path) '
+                'WHERE id > :lower AND id <= :upper AND path_id IS NULL'
+            ), {'lower': lower, 'upper': lower + MIGRATE_BATCH_SIZE})
+    log(f'Moved visit_logs.path of {max_id} row(s) to visit_paths ({len(routes)} distinct path(s))')
+
+    # Счетчики по маршрутам - из уже накопленных счетчиков по страницам (включая архивные месяцы)
+    if not db.session.query(RouteVisitRollup.day).first():
+        totals = {}
+        for day, path, visit_count in db.session.query(PageVisitRollup.day, PageVisitRollup.path,
+                                                       PageVisitRollup.visit_count):
+            key = (day, routes.get(path) or '')
+            totals[key] = totals.get(key, 0) + visit_count
+        db.session.bulk_insert_mappings(RouteVisitRollup, [
+            {'day': day, 'route': route, 'visit_count': n} for (day, route), n in totals.items()
+        ])
+        db.session.commit()
+
+    db.session.commit()
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE visit_logs DROP COLUMN path'))
+    log('Dropped column visit_logs.path (run VACUUM to reclaim the space)')
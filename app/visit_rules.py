@@ -0,0 +1,105 @@
+# app/visit_rules.py
+# Правила записи журнала посещений. Список VISIT_LOG_RULES из конфигурации один раз
+# при старте компилируется в набор проверок; для каждого запроса берется первое подходящее
+# правило (если ни одно не подошло - записывается каждое посещение).
+#
+# Правило - словарь:
+#   endpoint    - имя эндпоинта или список имен, допускаются шаблоны ('*.static');
+#   path_prefix - префикс пути или список префиксов;
+#   path_regex  - регулярное выражение для пути (re.search);
+#   user_agent  - регулярное выражение для User-Agent (без учета регистра);
+#   action      - 'include' (по умолчанию) или 'exclude';
+#   sample_rate - доля записываемых посещений (по умолчанию 1).
+# Условия внутри правила объединяются через И. При выборке 1 из N запись получает
+# sample_weight = N, а отчеты суммируют веса, поэтому оценка числа посещений несмещенная.
+# Доля округляется до 1/N с целым N: sample_rate=0.3 записывает каждое третье посещение.
+import fnmatch
+import random
+import re
+
+ACTION_INCLUDE = 'include'
+ACTION_EXCLUDE = 'exclude'
+
+RULE_KEYS = {'endpoint', 'path_prefix', 'path_regex', 'user_agent', 'action', 'sample_rate'}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+class VisitRule:
+    __slots__ = ('endpoints', 'endpoint_re', 'path_prefixes', 'path_re', 'user_agent_re', 'weight', 'index')
+
+    def __init__(self, spec, index):
+        unknown = set(spec) - RULE_KEYS
+        if unknown:
+            raise ValueError(f'VISIT_LOG_RULES[{index}]: unknown keys {sorted(unknown)}')
+        action = spec.get('action', ACTION_INCLUDE)
+        if action not in (ACTION_INCLUDE, ACTION_EXCLUDE):
+            raise ValueError(f'VISIT_LOG_RULES[{index}]: unknown action {action!r}')
+        rate = float(spec.get('sample_rate', 1))
+        if not 0 < rate <= 1 and action == ACTION_INCLUDE:
+            raise ValueError(f'VISIT_LOG_RULES[{index}]: sample_rate must be in (0, 1]')
+
+        self.index = index
+        # Вес записанного посещения; None - не записывать
+        self.weight = None if action == ACTION_EXCLUDE else max(1, round(1 / rate))
+
+        endpoints = _as_list(spec.get('endpoint'))
+        patterns = [e for e in endpoints if any(ch in e for ch in '*?[')]
+        self.endpoints = frozenset(e for e in endpoints if e not in patterns)
+        self.endpoint_re = re.compile('|'.join(fnmatch.translate(p) for p in patterns)) if patterns else None
+        self.path_prefixes = tuple(_as_list(spec.get('path_prefix'))) or None
+        self.path_re = re.compile(spec['path_regex']) if spec.get('path_regex') else None
+        self.user_agent_re = re.compile(spec['user_agent'], re.IGNORECASE) if spec.get('user_agent') else None
+        if not (endpoints or self.path_prefixes or self.path_re or self.user_agent_re):
+            raise ValueError(f'VISIT_LOG_RULES[{index}]: rule has no conditions')
+
+    def matches(self, endpoint, path, user_agent):
+        if self.endpoints or self.endpoint_re:
+            if endpoint not in self.endpoints and not (self.endpoint_re and self.endpoint_re.match(endpoint)):
+                return False
+        if self.path_prefixes and not path.startswith(self.path_prefixes):
+            return False
+        if self.path_re and not self.path_re.search(path):
+            return False
+        if self.user_agent_re and not self.user_agent_re.search(user_agent):
+            return False
+        return True
+
+
+class VisitRules:
+    def __init__(self, app=None):
+        self.rules = []
+        self._random = random.random
+        self.excluded = 0
+        self.sampled_out = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rules = [VisitRule(spec, i) for i, spec in enumerate(app.config.get('VISIT_LOG_RULES') or [])]
+        self.excluded = 0
+        self.sampled_out = 0
+        app.extensions['visit_rules'] = self
+
+    def decide(self, endpoint, path, user_agent=''):
+        # Возвращает вес записи или None, если посещение не записывается
+        for rule in self.rules:
+            if rule.matches(endpoint, path, user_agent):
+                if rule.weight is None:
+                    self.excluded += 1
+                    return None
+                if rule.weight > 1 and self._random() * rule.weight >= 1:
+                    self.sampled_out += 1
+                    return None
+                return rule.weight
+        return 1
+
+    def stats(self):
+        return {'rules': len(self.rules), 'excluded': self.excluded, 'sampled_out': self.sampled_out}
+
+
+visit_rules = VisitRules()
@@ -0,0 +1,241 @@
+# benchmarks/endpoints.py
+# Нагрузочный тест основных страниц на нескольких объемах данных.
+# Для каждого объема создается временная база (bootstrap + benchmarks/seed_data.py), затем
+# каждый сценарий выполняется заданное число раз через тестовый клиент Flask или по HTTP
+# у уже запущенного сервера (--base-url, например gunicorn над той же базой).
+# Результат - перцентили задержки, пропускная способность и пиковая память (tracemalloc,
+# только для тестового клиента) в формате JSON Lines с хешем коммита, чтобы сравнивать
+# результаты между коммитами.
+#
+#   python benchmarks/endpoints.py --scales 100:10000,2000:200000 --requests 50
+#   python benchmarks/endpoints.py --scales 5000:2000000 --output results.jsonl
+#   DATABASE_URL=sqlite:////tmp/bench.db gunicorn -w 4 run:app &
+#   python benchmarks/endpoints.py --base-url http://127.0.0.1:8000 --requests 200
+import argparse
+import contextlib
+import http.cookiejar
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ADMIN_USERNAME = 'admin'
+ADMIN_PASSWORD = 'Admin123!'
+
+# Сценарии: имя -> путь. log_visit измеряется отдельно (вызов хука без маршрута)
+SCENARIOS = {
+    'index': '/',
+    'visit_log_index': '/logs/',
+    'page_stats': '/logs/pages',
+    'user_stats': '/logs/users',
+    'page_stats_csv': '/logs/pages/export',
+    'user_stats_csv': '/logs/users/export',
+    'raw_export_csv': '/logs/export/raw?limit=10000',
+}
+
+
+class TestClientDriver:
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+
+    def login(self):
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.client.post('/login', data={'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+
+    def get(self, path):
+        response = self.client.get(path)
+        body = response.get_data() # Потоковые ответы читаются целиком
+        return response.status_code, len(body)
+
+
+class HttpDriver:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def login(self):
+        page = self.opener.open(self.base_url + '/login').read().decode()
+        token = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', page)
+        data = {'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD}
+        if token:
+            data['csrf_token'] = token.group(1)
+        self.opener.open(self.base_url + '/login', urllib.parse.urlencode(data).encode()).read()
+
+    def get(self, path):
+        try:
+            with self.opener.open(self.base_url + path) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, 0
+
+
+def percentile_ms(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+
+def measure(call, requests, warmup, memory_samples):
+    for _ in range(warmup):
+        call()
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        t = time.perf_counter()
+        ok = call()
+        latencies.append(time.perf_counter() - t)
+        errors += 0 if ok else 1
+    elapsed = time.perf_counter() - started
+
+    peak = None
+    if memory_samples:
+        # Отдельный проход: tracemalloc заметно замедляет выполнение и исказил бы задержки
+        tracemalloc.start()
+        for _ in range(memory_samples):
+            call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': percentile_ms(latencies, 0.5),
+        'p95_ms': percentile_ms(latencies, 0.95),
+        'p99_ms': percentile_ms(latencies, 0.99),
+        'max_ms': percentile_ms(latencies, 1.0),
+        'rps': round(requests / elapsed, 1) if elapsed else None,
+        'peak_memory_kib': round(peak / 1024, 1) if peak is not None else None,
+    }
+
+
+def endpoint_call(driver, path):
+    def call():
+        status, _ = driver.get(path)
+        return status == 200
+    return call
+
+
+def log_visit_call(app, stack):
+    # Хук before_request без маршрута и шаблона: стоимость записи посещения для каждого запроса
+    from app import log_visit
+    stack.enter_context(app.test_request_context('/user/1'))
+
+    def call():
+        log_visit()
+        return True
+    return call
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_scales(value):
+    # "users:visits,users:visits"
+    scales = []
+    for item in value.split(','):
+        users, visits = item.split(':')
+        scales.append((int(users), int(visits)))
+    return scales
+
+
+def run_scale(users, visits, args, emit):
+    from app import create_app
+    from app.bootstrap import bootstrap_database
+    from app.config import config_by_name
+    from app.logs.rollups import refresh_rollups
+    from app.visit_buffer import visit_buffer
+    from seed_data import seed
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = type('BenchmarkConfig', (config_by_name[args.config],), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'bench.db'),
+        })
+        app = create_app(config)
+        with app.app_context():
+            started = time.perf_counter()
+            bootstrap_database(log=lambda message: None)
+            seed(users, visits, log=lambda message: None)
+            refresh_rollups()
+            seed_seconds = round(time.perf_counter() - started, 1)
+
+        driver = TestClientDriver(app)
+        driver.login()
+        for name in args.scenarios:
+            with contextlib.ExitStack() as stack:
+                if name == 'log_visit':
+                    call = log_visit_call(app, stack)
+                else:
+                    call = endpoint_call(driver, SCENARIOS[name])
+                result = measure(call, args.requests, args.warmup, args.memory_samples)
+            emit(dict(result, scenario=name, users=users, visits=visits, seed_seconds=seed_seconds))
+        visit_buffer.close()
+
+
+def main():
+    all_scenarios = ['log_visit'] + list(SCENARIOS)
+    parser = argparse.ArgumentParser(description='Задержка, пропускная способность и память основных страниц')
+    parser.add_argument('--scales', default='100:10000,1000:100000',
+                        help='Объемы данных: пользователи:посещения через запятую')
+    parser.add_argument('--scenarios', default=','.join(all_scenarios))
+    parser.add_argument('--requests', type=int, default=30, help='Запросов на сценарий')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--memory-samples', type=int, default=3, help='Запросов под tracemalloc (0 - не измерять)')
+    parser.add_argument('--config', default='default', help='Профиль конфигурации (см. app/config.py)')
+    parser.add_argument('--base-url', help='Нагружать уже запущенный сервер вместо тестового клиента')
+    parser.add_argument('--output', help='Дописать результаты в файл JSON Lines')
+    args = parser.parse_args()
+    args.scenarios = args.scenarios.split(',')
+
+    commit = git_commit()
+    output = open(args.output, 'a') if args.output else None
+
+    def emit(result):
+        result = dict(result, commit=commit, driver='http' if args.base_url else 'test_client')
+        line = json.dumps(result, ensure_ascii=False)
+        print(line)
+        if output:
+            output.write(line + '\n')
+            output.flush()
+
+    try:
+        if args.base_url:
+            # Данные уже лежат в базе сервера; log_visit отдельно не измеряется
+            driver = HttpDriver(args.base_url)
+            driver.login()
+            for name in args.scenarios:
+                if name in SCENARIOS:
+                    result = measure(endpoint_call(driver, SCENARIOS[name]), args.requests, args.warmup, 0)
+                    emit(dict(result, scenario=name, base_url=args.base_url))
+        elif len(parse_scales(args.scales)) == 1:
+            users, visits = parse_scales(args.scales)[0]
+            run_scale(users, visits, args, emit)
+        else:
+            # Каждый объем - в отдельном процессе: чистые синглтоны приложения и честная пиковая память
+            for item in args.scales.split(','):
+                argv = [a for a in sys.argv[1:]]
+                subprocess.run([sys.executable, os.path.abspath(__file__), *argv, '--scales', item], check=True)
+            return
+    finally:
+        if output:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
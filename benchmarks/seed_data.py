@@ -0,0 +1,132 @@
+# benchmarks/seed_data.py
+# Быстрое наполнение базы тестовыми данными для нагрузочных тестов.
+# Пользователи получают один заранее вычисленный хеш пароля (хеширование тысяч паролей
+# заняло бы минуты), посещения распределены по страницам и пользователям по закону Ципфа:
+# несколько популярных страниц и активных пользователей дают большую часть журнала,
+# около трети посещений - без входа. Время посещений растет вместе с id, как в реальном журнале.
+#
+#   DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/seed_data.py --users 5000 --visits 2000000
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert  # noqa: E402
+
+from app.models import db, User, VisitLog  # noqa: E402
+from app.roles import role_registry  # noqa: E402
+from app.visit_paths import path_dictionary, route_for_path  # noqa: E402
+
+BENCH_PASSWORD = 'Bench123!'
+BATCH_SIZE = 20000
+ANONYMOUS_SHARE = 0.3
+
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+              'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров']
+FIRST_NAMES = ['Александр', 'Дмитрий', 'Максим', 'Сергей', 'Андрей', 'Алексей', 'Артём', 'Илья',
+               'Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Екатерина', 'Татьяна', 'Ирина']
+MIDDLE_NAMES = ['Александрович', 'Дмитриевич', 'Сергеевич', 'Андреевич', 'Алексеевич', 'Ильич', None]
+
+# Страницы приложения; /user/<id> подставляется для конкретных пользователей
+STATIC_PATHS = ['/', '/logs/', '/logs/pages', '/logs/users', '/login', '/change-password',
+                '/user/create', '/logs/pages/export', '/logs/users/export', '/logout']
+
+
+def zipf_sampler(n, rng, s=1.1):
+    # Выбор индекса 0..n-1 с вероятностью ~ 1/(k+1)^s
+    weights = list(itertools.accumulate(1.0 / (k + 1) ** s for k in range(n)))
+    total = weights[-1]
+    return lambda: bisect.bisect_left(weights, rng.random() * total)
+
+
+def seed_users(count, rng, log=print):
+    role = role_registry.by_name('User')
+    password_hash = User(password=BENCH_PASSWORD).password_hash
+    start = datetime.utcnow() - timedelta(days=365)
+    existing = db.session.query(db.func.count(User.id)).scalar()
+    rows = []
+    for i in range(count):
+        rows.append({
+            'username': f'bench{existing + i:07d}',
+            'password_hash': password_hash,
+            'last_name': rng.choice(LAST_NAMES),
+            'first_name': rng.choice(FIRST_NAMES),
+            'middle_name': rng.choice(MIDDLE_NAMES),
+            'role_id': role.id if role else None,
+            'created_at': start + timedelta(seconds=rng.randrange(365 * 86400)),
+        })
+        if len(rows) >= BATCH_SIZE:
+            db.session.execute(insert(User), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(User), rows)
+    db.session.commit()
+    log(f'Users: +{count}')
+    return [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+
+
+def seed_visits(count, user_ids, days, rng, log=print):
+    pick_path = zipf_sampler(len(STATIC_PATHS) + len(user_ids), rng)
+    pick_user = zipf_sampler(len(user_ids), rng)
+    # Активные пользователи - не первые по id, а случайные
+    users_by_activity = user_ids[:]
+    rng.shuffle(users_by_activity)
+    start = datetime.utcnow() - timedelta(days=days)
+    step = days * 86400.0 / max(count, 1)
+    # Номера путей в словаре visit_paths - заранее для всех страниц
+    paths = STATIC_PATHS + [f'/user/{user_id}' for user_id in users_by_activity]
+    path_ids = path_dictionary.intern({path: route_for_path(path) for path in paths})
+
+    written = 0
+    started = time.perf_counter()
+    while written < count:
+        rows = []
+        for i in range(written, min(count, written + BATCH_SIZE)):
+            path = paths[pick_path()]
+            user_id = None if rng.random() < ANONYMOUS_SHARE else users_by_activity[pick_user()]
+            rows.append({
+                'path_id': path_ids[path],
+                'user_id': user_id,
+                'created_at': start + timedelta(seconds=(i + rng.random() * 0.9) * step),
+            })
+        db.session.execute(insert(VisitLog), rows)
+        db.session.commit()
+        written += len(rows)
+    elapsed = time.perf_counter() - started
+    log(f'Visits: +{count} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s)')
+
+
+def seed(users, visits, days=90, random_seed=1, log=print):
+    # Вызывается в контексте приложения над базой после `flask bootstrap`
+    rng = random.Random(random_seed)
+    user_ids = seed_users(users, rng, log=log)
+    seed_visits(visits, user_ids, days, rng, log=log)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Наполнение базы пользователями и журналом посещений')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--visits', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=90, help='За сколько последних дней распределить посещения')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.bootstrap import bootstrap_database
+    from app.logs.rollups import refresh_rollups
+
+    app = create_app()
+    with app.app_context():
+        bootstrap_database()
+        seed(args.users, args.visits, days=args.days, random_seed=args.seed)
+        refresh_rollups()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# benchmarks/sqlite_contention.py
+# Нагрузочный тест конкурентного доступа к SQLite для разных профилей PRAGMA.
+# Несколько процессов (как воркеры gunicorn) одновременно пишут в visit_logs по одной
+# записи на "запрос" и читают агрегаты, как страницы статистики. Для каждого профиля
+# выводится пропускная способность, перцентили задержки и число ошибок блокировки.
+#
+#   python benchmarks/sqlite_contention.py --workers 8 --seconds 10
+#   python benchmarks/sqlite_contention.py --profiles rollback,production --json
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import DevelopmentConfig, ProductionConfig  # noqa: E402
+
+# Поведение SQLite по умолчанию (как было до профиля): журнал отката и полный fsync
+PROFILES = {
+    'rollback': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000},
+    'development': DevelopmentConfig.SQLITE_PRAGMAS,
+    'production': ProductionConfig.SQLITE_PRAGMAS,
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS visit_logs (
+    id INTEGER PRIMARY KEY,
+    path VARCHAR(255) NOT NULL,
+    user_id INTEGER,
+    created_at DATETIME
+);
+CREATE INDEX IF NOT EXISTS ix_visit_logs_created_at ON visit_logs (created_at);
+'''
+
+
+def connect(path, pragmas):
+    conn = sqlite3.connect(path, timeout=5)
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name}={value}')
+    return conn
+
+
+def prepare(path, pragmas, rows):
+    conn = connect(path, pragmas)
+    conn.executescript(SCHEMA)
+    conn.executemany(
+        'INSERT INTO visit_logs (path, user_id, created_at) VALUES (?, ?, datetime("now"))',
+        ((f'/page/{i % 200}', i % 50 or None) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def worker(args):
+    path, pragmas, seconds, write_ratio, seed = args
+    rng = random.Random(seed)
+    conn = connect(path, pragmas)
+    latencies = {'write': [], 'read': []}
+    errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        kind = 'write' if rng.random() < write_ratio else 'read'
+        started = time.perf_counter()
+        try:
+            if kind == 'write':
+                conn.execute(
+                    'INSERT INTO visit_logs (path, user_id, created_at) VALUES (?, ?, datetime("now"))',
+                    (f'/page/{rng.randrange(200)}', rng.randrange(50) or None),
+                )
+                conn.commit()
+            else:
+                conn.execute(
+                    'SELECT path, count(*) FROM visit_logs '
+                    'WHERE id > (SELECT max(id) FROM visit_logs) - 5000 GROUP BY path'
+                ).fetchall()
+        except sqlite3.OperationalError:
+            errors += 1
+            conn.rollback()
+            continue
+        latencies[kind].append(time.perf_counter() - started)
+    conn.close()
+    return latencies, errors
+
+
+def percentile_ms(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+
+def run_profile(name, pragmas, workers, seconds, write_ratio, rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        prepare(path, pragmas, rows)
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(worker, [(path, pragmas, seconds, write_ratio, i) for i in range(workers)])
+
+    writes = [x for lat, _ in results for x in lat['write']]
+    reads = [x for lat, _ in results for x in lat['read']]
+    return {
+        'profile': name,
+        'workers': workers,
+        'seconds': seconds,
+        'ops_per_sec': round((len(writes) + len(reads)) / seconds, 1),
+        'writes_per_sec': round(len(writes) / seconds, 1),
+        'reads_per_sec': round(len(reads) / seconds, 1),
+        'write_p50_ms': percentile_ms(writes, 0.5),
+        'write_p99_ms': percentile_ms(writes, 0.99),
+        'read_p50_ms': percentile_ms(reads, 0.5),
+        'read_p99_ms': percentile_ms(reads, 0.99),
+        'lock_errors': sum(errors for _, errors in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Конкурентный доступ к SQLite для разных профилей PRAGMA')
+    parser.add_argument('--profiles', default=','.join(PROFILES))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.5)
+    parser.add_argument('--rows', type=int, default=50000, help='Начальное число строк в visit_logs')
+    parser.add_argument('--json', action='store_true', help='Вывод в формате JSON Lines')
+    args = parser.parse_args()
+
+    for name in args.profiles.split(','):
+        result = run_profile(name, PROFILES[name], args.workers, args.seconds, args.write_ratio, args.rows)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{name:12} {result['ops_per_sec']:>9} ops/s  "
+                  f"write p50/p99 {result['write_p50_ms']}/{result['write_p99_ms']} ms  "
+                  f"read p50/p99 {result['read_p50_ms']}/{result['read_p99_ms']} ms  "
+                  f"lock errors {result['lock_errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# benchmarks/startup_time.py
+# Время холодного старта воркера: импорт пакета app и create_app в отдельном процессе.
+# Режим 'legacy' повторяет прежнее поведение create_app (create_all, проверка индексов
+# и запросы начальных данных при каждом старте), 'current' - текущий create_app без
+# обращений к БД. Параметр --concurrent запускает несколько воркеров одновременно,
+# как gunicorn при старте или перезапуске.
+#
+#   python benchmarks/startup_time.py --runs 10
+#   python benchmarks/startup_time.py --concurrent 4 --json
+#   python benchmarks/startup_time.py --database-url sqlite:// --runs 1  # старт с базой в памяти
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+from app.bootstrap import bootstrap_database
+app = create_app()
+if sys.argv[1] == 'legacy':
+    with app.app_context():
+        bootstrap_database(log=lambda message: None)
+print(json.dumps({'seconds': time.perf_counter() - started}))
+'''
+
+MODES = ('legacy', 'current')
+
+
+def boot_workers(mode, concurrent, env):
+    started = time.perf_counter()
+    procs = [subprocess.Popen([sys.executable, '-c', CHILD, mode], cwd=ROOT, env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+             for _ in range(concurrent)]
+    timings = []
+    for proc in procs:
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f'{mode} worker failed:\n{err}')
+        timings.append(json.loads(out.strip().splitlines()[-1])['seconds'])
+    return timings, time.perf_counter() - started
+
+
+def percentile_ms(values, q):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 1)
+
+
+def run_mode(mode, runs, concurrent, env):
+    in_process, wall = [], []
+    for _ in range(runs):
+        timings, elapsed = boot_workers(mode, concurrent, env)
+        in_process.extend(timings)
+        wall.append(elapsed)
+    return {
+        'mode': mode,
+        'runs': runs,
+        'concurrent': concurrent,
+        'create_app_p50_ms': percentile_ms(in_process, 0.5),
+        'create_app_p95_ms': percentile_ms(in_process, 0.95),
+        'create_app_max_ms': percentile_ms(in_process, 1.0),
+        'all_workers_ready_p50_ms': percentile_ms(wall, 0.5),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время старта воркера до и после выноса bootstrap из create_app')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--concurrent', type=int, default=1, help='Сколько воркеров стартует одновременно')
+    parser.add_argument('--json', action='store_true', help='Вывод в формате JSON Lines')
+    parser.add_argument('--database-url', help='DATABASE_URL воркеров (по умолчанию временный файл SQLite)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=args.database_url or 'sqlite:///' + os.path.join(tmp, 'bench.db'),
+                   AUTO_BOOTSTRAP='0', VISIT_LOG_BUFFERED='0')
+        # База готовится один раз, как командой `flask bootstrap` при развертывании
+        boot_workers('legacy', 1, env)
+        for mode in args.modes.split(','):
+            result = run_mode(mode, args.runs, args.concurrent, env)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"{mode:8} create_app p50/p95/max {result['create_app_p50_ms']}/"
+                      f"{result['create_app_p95_ms']}/{result['create_app_max_ms']} ms  "
+                      f"{args.concurrent} worker(s) ready p50 {result['all_workers_ready_p50_ms']} ms")
+
+
+if __name__ == '__main__':
+    main()
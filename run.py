@@ -1,7 +1,10 @@
 # run.py
+import os
 from app import create_app
+from app.config import config_by_name
 
-app = create_app()
+# APP_CONFIG=development|production выбирает профиль БД и пула соединений
+app = create_app(config_by_name[os.environ.get('APP_CONFIG', 'default')])
 
 if __name__ == '__main__':
     app.run(debug=True)